@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Equality check of the block engine and the QGIS processing path.
+
+The SI script runs twice on a synthetic study area, with the block engine
+and with the processing tools (both with the native terrain derivatives),
+headless like the worker. For every factor the si table (<factor>_si.txt)
+and the si raster are compared, and the si map without the roads. One JSON
+line with the largest differences is appended to the results file, the exit
+code is 1 if a factor differs:
+
+    python benchmarks/compare_engines.py --size 256 --workers 2
+
+The roads are not compared: the processing path rasterizes them in
+EPSG:32648 with 30 m pixels and uses gdal:proximity, the block engine
+calculates the distances on the dgm grid, so the classes can differ along the
+class breaks. Needs QGIS with the processing framework (QGIS_PREFIX_PATH or
+--prefix).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARKS_FOLDER, '..', 'scripts'))
+sys.path.append(os.path.join(BENCHMARKS_FOLDER, '..', 'worker'))
+from landslide_engine.raster_io import RasterGrid, open_on_grid, read_window
+from landslide_engine.scripts import RASTER_NAMES
+from synthetic import generate_study_area
+
+# engine parameter of the scripts
+ENGINES = {'engine': 0, 'processing': 1}
+
+# factors whose inputs differ between the engines (see above)
+NOT_COMPARED = ['roads']
+
+# largest accepted difference of the si values (both engines write Float32)
+TOLERANCE = 1e-5
+
+
+def read_si_table(file):
+    '''
+    {class: si} of a <factor>_si.txt file ("class: si, class: si, ...")
+    '''
+    with open(file, encoding='utf8') as f:
+        text = f.read().split('WF:')[0]
+    table = {}
+    for entry in text.split(', '):
+        if ': ' in entry:
+            key, value = entry.split(': ')
+            table[key.strip()] = float(value)
+    return table
+
+
+def table_difference(first, second):
+    '''
+    largest difference of the si values of two tables, inf if the classes differ
+    '''
+    if set(first) != set(second):
+        return float('inf')
+    return max([abs(first[key] - second[key]) for key in first] or [0.0])
+
+
+def read_raster(file, grid):
+    return read_window(open_on_grid(file, grid), 0, grid.ysize)
+
+
+def raster_difference(first, second):
+    '''
+    (largest difference, pixels which are nodata in only one raster) of two arrays
+    '''
+    nodata = np.isnan(first)
+    mismatched = int(np.count_nonzero(nodata != np.isnan(second)))
+    valid = ~nodata & ~np.isnan(second)
+    return (float(np.max(np.abs(first[valid] - second[valid]))) if np.any(valid) else 0.0), mismatched
+
+
+def run_si(scripts, area, folder, engine, workers):
+    '''
+    runs the SI script headless with an engine, returns the output folder
+    '''
+    from landslide_worker import JobFeedback, run_algorithm
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    parameters = dict(area, output=folder, engine=ENGINES[engine], terrain=0, workers=workers)
+    feedback = JobFeedback()
+    try:
+        run_algorithm(scripts, 'si', parameters, feedback)
+    except Exception:
+        print('\n'.join(feedback.log))
+        raise
+    return folder
+
+
+def compare(folders, grid):
+    '''
+    differences of the si tables and rasters of the two runs per factor, and of the si map without the roads
+    '''
+    factors = {}
+    sums = []
+    for folder in folders:
+        total = np.zeros((grid.ysize, grid.xsize))
+        for name in RASTER_NAMES:
+            if name not in NOT_COMPARED:
+                total += read_raster(os.path.join(folder, 'si_value_data', 'si_values_' + name + '.tif'), grid)
+        sums.append(total)
+    for name in RASTER_NAMES:
+        if name in NOT_COMPARED:
+            continue
+        tables = [read_si_table(os.path.join(folder, name + '_si.txt')) for folder in folders]
+        rasters = [read_raster(os.path.join(folder, 'si_value_data', 'si_values_' + name + '.tif'), grid) for folder in folders]
+        difference, mismatched = raster_difference(*rasters)
+        factors[name] = {'table_difference': table_difference(*tables), 'raster_difference': difference, 'nodata_mismatch': mismatched}
+    difference, mismatched = raster_difference(*sums)
+    return factors, {'raster_difference': difference, 'nodata_mismatch': mismatched}
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Equality check of the block engine and the QGIS processing path')
+    parser.add_argument('--size', type=int, default=256, help='edge length of the study area in pixels')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the study area generator')
+    parser.add_argument('--workers', type=int, default=1, help='parallel workers of both engines')
+    parser.add_argument('--workdir', default='benchmark_data', help='folder for the study area and outputs')
+    parser.add_argument('--output', default='engine_comparison.jsonl', help='results file (one JSON line per check)')
+    parser.add_argument('--prefix', default=None, help='QGIS prefix path (default: QGIS_PREFIX_PATH or /usr)')
+    options = parser.parse_args(arguments)
+
+    from landslide_worker import start_qgis, load_scripts
+    from run_benchmarks import git_commit
+    area = generate_study_area(os.path.join(options.workdir, 'area_' + str(options.size) + '_' + str(options.seed)), options.size, options.seed)
+    grid = RasterGrid.from_path(area['dgm'])
+    application = start_qgis(options.prefix)
+    try:
+        scripts = load_scripts()
+        folders = [run_si(scripts, area, os.path.abspath(os.path.join(options.workdir, 'compare_' + engine + '_' + str(options.size))), engine, options.workers)
+                   for engine in ENGINES]
+    finally:
+        application.exitQgis()
+
+    factors, si_map = compare(folders, grid)
+    failed = sorted(name for name, record in list(factors.items()) + [('si_map', si_map)]
+                    if record.get('table_difference', 0.0) > TOLERANCE or record['raster_difference'] > TOLERANCE or record['nodata_mismatch'])
+    record = {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'size': options.size, 'seed': options.seed,
+              'workers': options.workers, 'tolerance': TOLERANCE, 'not_compared': NOT_COMPARED,
+              'factors': factors, 'si_map': si_map, 'failed': failed}
+    with open(options.output, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    for name, result in list(factors.items()) + [('si_map', si_map)]:
+        print('  {:<20}table {:>10.2e}  raster {:>10.2e}  nodata mismatch {}'.format(
+            name, result.get('table_difference', 0.0), result['raster_difference'], result['nodata_mismatch']))
+    print('engines differ: ' + ', '.join(failed) if failed else 'engines agree')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+Peak memory of the block engine at several extents.
+
+With a memory budget the strips of the block passes and the tiles of the
+catchment area are sized to the budget, so the peak memory must not grow
+with the extent of the study area. Every size runs in a new process (the
+peak resident set size of a process only grows), which reports its peak
+resident set size and the resident set size after the imports. One JSON line
+per size is appended to the results file:
+
+    python benchmarks/memory_benchmark.py --sizes 1024 2048 4096 --memory-budget 256
+
+--stage flow_accumulation measures the catchment area alone, --stage
+pipeline all stages of run_benchmarks.py. The GDAL block cache is limited
+(--gdal-cache) and counts on top of the budget. The resource module is
+needed (not available on Windows).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# peak and current resident set size in bytes (ru_maxrss is in kilobytes on Linux, in bytes on macOS)
+RSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+
+def current_rss():
+    '''
+    resident set size of this process now, the peak so far where /proc is missing
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_SCALE
+
+
+def measure(stage, area, memory_budget, gdal_cache, workdir):
+    '''
+    runs a stage on a study area in this process, returns the baseline and peak resident set size
+    '''
+    import resource
+    from osgeo import gdal
+    from run_benchmarks import run_pipeline
+    from landslide_engine.hydrology import catchment_area, MFD
+
+    gdal.SetCacheMax(gdal_cache)
+    baseline = current_rss()
+    start = time.perf_counter()
+    if stage == 'flow_accumulation':
+        catchment_area(area['dgm'], os.path.join(workdir, 'SCA.tif'), MFD, memory_budget)
+    else:
+        run_pipeline(area, workdir, 1, 256, memory_budget)
+    return {'seconds': time.perf_counter() - start, 'baseline_rss': baseline,
+            'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_SCALE}
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Peak memory of the block engine at several extents')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048], help='edge lengths of the study areas in pixels')
+    parser.add_argument('--memory-budget', type=int, default=256, help='memory budget in MB')
+    parser.add_argument('--stage', choices=['flow_accumulation', 'pipeline'], default='flow_accumulation', help='stages to measure')
+    parser.add_argument('--gdal-cache', type=int, default=64, help='GDAL block cache in MB')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the study area generator')
+    parser.add_argument('--workdir', default='benchmark_data', help='folder for the study areas and outputs')
+    parser.add_argument('--output', default='memory_results.jsonl', help='results file (one JSON line per size)')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    options = parser.parse_args(arguments)
+
+    if options.child is not None:
+        # the measurement of one study area (files as JSON), started by the parent process
+        area = json.loads(options.child)
+        result = measure(options.stage, area, options.memory_budget * 1024 * 1024, options.gdal_cache * 1024 * 1024,
+                         os.path.join(options.workdir, 'memory_' + options.stage + '_' + os.path.basename(os.path.dirname(area['dgm']))))
+        print(json.dumps(result))
+        return
+
+    from run_benchmarks import git_commit
+    from synthetic import generate_study_area
+    for size in options.sizes:
+        # the study area is generated here, the generator holds whole arrays
+        area = generate_study_area(os.path.join(options.workdir, 'area_' + str(size) + '_' + str(options.seed)), size, options.seed)
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', json.dumps(area),
+                                          '--memory-budget', str(options.memory_budget), '--stage', options.stage,
+                                          '--gdal-cache', str(options.gdal_cache), '--workdir', options.workdir])
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        record = dict(result, commit=git_commit(), timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'), size=size, seed=options.seed,
+                      stage=options.stage, memory_budget=options.memory_budget, gdal_cache=options.gdal_cache,
+                      used=result['peak_rss'] - result['baseline_rss'])
+        with open(options.output, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        print('size {}: peak {:.0f} MB, {:.0f} MB above the baseline (budget {} MB + GDAL cache {} MB), {:.2f} s'.format(
+            size, result['peak_rss'] / 2 ** 20, record['used'] / 2 ** 20, options.memory_budget, options.gdal_cache, result['seconds']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the block engine stages on synthetic study areas.
+
+Every stage of the SI, WF and ROC calculation (terrain derivatives, flow
+accumulation, road proximity, viewshed mask, classification, counts, si
+tables, reclassification, summation, WF map and ROC) is run on generated
+study areas and timed. One JSON line per size and repetition is appended to
+the results file, with the git commit, so the throughput in pixels per second
+can be compared across commits:
+
+    python benchmarks/run_benchmarks.py --sizes 512 1024 2048 --repeat 3
+
+The QGIS processing path (SAGA, clipping, zonal statistics) needs a running
+QGIS and is not timed here; compare_engines.py checks that it gives the same
+si values as the block engine.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+from osgeo import gdal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from landslide_engine.raster_io import RasterGrid
+from landslide_engine.statistics import Factor, contingency_tables
+from landslide_engine.reclassify import ReclassTable, reclassify_rasters, MIN_INCLUSIVE_MAX_INCLUSIVE
+from landslide_engine.summation import sum_rasters
+from landslide_engine.viewshed import ViewshedMask
+from landslide_engine.terrain import terrain_derivatives
+from landslide_engine.hydrology import catchment_area, wetness_indices, MFD
+from landslide_engine.proximity import proximity_raster, largest_break
+from landslide_engine.indices import factor_index_tables, total_statistical_index, weight_factors
+from landslide_engine.mapping import risk_maps
+from landslide_engine.roc import risk_histogram
+from landslide_engine.tiling import block_rows_for_budget
+from landslide_engine.scripts import TERRAIN_FACTORS, ROADS_TABLE, DGM_TABLE
+from synthetic import generate_study_area
+
+CLASSIFIED = ['precip', 'soil', 'landuse', 'lithosphere', 'waterbodies']
+SOURCE_NAMES = {'precip': 'precipation'}
+
+
+class StageTimer:
+    '''
+    Collects wall time and throughput of the stages of one run
+    '''
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.stages = []
+
+    def run(self, stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        self.stages.append({'stage': stage, 'seconds': seconds, 'pixels': self.pixels,
+                            'pixels_per_second': self.pixels / seconds if seconds > 0 else None})
+        return result
+
+
+def run_pipeline(area, folder, workers=1, block_rows=256, memory_budget=0):
+    '''
+    runs all stages of the block engine for one study area and returns the stage timings.
+    With a memory budget (bytes) the strips and the tiles of the catchment area follow the budget.
+    '''
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    grid = RasterGrid.from_path(area['dgm'])
+    timer = StageTimer(grid.pixel_count)
+    if memory_budget:
+        block_rows = block_rows_for_budget(grid, memory_budget, 15)
+
+    terrain = timer.run('terrain_derivatives', terrain_derivatives, area['dgm'], os.path.join(folder, 'terrain'), ['SLOPE', 'ASPECT', 'C_PLAN', 'C_PROF'], block_rows)
+    sca = timer.run('flow_accumulation', catchment_area, area['dgm'], os.path.join(folder, 'terrain', 'SCA.tif'), MFD, memory_budget)
+    terrain.update(timer.run('wetness_indices', wetness_indices, sca, terrain['SLOPE'], os.path.join(folder, 'terrain'), block_rows))
+    roads = timer.run('road_proximity', proximity_raster, area['roads'], grid, os.path.join(folder, 'roads_distance.tif'), largest_break(ROADS_TABLE), block_rows)
+    viewshed = timer.run('viewshed_mask', ViewshedMask.from_raster, area['viewshed'], grid, block_rows)
+
+    # the continuous factors are classified into class code rasters with the tables of the scripts (like the tiled mode)
+    continuous = [('dgm', area['dgm'], DGM_TABLE), ('roads', roads, ROADS_TABLE)] + [(name, terrain[key], table) for name, key, table in TERRAIN_FACTORS]
+    jobs = [(raster, [ReclassTable(table)], os.path.join(folder, name + '_classified.tif')) for name, raster, table in continuous]
+    classified = timer.run('classification', reclassify_rasters, jobs, grid, block_rows, workers)
+    factors = [Factor(name, file) for (name, raster, table), file in zip(continuous, classified)]
+    factors += [Factor(name, area[SOURCE_NAMES.get(name, name)]) for name in CLASSIFIED]
+
+    factor_tables, landslide_count = timer.run('counts', contingency_tables, factors, area['landslides'], grid, viewshed, block_rows, workers)
+    index_tables = timer.run('si_tables', factor_index_tables, factor_tables, landslide_count)
+
+    si_jobs = [(factor.raster, [ReclassTable(table, MIN_INCLUSIVE_MAX_INCLUSIVE)], os.path.join(folder, 'si_values_' + factor.name + '.tif'))
+               for factor, table in zip(factors, index_tables)]
+    si_rasters = timer.run('reclassification', reclassify_rasters, si_jobs, grid, block_rows, workers)
+    si_map = timer.run('summation', sum_rasters, si_rasters, os.path.join(folder, 'landslides_risk_si.tif'), grid, None, block_rows)
+
+    tsi_list = [total_statistical_index(table, factor_table.landslides_per_class()) for table, factor_table in zip(index_tables, factor_tables)]
+    wf_map = os.path.join(folder, 'landslides_risk_wf.tif')
+    timer.run('wf_map', risk_maps, factors, index_tables, [weight_factors(tsi_list)], [wf_map], grid, None, None, block_rows)
+
+    for method, risk_map in [('si', si_map), ('wf', wf_map)]:
+        histogram = timer.run('roc_' + method, risk_histogram, risk_map, area['landslides'], area['viewshed'])
+        histogram.auc()
+    return timer.stages
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the block engine on synthetic study areas')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024], help='edge lengths of the study areas in pixels')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per size')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the study area generator')
+    parser.add_argument('--workers', type=int, default=1, help='parallel workers of the block engine')
+    parser.add_argument('--block-rows', type=int, default=256, help='rows per strip')
+    parser.add_argument('--memory-budget', type=int, default=0, help='memory budget in MB (0 = none), replaces --block-rows')
+    parser.add_argument('--workdir', default='benchmark_data', help='folder for the study areas and outputs')
+    parser.add_argument('--output', default='benchmark_results.jsonl', help='results file (one JSON line per run)')
+    options = parser.parse_args(arguments)
+
+    environment = {'commit': git_commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+                   'gdal': gdal.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count()}
+    for size in options.sizes:
+        area = generate_study_area(os.path.join(options.workdir, 'area_' + str(size) + '_' + str(options.seed)), size, options.seed)
+        for repetition in range(options.repeat):
+            stages = run_pipeline(area, os.path.join(options.workdir, 'run_' + str(size)), options.workers, options.block_rows,
+                                  options.memory_budget * 1024 * 1024)
+            record = dict(environment, timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'), size=size, seed=options.seed,
+                          workers=options.workers, block_rows=options.block_rows, memory_budget=options.memory_budget,
+                          repetition=repetition,
+                          total_seconds=sum(stage['seconds'] for stage in stages), stages=stages)
+            with open(options.output, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+            print('size ' + str(size) + ', run ' + str(repetition + 1) + ': ' + str(round(record['total_seconds'], 2)) + ' s')
+            for stage in stages:
+                print('  {:<22}{:>10.3f} s{:>14.0f} px/s'.format(stage['stage'], stage['seconds'], stage['pixels_per_second'] or 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic study areas for the benchmarks.
+
+A study area of size x size pixels is generated from a seed, so the same
+seed and size always give the same rasters: a fractal dgm, classified soil,
+landuse, lithosphere, precipitation and waterbody rasters, a viewshed, road
+lines (GeoPackage) and a sparse landslide inventory on steep slopes. The
+rasters use the same data types and nodata values as the test data of the
+scripts (UTM zone 48N, 30 m pixels).
+"""
+
+import os
+import sys
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from landslide_engine.raster_io import NODATA, RasterGrid, create_raster, write_window
+
+# CRS and origin of the synthetic study areas
+EPSG = 32648
+ORIGIN = (600000.0, 1800000.0)
+CELL_SIZE = 30.0
+
+
+def fractal_noise(rng, shape, octaves=6, persistence=0.5):
+    '''
+    smooth noise between 0 and 1: sum of bilinear upsampled random grids of doubling resolution
+    '''
+    noise = np.zeros(shape)
+    amplitude = 1.0
+    for octave in range(octaves):
+        cells = 2 ** (octave + 2)
+        noise += amplitude * upsample(rng.random((cells + 1, cells + 1)), shape)
+        amplitude *= persistence
+    noise -= noise.min()
+    return noise / max(noise.max(), 1e-12)
+
+
+def upsample(coarse, shape):
+    '''
+    bilinear interpolation of a coarse grid to shape
+    '''
+    ys = np.linspace(0, coarse.shape[0] - 1, shape[0])
+    xs = np.linspace(0, coarse.shape[1] - 1, shape[1])
+    y0 = np.minimum(ys.astype(int), coarse.shape[0] - 2)
+    x0 = np.minimum(xs.astype(int), coarse.shape[1] - 2)
+    wy = (ys - y0)[:, None]
+    wx = (xs - x0)[None, :]
+    top = coarse[y0][:, x0] * (1 - wx) + coarse[y0][:, x0 + 1] * wx
+    bottom = coarse[y0 + 1][:, x0] * (1 - wx) + coarse[y0 + 1][:, x0 + 1] * wx
+    return top * (1 - wy) + bottom * wy
+
+
+def classes(noise, count):
+    '''
+    class codes 1..count with roughly equal areas
+    '''
+    breaks = np.quantile(noise, np.linspace(0, 1, count + 1)[1:-1])
+    return np.digitize(noise, breaks) + 1
+
+
+def study_area_grid(size):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    return RasterGrid((ORIGIN[0], CELL_SIZE, 0.0, ORIGIN[1], 0.0, -CELL_SIZE), size, size, srs.ExportToWkt())
+
+
+def write_array(file, grid, array, data_type, nodata=NODATA):
+    dataset = create_raster(file, grid, data_type, nodata, options=['TILED=YES'])
+    write_window(dataset, array, 0, nodata)
+    dataset = None
+    return file
+
+
+def write_roads(file, grid, rng, count):
+    '''
+    random walk road lines across the study area
+    '''
+    driver = ogr.GetDriverByName('GPKG')
+    if os.path.exists(file):
+        driver.DeleteDataSource(file)
+    source = driver.CreateDataSource(file)
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(grid.projection)
+    layer = source.CreateLayer('roads', srs, ogr.wkbLineString)
+    xmin, ymin, xmax, ymax = grid.extent
+    step = CELL_SIZE * 10
+    for road in range(count):
+        line = ogr.Geometry(ogr.wkbLineString)
+        x = rng.uniform(xmin, xmax)
+        y = rng.uniform(ymin, ymax)
+        direction = rng.uniform(0, 2 * np.pi)
+        for vertex in range(max(grid.xsize, grid.ysize) // 10):
+            line.AddPoint_2D(x, y)
+            direction += rng.normal(0, 0.3)
+            x += step * np.cos(direction)
+            y += step * np.sin(direction)
+            if not (xmin <= x <= xmax and ymin <= y <= ymax):
+                break
+        if line.GetPointCount() > 1:
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetGeometry(line)
+            layer.CreateFeature(feature)
+    source = None
+    return file
+
+
+def landslide_inventory(rng, dem, density=0.0005, patch=3):
+    '''
+    sparse landslide patches, more likely on steep slopes
+    '''
+    gradient_y, gradient_x = np.gradient(dem, CELL_SIZE)
+    steepness = np.hypot(gradient_x, gradient_y)
+    probability = density * steepness / max(steepness.mean(), 1e-12)
+    seeds = rng.random(dem.shape) < probability
+    landslides = np.zeros(dem.shape, dtype=np.uint8)
+    for row, col in zip(*np.nonzero(seeds)):
+        landslides[row:row + patch, col:col + patch] = 1
+    return landslides
+
+
+def generate_study_area(folder, size, seed=0):
+    '''
+    writes a synthetic study area of size x size pixels to folder and
+    returns the files as dictionary (keys are the parameter names of the scripts)
+    '''
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    rng = np.random.default_rng(seed)
+    grid = study_area_grid(size)
+    shape = (size, size)
+
+    # relief between 0 and ~2500 m rising to the east, like the valleys and mountains of the test data
+    dem = fractal_noise(rng, shape) * 2000.0 + np.linspace(0, 500, size)[None, :]
+    precipitation = classes(fractal_noise(rng, shape, octaves=3) + dem / 5000.0, 5)
+    files = {
+        'dgm': write_array(os.path.join(folder, 'dgm.tif'), grid, dem.astype(np.float32), gdal.GDT_Float32),
+        'soil': write_array(os.path.join(folder, 'soil.tif'), grid, classes(fractal_noise(rng, shape), 6).astype(np.int16), gdal.GDT_Int16),
+        'landuse': write_array(os.path.join(folder, 'landuse.tif'), grid, classes(fractal_noise(rng, shape), 8).astype(np.int16), gdal.GDT_Int16),
+        'lithosphere': write_array(os.path.join(folder, 'lithosphere.tif'), grid, classes(fractal_noise(rng, shape, octaves=4), 5).astype(np.int16), gdal.GDT_Int16),
+        'precipation': write_array(os.path.join(folder, 'precipation.tif'), grid, precipitation.astype(np.int16), gdal.GDT_Int16),
+        'waterbodies': write_array(os.path.join(folder, 'waterbodies.tif'), grid, (fractal_noise(rng, shape) > 0.85).astype(np.int16), gdal.GDT_Int16),
+        'viewshed': write_array(os.path.join(folder, 'viewshed.tif'), grid, (fractal_noise(rng, shape, octaves=3) > 0.3).astype(np.uint8), gdal.GDT_Byte, None),
+        'landslides': write_array(os.path.join(folder, 'landslides.tif'), grid, landslide_inventory(rng, dem), gdal.GDT_Byte, None),
+        'roads': write_roads(os.path.join(folder, 'roads.gpkg'), grid, rng, max(2, size // 128)),
+    }
+    return files
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterString)
+import os
+import sys
+import time
+
+# the engine package is located next to this script
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from landslide_engine.cache import RasterCache
+
+class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
+    """
+    Lists or invalidates the entries of the raster cache used by the
+    statistical index and weight factor scripts.
+    """
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ExampleProcessingAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm.
+        """
+        return 'landslides_cache'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name.
+        """
+        return self.tr('landslides_cache')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to.
+        """
+        return self.tr('GEO403')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to.
+        """
+        return 'geo403'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm.
+        """
+        return self.tr("This algorithm lists or invalidates the cached terrain derivatives, road distances and class code rasters. An entry is given by the beginning of its key or by its name (terrain, roads_distance, classified), without entry all entries are removed. For more information look at https://github.com/schreifab/GEO403-landslide-modelling .")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs of the algorithm.
+        """
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "cache",
+                self.tr('Cache folder'),
+                behavior=QgsProcessingParameterFile.Folder
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "action",
+                self.tr('Action'),
+                options=[self.tr('list entries'), self.tr('invalidate entries')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                "entry",
+                self.tr('Entry (key or name, empty = all)'),
+                optional=True
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        cache = RasterCache(self.parameterAsString(parameters, 'cache', context))
+        entry = self.parameterAsString(parameters, 'entry', context)
+
+        if self.parameterAsEnum(parameters, 'action', context) == 1:
+            removed = cache.invalidate(entry)
+            for key in removed:
+                feedback.pushInfo('removed '+key)
+            return {'REMOVED':len(removed)}
+
+        for key, values in cache.entries():
+            last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(values['last_used']))
+            feedback.pushInfo(key+'  '+values['name']+'  '+str(round(values['bytes']/1024.0/1024.0, 1))+' MB  last used '+last_used)
+        feedback.pushInfo('total: '+str(round(cache.size()/1024.0/1024.0, 1))+' MB')
+        return {'ENTRIES':len(cache.entries())}
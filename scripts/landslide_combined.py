@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterVectorLayer,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterBoolean,
+                       QgsProject,
+                       QgsRasterLayer,
+                       QgsApplication)
+from qgis import processing
+import os
+import sys
+
+# the engine package is located next to this script
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from landslide_engine.raster_io import RasterGrid, make_folder
+from landslide_engine.statistics import Factor, contingency_tables
+from landslide_engine.reclassify import ReclassTable
+from landslide_engine.viewshed import ViewshedMask
+from landslide_engine.tiling import block_rows_for_budget, classify_tiled
+from landslide_engine.cache import RasterCache
+from landslide_engine.proximity import proximity_raster, largest_break
+from landslide_engine.indices import factor_index_tables, total_statistical_index, weight_factors, write_index_file
+from landslide_engine.mapping import risk_maps, replace_factor, MAP_DATA_TYPE, SUM_DATA_TYPE
+from landslide_engine.roc import write_roc
+from landslide_engine.selection import SiStack, search_subsets, write_subset_table, STRATEGIES
+from landslide_engine.validation import ClassStack, cross_validate, write_cross_validation, PARTITIONS
+from landslide_engine.bootstrap import EventCounts, bootstrap, confidence_interval, write_bootstrap
+from landslide_engine.output import OutputProfile, PROFILES
+from landslide_engine.factor_stack import FactorStack, FACTOR_STACK_FILE
+from landslide_engine.inventory import InventoryManifest, inventory_pixels, update_counts, map_state
+from landslide_engine.catalog import RunStatistics
+from landslide_engine.tracing import Tracer, TRACE_FILE
+from landslide_engine.scripts import ScriptMixin, terrain_factors, TERRAIN_TABLES, ROADS_TABLE, DGM_TABLE
+
+class ExampleProcessingAlgorithm(ScriptMixin, QgsProcessingAlgorithm):
+    """
+    Statistical index map, weighting factor map and their ROC curves from
+    one prepared factor stack.
+
+    The factors are prepared and counted once, the WF method only adds the
+    tsi and weighting factor step on top of the si values. Both maps and the
+    histograms of their ROC curves are written in one pass.
+    """
+
+    # set by the worker (worker/landslide_worker.py): QGIS is already initialized and no layers are added to the project
+    headless = False
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ExampleProcessingAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm.
+        """
+        return 'landslides_combined'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name.
+        """
+        return self.tr('landslides_si_wf_roc')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to.
+        """
+        return self.tr('GEO403')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to.
+        """
+        return 'geo403'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm.
+        """
+        return self.tr("This algorithm generates the landslide risk maps of the statistical index and the weighting factor method and the ROC curves of both maps in one run. For more information look at https://github.com/schreifab/GEO403-landslide-modelling .")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm.
+        """
+        for name in ['landslides', 'dgm', 'viewshed', 'soil', 'lithosphere', 'landuse', 'waterbodies', 'precipation']:
+            self.addParameter(
+                QgsProcessingParameterRasterLayer(
+                    name,
+                    self.tr(name),
+                    None
+                )
+            )
+
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                "roads",
+                self.tr('roads')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                "output",
+                self.tr('Output folder')
+            )
+        )
+
+        # number of thresholds of the ROC curves
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "i",
+                self.tr('Iterations'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=100
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "memory_budget",
+                self.tr('Memory budget in MB for tiled processing (0 = no tiling)'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "workers",
+                self.tr('Number of parallel workers'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "cache",
+                self.tr('Cache folder (optional)'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "cache_size",
+                self.tr('Cache size in MB'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=2048
+            )
+        )
+
+        # counts, si values, tsi, wf and input hashes of every run are added to this SQLite file for comparisons between runs
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "catalog",
+                self.tr('Statistics catalog (SQLite, optional, without a file no catalog is written)'),
+                behavior=QgsProcessingParameterFile.File,
+                extension='sqlite',
+                optional=True
+            )
+        )
+
+        # slope, aspect and curvature: native numpy engine (Zevenbergen & Thorne like SAGA method 6) or saga:slopeaspectcurvature
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "terrain",
+                self.tr('Terrain derivatives'),
+                options=[self.tr('native (numpy)'), self.tr('SAGA')],
+                defaultValue=0
+            )
+        )
+
+        # flow routing of the native twi and spi: D8 or multiple flow directions (Freeman 1991)
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "flow_routing",
+                self.tr('Flow routing (catchment area of the terrain derivatives)'),
+                options=[self.tr('D8'), self.tr('multiple flow directions (MFD)')],
+                defaultValue=1
+            )
+        )
+
+        # class codes of all factors in one memory mapped file (uint8 / bit-packed bands and nodata masks)
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "factor_stack",
+                self.tr('Keep the classified factors in a compact factor stack (factor_stack.lfs)'),
+                defaultValue=False
+            )
+        )
+
+        # only the counts of added and removed landslide pixels (or of one replaced factor) are updated, if the previous run into the output folder had the same other inputs
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "incremental",
+                self.tr('Update the previous run in the output folder if only the landslides or one factor changed'),
+                defaultValue=False
+            )
+        )
+
+        # result rasters: plain GeoTIFF, tiled and compressed GeoTIFF or Cloud-Optimized GeoTIFF with internal overviews
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "output_profile",
+                self.tr('Output rasters'),
+                options=[self.tr('GeoTIFF (uncompressed)'), self.tr('compressed GeoTIFF'), self.tr('Cloud-Optimized GeoTIFF with overviews')],
+                defaultValue=0
+            )
+        )
+
+        # risk maps as int16 with scale and offset in the metadata
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "quantize",
+                self.tr('Store risk maps as int16 (scale/offset)'),
+                defaultValue=False
+            )
+        )
+
+        # factor subsets scored by the AUC of their si sum, ranked in factor_selection.csv
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "selection",
+                self.tr('Factor selection'),
+                options=[self.tr('none'), self.tr('forward selection'), self.tr('backward elimination'), self.tr('leave-one-out'), self.tr('all of them')],
+                defaultValue=0
+            )
+        )
+
+        # k-fold cross-validation of the landslide pixels, per fold and mean AUC in cross_validation.csv
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "cross_validation",
+                self.tr('Cross-validation'),
+                options=[self.tr('none'), self.tr('random folds'), self.tr('spatial block folds')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "folds",
+                self.tr('Number of cross-validation folds'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=2,
+                defaultValue=5
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "fold_block_size",
+                self.tr('Size of the spatial blocks in pixels'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=100
+            )
+        )
+
+        # landslide events resampled with replacement, confidence intervals in bootstrap.csv
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "bootstrap",
+                self.tr('Bootstrap replicates (0 = no bootstrap)'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "confidence_level",
+                self.tr('Confidence level in %'),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=1,
+                maxValue=99.9,
+                defaultValue=95
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        # all files are written to the output folder by absolute paths, the working directory is not changed
+        # (the worker runs several jobs in one process)
+        self.output = parameters["output"]
+
+        # stages and tools are traced, trace.json and a summary are written at the end
+        self.tracer = Tracer()
+        self.tracer.start('initialisation')
+
+        # init some settings
+        # the worker initializes QGIS once for all jobs
+        if not self.headless:
+            QgsApplication.setPrefixPath((parameters["output"]), True)
+            QgsApplication.initQgis()
+
+        if not os.path.exists(self.outputFile('index_values')):
+            os.makedirs(self.outputFile('index_values'))
+
+        memory_budget = self.parameterAsInt(parameters, 'memory_budget', context) * 1024 * 1024
+        workers = self.parameterAsInt(parameters, 'workers', context)
+        self.terrain_engine = self.parameterAsEnum(parameters, 'terrain', context)
+        self.flow_method = self.parameterAsEnum(parameters, 'flow_routing', context)
+        # the catchment area is calculated for the whole dgm, also when the terrain derivatives are calculated per tile,
+        # in tiles of the memory budget
+        self.dgm = self.rasterSource(parameters, 'dgm', context)
+        self.catchment_area = None
+        self.memory_budget = memory_budget
+        # the terrain derivatives stay in the output folder, the manifest of the run refers to them
+        self.terrain_folder = self.outputFile('terrain')
+        make_folder(self.terrain_folder)
+        cache = None
+        if self.parameterAsString(parameters, 'cache', context):
+            cache = RasterCache.shared(self.parameterAsString(parameters, 'cache', context), self.parameterAsInt(parameters, 'cache_size', context) * 1024 * 1024).job()
+
+        # the cached rasters stay pinned until the end of the run, also when it fails
+        try:
+            self.tracer.start('viewshed')
+            grid = RasterGrid.from_path(self.rasterSource(parameters, 'dgm', context))
+            block_rows = block_rows_for_budget(grid, memory_budget, 15)
+            viewshed_mask = ViewshedMask.from_raster(self.rasterSource(parameters, 'viewshed', context), grid, block_rows)
+            viewshed_mask.write(self.outputFile('viewshed_mask.tif'))
+            landslides = self.rasterSource(parameters, 'landslides', context)
+
+            # the manifest of the previous run is updated if only the landslide inventory or one factor input changed
+            settings = self.inventorySettings(parameters, context, memory_budget)
+            manifest = None
+            replaced = None
+            current_pixels = None
+            if self.parameterAsBool(parameters, 'incremental', context):
+                self.tracer.start('inventory update')
+                manifest, replaced, current_pixels, added, removed = self.previousRun(settings, grid, landslides, block_rows, feedback)
+                if manifest is not None:
+                    factor_list = list(manifest.factors)
+            if manifest is not None and replaced is not None:
+                # only the replaced factor is counted, the tables of the other factors stay the same
+                self.tracer.start('factor update')
+                replaced_index = manifest.factor_index({'precipation':'precip'}.get(replaced, replaced))
+                feedback.pushInfo('partial rebuild, '+replaced+' was replaced')
+                factor_list[replaced_index] = Factor(factor_list[replaced_index].name, self.rasterSource(parameters, replaced, context))
+                [replaced_table], pixel_landslide_count = contingency_tables([factor_list[replaced_index]], landslides, grid, viewshed_mask, block_rows, workers)
+                factor_tables = list(manifest.factor_tables)
+                factor_tables[replaced_index] = replaced_table
+            elif manifest is not None:
+                factor_tables, pixel_landslide_count = update_counts(manifest.factor_tables, factor_list, grid, viewshed_mask, added, removed, manifest.landslide_count, block_rows)
+            else:
+                # factor stack and class counts are shared by both methods
+                factor_list = self.prepareFactors(parameters, context, feedback, grid, cache, memory_budget, block_rows)
+                if self.parameterAsBool(parameters, 'factor_stack', context):
+                    # the factors are classified once, all later passes read the memory mapped stack instead of the rasters
+                    self.tracer.start('factor stack')
+                    stack = FactorStack.create(self.outputFile(FACTOR_STACK_FILE), factor_list, grid, block_rows)
+                    feedback.pushInfo('factor stack: '+str(round(stack.size / 1048576.0, 1))+' MB')
+                    factor_list = stack.factors()
+                self.tracer.start('counts')
+                factor_tables, pixel_landslide_count = contingency_tables(factor_list, landslides, grid, viewshed_mask, block_rows, workers)
+                if current_pixels is None:
+                    current_pixels = inventory_pixels(landslides, grid, block_rows)
+            index_tables = factor_index_tables(factor_tables, pixel_landslide_count)
+
+            self.tracer.start('index values')
+            # the weighting factor method only adds the tsi and the scaling of the si values per factor
+            tsi_list = [total_statistical_index(table, factor_table.landslides_per_class()) for table, factor_table in zip(index_tables, factor_tables)]
+            wf_list = weight_factors(tsi_list)
+            for factor, table, wf in zip(factor_list, index_tables, wf_list):
+                write_index_file(self.outputFile('index_values/'+factor.name+'_si.txt'), table, wf)
+            # the same values for the statistics catalog, written at the end of the run with the AUCs
+            inputs = dict(settings['inputs'], landslides=landslides)
+            statistics = RunStatistics('combined', self.output, dict((key, value) for key, value in settings.items() if key != 'inputs'), inputs)
+            statistics.landslide_count = pixel_landslide_count
+            for factor, table, factor_table, tsi, wf in zip(factor_list, index_tables, factor_tables, tsi_list, wf_list):
+                statistics.add_factor(factor.name, factor_table.pixel_per_class(), factor_table.landslides_per_class(), table, tsi, wf)
+
+            results = {}
+            selection = self.parameterAsEnum(parameters, 'selection', context)
+            if selection > 0:
+                self.tracer.start('factor selection')
+                results.update(self.selectFactors(factor_list, index_tables, grid, landslides, viewshed_mask, STRATEGIES if selection == 4 else [STRATEGIES[selection - 1]], memory_budget, block_rows, feedback))
+
+            cross_validation = self.parameterAsEnum(parameters, 'cross_validation', context)
+            replicates = self.parameterAsInt(parameters, 'bootstrap', context)
+            if cross_validation > 0 or replicates > 0:
+                # the class codes inside the viewshed are read once; with a memory budget they are kept in a memory mapped file
+                self.tracer.start('class stack')
+                stack_file = self.outputFile('class_stack.npy') if memory_budget > 0 else None
+                stack = ClassStack.from_factors(factor_list, grid, landslides, viewshed_mask, stack_file, block_rows)
+                if cross_validation > 0:
+                    self.tracer.start('cross-validation')
+                    results.update(self.crossValidate(stack, factor_tables, pixel_landslide_count, PARTITIONS[cross_validation - 1],
+                                                      self.parameterAsInt(parameters, 'folds', context), self.parameterAsInt(parameters, 'fold_block_size', context), feedback))
+                if replicates > 0:
+                    self.tracer.start('bootstrap')
+                    results.update(self.bootstrapIntervals(stack, factor_tables, pixel_landslide_count, replicates, self.parameterAsDouble(parameters, 'confidence_level', context) / 100.0, feedback))
+                del stack
+                if stack_file is not None:
+                    os.remove(stack_file)
+
+            self.tracer.start('risk maps')
+            # both maps and the histograms of their ROC curves in one pass, the si sum and the tsi weighted sum are kept for partial rebuilds
+            outputs = [self.outputFile('landslides_risk_si.tif'), self.outputFile('landslides_risk_wf.tif')]
+            sums = [self.outputFile('si_sum.tif'), self.outputFile('tsi_weighted_sum.tif')]
+            profile = OutputProfile(PROFILES[self.parameterAsEnum(parameters, 'output_profile', context)], self.parameterAsBool(parameters, 'quantize', context))
+            if replaced is not None:
+                # the old si values of the replaced factor are subtracted from the maps of the previous run, the new ones added
+                replaced_tables = factor_index_tables([manifest.factor_tables[replaced_index]], pixel_landslide_count)
+                replaced_tsi = total_statistical_index(replaced_tables[0], manifest.factor_tables[replaced_index].landslides_per_class())
+                histograms = replace_factor(factor_list, index_tables, tsi_list, replaced_index, manifest.factors[replaced_index], replaced_tables[0], replaced_tsi, sums, outputs, grid, landslides, viewshed_mask, block_rows, profile.creation_options())
+            else:
+                histograms = risk_maps(factor_list, index_tables, [[1.0] * len(factor_list), wf_list, [1.0] * len(factor_list), tsi_list], outputs + sums, grid, landslides, viewshed_mask, block_rows, profile.creation_options(),
+                                       [MAP_DATA_TYPE, MAP_DATA_TYPE, SUM_DATA_TYPE, SUM_DATA_TYPE])[:2]
+
+            self.tracer.start('output rasters')
+            # the histograms already have the float values, quantization and overviews only change the stored maps
+            for output in outputs:
+                profile.finish(output)
+            # the next run into this folder is compared with this one
+            InventoryManifest(settings, grid, factor_list, factor_tables, pixel_landslide_count, maps=map_state(*sums)).save(self.output, current_pixels)
+
+            self.tracer.start('roc')
+            with open(self.outputFile('auc.txt'), 'w') as f:
+                for method, output, histogram in zip(['si', 'wf'], outputs, histograms):
+                    tpr, fpr = histogram.curve(histogram.thresholds(self.parameterAsInt(parameters, 'i', context)))
+                    write_roc(self.outputFile('roc_'+method+'.txt'), tpr, fpr)
+                    auc = histogram.auc()
+                    f.write(method+': '+str(auc)+'\n')
+                    feedback.pushInfo('AUC '+method+': '+str(auc))
+                    results['AUC_'+method.upper()] = auc
+                    if not self.headless:
+                        QgsProject.instance().addMapLayer(QgsRasterLayer(output, "landslide_risk_map_"+method))
+
+            self.tracer.start('catalog')
+            catalog = self.parameterAsString(parameters, 'catalog', context)
+            if catalog:
+                statistics.write(catalog, results)
+        finally:
+            if cache is not None:
+                cache.release()
+        self.tracer.report(feedback, self.outputFile(TRACE_FILE))
+        return results
+
+    def selectFactors(self, factor_list, index_tables, grid, landslides, viewshed_mask, strategies, memory_budget, block_rows, feedback):
+        """
+        Scores factor subsets with the AUC of their si sum and writes the ranked subsets to factor_selection.csv.
+        The si values inside the viewshed are read once; with a memory budget they are kept in a memory mapped file.
+        """
+        stack_file = self.outputFile('factor_selection_stack.npy') if memory_budget > 0 else None
+        stack = SiStack.from_factors(factor_list, index_tables, grid, landslides, viewshed_mask, stack_file, block_rows)
+        ranked = search_subsets(stack, strategies)
+        write_subset_table(self.outputFile('factor_selection.csv'), ranked, stack.names)
+        del stack
+        if stack_file is not None:
+            os.remove(stack_file)
+        for subset, auc, found in ranked[:5]:
+            feedback.pushInfo('AUC '+str(round(auc, 4))+': '+', '.join(factor_list[i].name for i in subset))
+        return {'BEST_SUBSET': ' '.join(factor_list[i].name for i in ranked[0][0]), 'BEST_SUBSET_AUC': ranked[0][1]}
+
+    def crossValidate(self, stack, factor_tables, landslide_count, partition, folds, block_size, feedback):
+        """
+        k-fold cross-validation: si and wf weights without the landslide pixels of a fold, scored on the held-out pixels.
+        Writes the AUC of every fold and the mean to cross_validation.csv.
+        """
+        records = cross_validate(stack, factor_tables, landslide_count, folds, partition, block_size)
+        write_cross_validation(self.outputFile('cross_validation.csv'), records)
+        cv_results = {}
+        for method in ['si', 'wf']:
+            for record in records:
+                feedback.pushInfo('fold '+str(record['fold'])+' AUC '+method+': '+str(record['auc_'+method]))
+            cv_results['CV_AUC_'+method.upper()] = sum(record['auc_'+method] for record in records) / len(records)
+            feedback.pushInfo('mean cross-validation AUC '+method+': '+str(cv_results['CV_AUC_'+method.upper()]))
+        return cv_results
+
+    def bootstrapIntervals(self, stack, factor_tables, landslide_count, replicates, level, feedback):
+        """
+        Resamples the landslide events and writes the confidence intervals of the si values, weighting factors and AUC to bootstrap.csv.
+        """
+        counts = EventCounts(stack, factor_tables, landslide_count)
+        feedback.pushInfo(str(counts.event_count)+' landslide events, '+str(counts.unit_stable.size)+' condition units')
+        estimate, samples = bootstrap(counts, replicates)
+        write_bootstrap(self.outputFile('bootstrap.csv'), counts, estimate, samples, level)
+        bootstrap_results = {}
+        for method, values in [('si', samples[3]), ('wf', samples[4])]:
+            lower, upper = confidence_interval(values, level)
+            feedback.pushInfo('AUC '+method+' '+str(round(level * 100, 1))+'% interval: '+str(lower)+' - '+str(upper))
+            bootstrap_results['AUC_'+method.upper()+'_LOWER'] = lower
+            bootstrap_results['AUC_'+method.upper()+'_UPPER'] = upper
+        return bootstrap_results
+
+    def prepareFactors(self, parameters, context, feedback, grid, cache, memory_budget, block_rows):
+        """
+        Returns the 13 conditioning factors as list of Factors (raster and classification table).
+        """
+        dgm = self.rasterSource(parameters, 'dgm', context)
+        self.tracer.start('roads distance')
+        # roads burnt on the dgm grid, the distances are exact up to the largest class break of the roads table
+        roads_source = self.parameterAsVectorLayer(parameters, 'roads', context).source()
+        roads_distance = self.cached(cache, 'roads_proximity', [roads_source, dgm], {'MAX_DISTANCE':largest_break(ROADS_TABLE)}, lambda: {'OUTPUT':proximity_raster(roads_source, grid, self.outputFile('roads_distance.tif'), largest_break(ROADS_TABLE), block_rows)})
+
+        self.tracer.start('terrain derivatives')
+        terrain_list = terrain_factors()
+        if memory_budget > 0:
+            classification = {'terrain':self.terrainParameters(),'tables':TERRAIN_TABLES,'memory_budget':memory_budget}
+            classified = self.cached(cache, 'classified', [dgm], classification, lambda: dict((factor.name, factor.raster) for factor in classify_tiled(dgm, grid, self.terrainDerivatives, terrain_list, self.outputFile('classified'), memory_budget, feedback)))
+            terrain_list = [Factor(factor.name, classified[factor.name]) for factor in terrain_list]
+        else:
+            terrain = self.cached(cache, 'terrain', [dgm], self.terrainParameters(), lambda: self.terrainDerivatives(dgm))
+            terrain_list = terrain_factors(terrain)
+
+        return [Factor('dgm',dgm,ReclassTable(DGM_TABLE)),Factor('precip',self.rasterSource(parameters, 'precipation', context)),Factor('soil',self.rasterSource(parameters, 'soil', context)),Factor('landuse',self.rasterSource(parameters, 'landuse', context)),Factor('lithosphere',self.rasterSource(parameters, 'lithosphere', context)),Factor('waterbodies',self.rasterSource(parameters, 'waterbodies', context)),Factor('roads',roads_distance['OUTPUT'],ReclassTable(ROADS_TABLE))] + terrain_list
+
+    def inventorySettings(self, parameters, context, memory_budget):
+        """
+        Returns the inputs (except the landslides) and settings the counts of a run depend on, recorded in the inventory manifest.
+        """
+        inputs = self.inputSources(parameters, context)
+        del inputs['landslides']
+        return {'inputs':inputs,'terrain':self.terrainParameters(),'memory_budget':memory_budget,'factor_stack':self.parameterAsBool(parameters, 'factor_stack', context)}
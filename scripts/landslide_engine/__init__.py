@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+"""
+Block-wise raster engines used by the GEO403 landslide processing scripts.
+
+The scripts in the parent folder add this folder to sys.path and import the
+modules they need, e.g. ``from landslide_engine.roc import RiskHistogram``.
+"""
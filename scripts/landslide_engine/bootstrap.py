@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bootstrap confidence intervals of the si values, weighting factors and AUC.
+
+The landslide inventory is resampled by events (connected landslide patches,
+8 neighbours) instead of pixels, because the pixels of one landslide are not
+independent. Everything a replicate needs is counted once from a ClassStack:
+
+- the landslide pixels per event and class of every factor,
+- the unique condition units (pixels with the same class in every factor),
+  their non-landslide pixels and the landslide pixels per event and unit.
+  The stack is read in blocks of pixels, a unit is an int64 key of its class
+  indices and only the units which occur are kept.
+
+A replicate draws the events with replacement, the number of draws per event
+is its weight. The landslide pixels per class are the weighted event counts,
+the si values, tsi and weighting factors follow from them like in
+statistical_index_table (a class without landslide pixels in a replicate
+gets the 0.1 pseudo-count as well, the share of such replicates is reported
+since these si values depend on the arbitrary 0.1). The AUC comes from a
+histogram of the unit risks weighted with the landslide and non-landslide
+pixels, so no raster and no pixel is touched per replicate. Like the AUC of
+the scripts it is calculated on the (resampled) landslides the weights were
+fitted with, with few events the replicates are optimistic.
+"""
+
+import numpy as np
+
+from .validation import NO_CLASS
+
+# landslide pixels counted for classes without landslides (create_statistical_index_list)
+PSEUDO_COUNT = 0.1
+
+# histogram bins of the replicate AUCs (fewer than RiskHistogram, the unit risks are binned per replicate)
+AUC_BINS = 4096
+
+# values (replicates x condition units or histogram bins) of the replicates evaluated at the same time
+CHUNK_VALUES = 2 ** 22
+
+# pixels of the stack counted at the same time
+BLOCK_PIXELS = 2 ** 20
+
+
+def label_events(rows, cols):
+    '''
+    event number (0..events-1) of every landslide pixel, connected pixels (8 neighbours) form one event.
+    rows and cols are the grid positions of the landslide pixels in row-major order.
+    '''
+    count = rows.size
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+    width = int(cols.max()) + 2
+    keys = rows.astype(np.int64) * width + cols
+    first = []
+    second = []
+    for row_step, col_step in [(0, 1), (1, -1), (1, 0), (1, 1)]:
+        neighbours = keys + row_step * width + col_step
+        index = np.clip(np.searchsorted(keys, neighbours), 0, count - 1)
+        found = (keys[index] == neighbours) & (cols + col_step >= 0)
+        first.append(np.flatnonzero(found))
+        second.append(index[found])
+    first = np.concatenate(first)
+    second = np.concatenate(second)
+
+    # every pixel points to the smallest pixel of its event after hooking and pointer jumping
+    labels = np.arange(count)
+    while True:
+        previous = labels
+        low = np.minimum(labels[first], labels[second])
+        labels = labels.copy()
+        np.minimum.at(labels, first, low)
+        np.minimum.at(labels, second, low)
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            break
+    return np.unique(labels, return_inverse=True)[1].ravel()
+
+
+class EventCounts:
+    '''
+    Landslide pixels per event and class, and the condition units, of a ClassStack
+    '''
+
+    def __init__(self, stack, factor_tables, landslide_count, block_pixels=BLOCK_PIXELS):
+        self.names = stack.names
+        events = label_events(stack.landslide_rows, stack.landslide_cols)
+        self.event_count = int(events.max()) + 1 if events.size else 0
+        self.event_pixels = np.bincount(events, minlength=self.event_count)
+        # landslide pixels which are not in the stack (outside the viewshed) stay in the density
+        self.outside = landslide_count - stack.landslide_count
+
+        self.classes = []
+        self.pixels = []
+        keys = []
+        for table in factor_tables:
+            classes = table.unique_values()
+            pixel_per_class = table.pixel_per_class()
+            self.classes.append(classes)
+            self.pixels.append(np.array([pixel_per_class.get(key, 0.0) for key in classes]))
+            keys.append(np.array([int(key) for key in classes], dtype=np.int64))
+
+        # a condition unit is the int64 key sum(class index * stride) of its classes
+        self.strides = []
+        stride = 1
+        for classes in self.classes:
+            self.strides.append(stride)
+            stride *= max(len(classes), 1)
+        if stride > np.iinfo(np.int64).max:
+            raise ValueError('The classes of the {} factors have too many combinations for the condition units'.format(len(self.classes)))
+
+        # sorted unit keys and their non-landslide pixels, merged block by block
+        self.unit_keys = np.zeros(0, dtype=np.int64)
+        self.unit_stable = np.zeros(0, dtype=np.int64)
+        landslide_index = [[] for classes in self.classes]
+        landslide_keys = []
+        pixels = stack.is_landslide.size
+        for offset in range(0, pixels, block_pixels):
+            is_landslide = stack.is_landslide[offset:offset + block_pixels]
+            block_keys = np.zeros(is_landslide.size, dtype=np.int64)
+            valid = np.ones(is_landslide.size, dtype=bool)
+            for i, (factor_keys, stride) in enumerate(zip(keys, self.strides)):
+                codes = np.asarray(stack.codes[i][offset:offset + block_pixels])
+                if factor_keys.size:
+                    index = np.clip(np.searchsorted(factor_keys, codes), 0, factor_keys.size - 1)
+                    found = (codes != NO_CLASS) & (factor_keys[index] == codes)
+                else:
+                    index = np.zeros(codes.shape, dtype=np.int64)
+                    found = np.zeros(codes.shape, dtype=bool)
+                landslide_index[i].append(np.where(found, index, -1)[is_landslide])
+                block_keys += index * stride
+                valid &= found
+            landslide_keys.append(np.where(valid, block_keys, -1)[is_landslide])
+            block_units, unit_of_pixel = np.unique(block_keys[valid], return_inverse=True)
+            block_stable = np.bincount(unit_of_pixel.ravel(), weights=~is_landslide[valid], minlength=block_units.size)
+            self.merge_units(block_units, block_stable.astype(np.int64))
+
+        self.event_classes = []
+        for i, classes in enumerate(self.classes):
+            index = np.concatenate(landslide_index[i]) if landslide_index[i] else np.zeros(0, dtype=np.int64)
+            found = index >= 0
+            matrix = np.zeros((self.event_count, len(classes)), dtype=np.int64)
+            np.add.at(matrix, (events[found], index[found]), 1)
+            self.event_classes.append(matrix)
+
+        # landslide pixels per event and unit (only the pairs which occur)
+        landslide_keys = np.concatenate(landslide_keys) if landslide_keys else np.zeros(0, dtype=np.int64)
+        found = landslide_keys >= 0
+        units = self.unit_keys.size
+        landslide_units = np.searchsorted(self.unit_keys, landslide_keys[found])
+        pairs, self.pair_count = np.unique(events[found] * units + landslide_units, return_counts=True)
+        self.pair_event, self.pair_unit = np.divmod(pairs, units)
+
+    def merge_units(self, keys, stable):
+        '''
+        adds the non-landslide pixels of sorted unit keys of a block
+        '''
+        merged = np.union1d(self.unit_keys, keys)
+        counts = np.zeros(merged.size, dtype=np.int64)
+        counts[np.searchsorted(merged, self.unit_keys)] += self.unit_stable
+        counts[np.searchsorted(merged, keys)] += stable
+        self.unit_keys = merged
+        self.unit_stable = counts
+
+    def unit_classes(self, i):
+        '''
+        class index of factor i in every condition unit
+        '''
+        return (self.unit_keys // self.strides[i]) % max(len(self.classes[i]), 1)
+
+
+def weighted_auc(risk, landslide, stable, bins=AUC_BINS):
+    '''
+    histogram AUC (like RiskHistogram.auc) of every row of risk values with
+    the landslide pixels (same shape) and non-landslide pixels (one row) as weights
+    '''
+    replicates = risk.shape[0]
+    low = risk.min(axis=1, keepdims=True)
+    width = (risk.max(axis=1, keepdims=True) - low) / (bins - 1)
+    width[width == 0] = 1.0
+    index = (((risk - low) / width).astype(np.int64) + np.arange(replicates)[:, None] * bins).ravel()
+    # highest bin first, roc points start at (0, 0)
+    landslide = np.bincount(index, weights=landslide.ravel(), minlength=replicates * bins).reshape(replicates, bins)[:, ::-1]
+    stable = np.bincount(index, weights=np.broadcast_to(stable, risk.shape).ravel(), minlength=replicates * bins).reshape(replicates, bins)[:, ::-1]
+    start = np.zeros((replicates, 1))
+    tpr = np.hstack([start, np.cumsum(landslide, axis=1) / landslide.sum(axis=1, keepdims=True)])
+    fpr = np.hstack([start, np.cumsum(stable, axis=1) / stable.sum(axis=1, keepdims=True)])
+    return np.sum(np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2.0, axis=1)
+
+
+def replicate_statistics(counts, weights):
+    '''
+    si values (one array replicates x classes per factor), weighting factors
+    (replicates x factors), share of replicates without landslides per class
+    and AUC of the si and wf sum (replicates) for event weights (replicates x events)
+    '''
+    weights = np.asarray(weights, dtype=np.float64)
+    replicates = weights.shape[0]
+    landslide_count = weights @ counts.event_pixels + counts.outside
+    si_list = []
+    empty_list = []
+    tsi = np.zeros((replicates, len(counts.names)))
+    for i, (pixels, matrix) in enumerate(zip(counts.pixels, counts.event_classes)):
+        landslides = weights @ matrix
+        empty = landslides == 0
+        density = landslide_count / pixels.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            si = np.log((np.where(empty, PSEUDO_COUNT, landslides) / pixels) / density[:, None])
+        # class does not appear in the viewshed
+        si[:, pixels == 0] = 0.0
+        si_list.append(si)
+        empty_list.append(empty & (pixels > 0))
+        tsi[:, i] = np.sum(si * landslides, axis=1)
+    low = tsi.min(axis=1, keepdims=True)
+    high = tsi.max(axis=1, keepdims=True)
+    wf = (tsi - low) / (high - low) * 9 + 1
+
+    # risk of the condition units: the si values of their classes
+    units = counts.unit_stable.size
+    landslide = np.bincount((np.arange(replicates)[:, None] * units + counts.pair_unit).ravel(),
+                            weights=(weights[:, counts.pair_event] * counts.pair_count).ravel(),
+                            minlength=replicates * units).reshape(replicates, units)
+    si_risk = np.zeros((replicates, units))
+    wf_risk = np.zeros((replicates, units))
+    for i, si in enumerate(si_list):
+        unit_si = si[:, counts.unit_classes(i)]
+        si_risk += unit_si
+        wf_risk += unit_si * wf[:, i:i + 1]
+    auc_si = weighted_auc(si_risk, landslide, counts.unit_stable)
+    auc_wf = weighted_auc(wf_risk, landslide, counts.unit_stable)
+    return si_list, wf, empty_list, auc_si, auc_wf
+
+
+def bootstrap(counts, replicates=1000, seed=0):
+    '''
+    resamples the events replicates times and returns the point estimate
+    (all events once) and the replicates, each as tuple of replicate_statistics
+    '''
+    if counts.event_count == 0:
+        raise ValueError('There are no landslide pixels inside the viewshed to resample')
+    rng = np.random.default_rng(seed)
+    estimate = replicate_statistics(counts, np.ones((1, counts.event_count)))
+    chunk = max(1, CHUNK_VALUES // max(counts.unit_stable.size, AUC_BINS))
+    parts = []
+    probabilities = np.full(counts.event_count, 1.0 / counts.event_count)
+    for start in range(0, replicates, chunk):
+        size = min(chunk, replicates - start)
+        parts.append(replicate_statistics(counts, rng.multinomial(counts.event_count, probabilities, size=size)))
+    samples = (
+        [np.concatenate([part[0][i] for part in parts]) for i in range(len(counts.names))],
+        np.concatenate([part[1] for part in parts]),
+        [np.concatenate([part[2][i] for part in parts]) for i in range(len(counts.names))],
+        np.concatenate([part[3] for part in parts]),
+        np.concatenate([part[4] for part in parts]),
+    )
+    return estimate, samples
+
+
+def confidence_interval(values, level=0.95):
+    '''
+    percentile interval (lower, upper) of bootstrap values
+    '''
+    lower, upper = np.percentile(values, [(1 - level) / 2 * 100, (1 + level) / 2 * 100])
+    return float(lower), float(upper)
+
+
+def write_bootstrap(file, counts, estimate, samples, level=0.95):
+    '''
+    writes estimate, bootstrap mean and the percentile confidence interval of every si value,
+    weighting factor and AUC as csv. empty_share is the share of replicates in which the
+    class had no landslide pixels (si from the 0.1 pseudo-count).
+    '''
+    def line(kind, factor, key, point, values, empty=''):
+        lower, upper = confidence_interval(values, level)
+        return ','.join([kind, factor, key, str(float(point)), str(float(np.mean(values))),
+                         str(lower), str(upper), str(empty)]) + '\n'
+
+    si_estimate, wf_estimate, empty_estimate, auc_si_estimate, auc_wf_estimate = estimate
+    si_samples, wf_samples, empty_samples, auc_si_samples, auc_wf_samples = samples
+    with open(file, 'w', encoding='utf8') as f:
+        f.write('value,factor,class,estimate,mean,lower,upper,empty_share\n')
+        for i, name in enumerate(counts.names):
+            for j, key in enumerate(counts.classes[i]):
+                f.write(line('si', name, key, si_estimate[i][0, j], si_samples[i][:, j], float(np.mean(empty_samples[i][:, j]))))
+        for i, name in enumerate(counts.names):
+            f.write(line('wf', name, '', wf_estimate[0, i], wf_samples[:, i]))
+        f.write(line('auc_si', '', '', auc_si_estimate[0], auc_si_samples))
+        f.write(line('auc_wf', '', '', auc_wf_estimate[0], auc_wf_samples))
+    return file
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+"""
+Content-addressed raster cache.
+
+Derived rasters (terrain derivatives, road distances, class code rasters) are
+stored under a key which is the hash of the contents of their input files and
+of the processing parameters. A later run of the SI or the WF script with the
+same inputs gets the stored rasters instead of running the tools again, even
+if only the landslide inventory changed. The cache has a size cap, the least
+recently used entries are removed first.
+
+Jobs running in one process (threads of the worker) share one RasterCache per
+folder (RasterCache.shared). Every change of the index is made under a lock
+of the folder (a thread lock and an fcntl lock of index.lock, so also other
+processes like landslides_cache.py wait) after reading the index again, so no
+process overwrites the entries of another. A raster is built into a private
+folder and moved into place under the lock; if another job stored the same
+entry in the meantime, its entry is kept. The entries a run reads are pinned
+(RasterCache.job) until the run ends, eviction and invalidation skip them.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the index is guarded only between the threads of one process
+    fcntl = None
+
+from osgeo import gdal
+
+from .raster_io import open_raster
+
+# index of all entries, stored in the cache folder
+CACHE_INDEX = 'index.json'
+
+# lock file of the index, locked by every process which changes the index
+CACHE_LOCK = 'index.lock'
+
+# prefix of the folders an entry is built in, followed by the process id
+BUILD_PREFIX = '.build-'
+
+# default size cap in bytes
+DEFAULT_CACHE_SIZE = 2048 * 1024 * 1024
+
+# bytes read at once when hashing an input file
+HASH_CHUNK = 1024 * 1024
+
+# side car files which change the meaning of a file (projection, shapefile parts)
+SIDE_CAR_EXTENSIONS = ['.prj', '.shx', '.dbf', '.aux.xml']
+
+CACHE_RASTER_OPTIONS = ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+
+# caches shared by the jobs of one process, per folder
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def source_file(source):
+    '''
+    file of a QGIS layer source (without |layername=... and similar suffixes)
+    '''
+    return str(source).split('|')[0]
+
+
+def file_digest(file):
+    '''
+    sha256 of the contents of a file and its side car files
+    '''
+    digest = hashlib.sha256()
+    files = [file] + [os.path.splitext(file)[0] + extension for extension in SIDE_CAR_EXTENSIONS]
+    for path in files:
+        if path != file and not os.path.exists(path):
+            continue
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def process_alive(pid):
+    '''
+    False if no process with the id runs (on Windows all processes are taken as running)
+    '''
+    if pid == os.getpid() or os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RasterCache:
+    '''
+    Cache folder with one sub folder per entry and an index (index.json)
+    '''
+
+    def __init__(self, folder, max_bytes=DEFAULT_CACHE_SIZE):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        # nesting depth of _locked() and the open lock file while it is held
+        self.depth = 0
+        self.lock_file = None
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.index = self._load_index()
+
+    @classmethod
+    def shared(cls, folder, max_bytes=DEFAULT_CACHE_SIZE):
+        '''
+        the cache of a folder shared by all jobs of this process (the size cap of the last call is used)
+        '''
+        with _shared_lock:
+            cache = _shared.get(os.path.abspath(folder))
+            if cache is None:
+                cache = cls(folder, max_bytes)
+                _shared[os.path.abspath(folder)] = cache
+            cache.max_bytes = max_bytes
+            return cache
+
+    def job(self):
+        '''
+        view of the cache for one run, its entries stay pinned until CacheJob.release()
+        '''
+        return CacheJob(self)
+
+    def _load_index(self):
+        file = os.path.join(self.folder, CACHE_INDEX)
+        if not os.path.exists(file):
+            return {'entries': {}, 'digests': {}}
+        with open(file) as f:
+            return json.load(f)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        '''
+        holds the lock of the cache folder and reads the index again when it is taken,
+        so _save_index() keeps the changes of other processes
+        '''
+        with self.lock:
+            if self.depth == 0:
+                self.lock_file = open(os.path.join(self.folder, CACHE_LOCK), 'a')
+                if fcntl is not None:
+                    fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+                self.index = self._load_index()
+            self.depth += 1
+            try:
+                yield
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    # closing the file releases the fcntl lock
+                    self.lock_file.close()
+                    self.lock_file = None
+
+    def _save_index(self):
+        # called only under _locked(), the index was read again when the lock was taken
+        file = os.path.join(self.folder, CACHE_INDEX)
+        # write a new file and replace the old one, so a crash never leaves half an index
+        with open(file + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(file + '.tmp', file)
+
+    def digest(self, source):
+        '''
+        content hash of an input file. The hash is remembered with size and
+        modification time of the file, so unchanged inputs are hashed only once.
+        '''
+        file = os.path.abspath(source_file(source))
+        stat = os.stat(file)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        with self._locked():
+            known = self.index['digests'].get(file)
+            if known is not None and known['stamp'] == stamp:
+                return known['digest']
+        # hashed without the lock, a large input does not stop the other jobs
+        digest = file_digest(file)
+        with self._locked():
+            self.index['digests'][file] = {'stamp': stamp, 'digest': digest}
+            self._save_index()
+        return digest
+
+    def key(self, name, inputs, parameters):
+        '''
+        cache key of a derived product: its name, the contents of the input files and the parameters
+        '''
+        description = {'name': name,
+                       'inputs': [self.digest(source) for source in inputs],
+                       'parameters': parameters}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _files(self, key):
+        '''
+        {name: file} dictionary of an entry of the index, None if the entry or one of its files is missing
+        '''
+        entry = self.index['entries'].get(key)
+        if entry is None:
+            return None
+        files = dict((name, os.path.join(self.folder, key, file)) for name, file in entry['files'].items())
+        if not all(os.path.exists(file) for file in files.values()):
+            return None
+        return files
+
+    def _pin(self, key):
+        pins = self.index['entries'][key].setdefault('pins', {})
+        pid = str(os.getpid())
+        pins[pid] = pins.get(pid, 0) + 1
+
+    def pinned(self, key):
+        '''
+        True if a running process reads the entry (pins of processes which ended are ignored)
+        '''
+        entry = self.index['entries'].get(key)
+        return entry is not None and any(process_alive(int(pid)) for pid in entry.get('pins', {}))
+
+    def release(self, key):
+        '''
+        releases one pin of this process on an entry, it can be evicted again when no run reads it
+        '''
+        with self._locked():
+            entry = self.index['entries'].get(key)
+            if entry is None:
+                return
+            pins = entry.get('pins', {})
+            pid = str(os.getpid())
+            if pins.get(pid, 0) > 1:
+                pins[pid] -= 1
+            else:
+                pins.pop(pid, None)
+            if not pins:
+                entry.pop('pins', None)
+            self._save_index()
+
+    def get(self, key, pin=False):
+        '''
+        {name: file} dictionary of a cached entry or None; a pinned entry is
+        not evicted or invalidated until it is released
+        '''
+        with self._locked():
+            files = self._files(key)
+            if files is None:
+                if key in self.index['entries']:
+                    # files were deleted outside of the cache
+                    self.remove(key)
+                return None
+            self.index['entries'][key]['last_used'] = time.time()
+            if pin:
+                self._pin(key)
+            self._save_index()
+            return files
+
+    def put(self, key, name, files, pin=False):
+        '''
+        copies the rasters of a {name: file} dictionary into the cache and returns the cached files.
+        If another job stored the entry in the meantime, its files are returned and the copy is deleted.
+        '''
+        # copied into a private folder without the lock and moved into place under it,
+        # so no job sees a half written entry
+        building = tempfile.mkdtemp(prefix=BUILD_PREFIX + str(os.getpid()) + '-', dir=self.folder)
+        try:
+            stored = {}
+            size = 0
+            for raster_name, file in files.items():
+                stored[raster_name] = raster_name + '.tif'
+                target = os.path.join(building, stored[raster_name])
+                # SAGA and temporary outputs are converted to tiled and compressed GeoTIFFs
+                gdal.Translate(target, open_raster(file), format='GTiff', creationOptions=CACHE_RASTER_OPTIONS)
+                size += os.path.getsize(target)
+            with self._locked():
+                cached = self._files(key)
+                now = time.time()
+                if cached is None:
+                    entry_folder = os.path.join(self.folder, key)
+                    if os.path.exists(entry_folder):
+                        # an entry whose files were deleted, or left by a crash before the index was saved
+                        shutil.rmtree(entry_folder)
+                    os.replace(building, entry_folder)
+                    building = None
+                    self.index['entries'][key] = {'name': name, 'files': stored, 'bytes': size, 'created': now, 'last_used': now}
+                    cached = dict((raster_name, os.path.join(entry_folder, file)) for raster_name, file in stored.items())
+                else:
+                    self.index['entries'][key]['last_used'] = now
+                if pin:
+                    self._pin(key)
+                self.evict(keep=key)
+                self._save_index()
+                return cached
+        finally:
+            if building is not None:
+                shutil.rmtree(building, ignore_errors=True)
+
+    def cached(self, name, inputs, parameters, build, pins=None):
+        '''
+        returns the cached {name: file} dictionary for the inputs and parameters,
+        or calls build() and stores its result. With a pins list the entry is
+        pinned and its key appended to the list.
+        '''
+        key = self.key(name, inputs, parameters)
+        files = self.get(key, pins is not None)
+        if files is None:
+            # built without the lock, other jobs can use the cache in the meantime
+            files = self.put(key, name, build(), pins is not None)
+        if pins is not None:
+            pins.append(key)
+        return files
+
+    def size(self):
+        '''
+        bytes of all entries
+        '''
+        return sum(entry['bytes'] for entry in self.index['entries'].values())
+
+    def evict(self, keep=None):
+        '''
+        removes the least recently used entries until the cache fits into the size cap,
+        pinned entries are kept
+        '''
+        removed = []
+        with self._locked():
+            entries = sorted(self.index['entries'].items(), key=lambda item: item[1]['last_used'])
+            for key, entry in entries:
+                if self.size() <= self.max_bytes:
+                    break
+                if key != keep and self.remove(key):
+                    removed.append(key)
+        return removed
+
+    def remove(self, key):
+        '''
+        removes an entry unless it is pinned, returns True if it was removed
+        '''
+        with self._locked():
+            if self.pinned(key):
+                return False
+            entry_folder = os.path.join(self.folder, key)
+            if os.path.exists(entry_folder):
+                shutil.rmtree(entry_folder)
+            self.index['entries'].pop(key, None)
+            self._save_index()
+            return True
+
+    def entries(self):
+        '''
+        list of (key, entry) tuples, most recently used first
+        '''
+        with self._locked():
+            return sorted(self.index['entries'].items(), key=lambda item: item[1]['last_used'], reverse=True)
+
+    def invalidate(self, pattern=''):
+        '''
+        removes all entries whose key starts with pattern or whose name equals pattern
+        (all entries for an empty pattern) and returns the removed keys; entries
+        pinned by a running job are kept
+        '''
+        with self._locked():
+            keys = [key for key, entry in self.index['entries'].items()
+                    if not pattern or key.startswith(pattern) or entry['name'] == pattern]
+            removed = [key for key in keys if self.remove(key)]
+            if not pattern:
+                self.index['digests'] = {}
+                # build folders of processes which ended
+                for folder in os.listdir(self.folder):
+                    if folder.startswith(BUILD_PREFIX) and not process_alive(int(folder[len(BUILD_PREFIX):].split('-')[0])):
+                        shutil.rmtree(os.path.join(self.folder, folder), ignore_errors=True)
+                self._save_index()
+            return removed
+
+
+class CacheJob:
+    '''
+    The entries of a RasterCache read by one run. They are pinned until
+    release() is called at the end of the run, so other jobs do not evict
+    or invalidate them while the run reads their files.
+    '''
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.keys = []
+
+    def cached(self, name, inputs, parameters, build):
+        '''
+        RasterCache.cached() with the entry pinned for this run
+        '''
+        return self.cache.cached(name, inputs, parameters, build, self.keys)
+
+    def release(self):
+        '''
+        releases the pins of the run
+        '''
+        keys, self.keys = self.keys, []
+        for key in keys:
+            self.cache.release(key)
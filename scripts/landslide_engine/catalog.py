@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""
+Statistics catalog: the class counts, si values and weights of all runs in one SQLite file.
+
+The scripts write the statistics of a run as text files (<factor>_si.txt, the
+zonal statistics csv files), which are hard to compare between runs. Every
+run additionally adds one record to the catalog, in one transaction at the
+end of the run:
+
+    runs       run_id, algorithm, time, output folder, landslide pixels, settings and results (json)
+    inputs     run_id, input name, file, sha256 of the file contents
+    factors    run_id, factor, tsi, wf
+    classes    run_id, factor, class, pixels, landslide pixels, si
+
+The tables are indexed by factor and class, so a comparison of runs (e.g. the
+si values of one factor in all runs with the same dgm) is a single query and
+no raster is read again. The hashes of the input files are remembered with
+size and modification time (digests), unchanged inputs are hashed only once.
+Several jobs may write to the same catalog, SQLite serializes the transactions.
+The catalog is optional: runs without a catalog file write none and hash
+no inputs.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from .cache import source_file, file_digest
+
+# file name of a catalog in a folder
+CATALOG_FILE = 'statistics.sqlite'
+
+# seconds a writer waits for the lock of another job
+TIMEOUT = 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    algorithm TEXT NOT NULL,
+    created REAL NOT NULL,
+    output TEXT,
+    landslide_count INTEGER,
+    settings TEXT,
+    results TEXT
+);
+CREATE TABLE IF NOT EXISTS inputs (
+    run_id TEXT NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    file TEXT,
+    digest TEXT,
+    PRIMARY KEY (run_id, name)
+);
+CREATE TABLE IF NOT EXISTS factors (
+    run_id TEXT NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    factor TEXT NOT NULL,
+    tsi REAL,
+    wf REAL,
+    PRIMARY KEY (run_id, factor)
+);
+CREATE TABLE IF NOT EXISTS classes (
+    run_id TEXT NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    factor TEXT NOT NULL,
+    class TEXT NOT NULL,
+    pixels INTEGER NOT NULL,
+    landslides INTEGER NOT NULL,
+    si REAL,
+    PRIMARY KEY (run_id, factor, class)
+);
+CREATE INDEX IF NOT EXISTS classes_factor ON classes (factor, class);
+CREATE INDEX IF NOT EXISTS inputs_digest ON inputs (name, digest);
+CREATE TABLE IF NOT EXISTS digests (
+    file TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+'''
+
+
+def connect(file):
+    '''
+    opens (and creates) a catalog
+    '''
+    folder = os.path.dirname(os.path.abspath(file))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    connection = sqlite3.connect(file, timeout=TIMEOUT)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def input_digest(connection, source):
+    '''
+    sha256 of an input file, taken from the digests table if size and modification time are unchanged
+    '''
+    file = os.path.abspath(source_file(source))
+    if not os.path.exists(file):
+        return None
+    stat = os.stat(file)
+    known = connection.execute('SELECT digest FROM digests WHERE file = ? AND size = ? AND mtime_ns = ?',
+                               (file, stat.st_size, stat.st_mtime_ns)).fetchone()
+    if known is not None:
+        return known[0]
+    digest = file_digest(file)
+    connection.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)', (file, stat.st_size, stat.st_mtime_ns, digest))
+    return digest
+
+
+class RunStatistics:
+    '''
+    Statistics of one run, collected while the run goes on and written at its end
+    '''
+
+    def __init__(self, algorithm, output=None, settings=None, inputs=None):
+        self.run_id = uuid.uuid4().hex
+        self.algorithm = algorithm
+        self.created = time.time()
+        self.output = output
+        self.settings = settings or {}
+        # {input name: layer source}
+        self.inputs = inputs or {}
+        self.landslide_count = None
+        self.factors = []
+
+    def add_factor(self, name, pixel_per_class, landslides_per_class, table, tsi=None, wf=None):
+        '''
+        adds the counts ({class: pixels}) and the si table (flat ['min','max','value',...]) of a factor
+        '''
+        si = dict((table[i], float(table[i + 2])) for i in range(0, len(table), 3))
+        classes = sorted(set(pixel_per_class) | set(si), key=str)
+        rows = [(str(key), int(round(float(pixel_per_class.get(key, 0)))),
+                 int(round(float(landslides_per_class.get(key, 0)))), si.get(key)) for key in classes]
+        self.factors.append({'name': name, 'tsi': tsi, 'wf': wf, 'classes': rows})
+
+    def set_weight(self, name, wf):
+        for factor in self.factors:
+            if factor['name'] == name:
+                factor['wf'] = wf
+
+    def write(self, file, results=None):
+        '''
+        adds the run to the catalog file in one transaction and returns its run id
+        '''
+        connection = connect(file)
+        try:
+            with connection:
+                # the digests are part of the transaction, a run is only visible when it is complete
+                digests = [(name, source, input_digest(connection, source)) for name, source in sorted(self.inputs.items())]
+                connection.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   (self.run_id, self.algorithm, self.created, self.output,
+                                    None if self.landslide_count is None else int(round(float(self.landslide_count))),
+                                    json.dumps(self.settings, sort_keys=True, default=str),
+                                    json.dumps(results or {}, sort_keys=True, default=str)))
+                connection.executemany('INSERT INTO inputs VALUES (?, ?, ?, ?)',
+                                       [(self.run_id, name, str(source), digest) for name, source, digest in digests])
+                connection.executemany('INSERT INTO factors VALUES (?, ?, ?, ?)',
+                                       [(self.run_id, factor['name'], factor['tsi'], factor['wf']) for factor in self.factors])
+                connection.executemany('INSERT INTO classes VALUES (?, ?, ?, ?, ?, ?)',
+                                       [(self.run_id, factor['name']) + row for factor in self.factors for row in factor['classes']])
+        finally:
+            connection.close()
+        return self.run_id
+
+
+def runs(file, algorithm=None):
+    '''
+    (run_id, algorithm, created, output, landslide_count) of all runs, oldest first
+    '''
+    connection = connect(file)
+    try:
+        query = 'SELECT run_id, algorithm, created, output, landslide_count FROM runs'
+        if algorithm is not None:
+            return connection.execute(query + ' WHERE algorithm = ? ORDER BY created', (algorithm,)).fetchall()
+        return connection.execute(query + ' ORDER BY created').fetchall()
+    finally:
+        connection.close()
+
+
+def compare_runs(file, run_a, run_b):
+    '''
+    (factor, class, si of run_a, si of run_b, landslides of run_a, landslides of run_b) of all classes
+    of both runs, None where a class is missing in one of them
+    '''
+    connection = connect(file)
+    try:
+        return connection.execute('''
+            SELECT keys.factor, keys.class, a.si, b.si, a.landslides, b.landslides
+            FROM (SELECT factor, class FROM classes WHERE run_id IN (?, ?) GROUP BY factor, class) AS keys
+            LEFT JOIN classes AS a ON a.run_id = ? AND a.factor = keys.factor AND a.class = keys.class
+            LEFT JOIN classes AS b ON b.run_id = ? AND b.factor = keys.factor AND b.class = keys.class
+            ORDER BY keys.factor, keys.class''', (run_a, run_b, run_a, run_b)).fetchall()
+    finally:
+        connection.close()
+
+
+def factor_history(file, factor):
+    '''
+    (run_id, created, class, pixels, landslides, si) of a factor in all runs, oldest run first
+    '''
+    connection = connect(file)
+    try:
+        return connection.execute('''
+            SELECT runs.run_id, runs.created, class, pixels, landslides, si
+            FROM classes JOIN runs ON runs.run_id = classes.run_id
+            WHERE factor = ? ORDER BY runs.created, class''', (factor,)).fetchall()
+    finally:
+        connection.close()
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compact factor stack: the class codes of all factors in one memory mapped file.
+
+The classified factors hold a few small class codes but are stored and read
+as Float32 rasters (4 bytes per pixel, GDAL decoding per block). The factor
+stack stores every factor as one band of class indices on the dgm grid:
+
+- uint8 (one byte per pixel, up to 256 classes per factor), the class code of
+  an index is kept in the header,
+- bit-packed (one bit per pixel) for binary factors, e.g. the curvature sign,
+- a bit-packed nodata mask per factor (1 = nodata).
+
+File layout: magic, offset and length of the JSON header (at the end of the
+file), then the bands, each aligned to 4096 bytes. The bands are opened as
+numpy memory maps, a strip of rows is a view into the file, so counting,
+si reclassification and the risk maps read the page cache without copies or
+GDAL. For 13 factors the stack needs about 14.6 bytes per pixel instead of 52.
+
+A stack is written once from the prepared Factors with FactorStack.create and
+read through StackFactors, which behave like Factors in all block engines.
+"""
+
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .raster_io import DEFAULT_BLOCK_ROWS, RasterGrid
+from .reclassify import ReclassTable
+from .statistics import Factor
+
+# default file name in the output folder
+FACTOR_STACK_FILE = 'factor_stack.lfs'
+
+FILE_MAGIC = b'LSFSTACK'
+# magic, header offset, header length
+PREAMBLE = struct.Struct('<8sQQ')
+ALIGNMENT = 4096
+VERSION = 1
+
+# bits per pixel of the class index bands
+BYTE = 8
+BIT = 1
+
+# factor stacks kept open (memory mapped) per process
+MAX_OPEN_STACKS = 4
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def packed_width(xsize):
+    return (xsize + 7) // 8
+
+
+class CodeMap:
+    '''
+    class code -> index of one factor, new codes get the next free index
+    '''
+
+    def __init__(self, codes=(), limit=256):
+        self.codes = [int(code) for code in codes]
+        self.limit = limit
+
+    def indices(self, codes):
+        '''
+        index of every code of an integer array (codes seen for the first time are added)
+        '''
+        unique, inverse = np.unique(codes, return_inverse=True)
+        known = dict((code, index) for index, code in enumerate(self.codes))
+        lookup = np.empty(unique.size, dtype=np.uint8)
+        for i, code in enumerate(unique.tolist()):
+            if code not in known:
+                if len(self.codes) >= self.limit:
+                    raise ValueError('A factor with more than {} classes does not fit into the factor stack'.format(self.limit))
+                known[code] = len(self.codes)
+                self.codes.append(code)
+            lookup[i] = known[code]
+        return lookup[inverse.ravel()].reshape(codes.shape)
+
+
+def factor_bits(factor):
+    '''
+    bits per pixel of a factor: one bit if its ReclassTable maps every value to one of two classes
+    '''
+    if isinstance(factor.table, ReclassTable):
+        values = factor.table.output_values()
+        if values is not None and len(values) <= 2 and all(value == int(value) for value in values):
+            return BIT, [int(value) for value in values]
+    return BYTE, []
+
+
+class FactorStack:
+    '''
+    Memory mapped stack of class index bands and nodata masks
+    '''
+
+    def __init__(self, file, header, mode='r'):
+        self.file = file
+        self.header = header
+        self.mode = mode
+        self.grid = RasterGrid(header['grid']['geotransform'], header['grid']['xsize'],
+                               header['grid']['ysize'], header['grid']['projection'])
+        self.names = [band['name'] for band in header['factors']]
+        self.bits = [band['bits'] for band in header['factors']]
+        self.codes = [np.array(band['codes'], dtype=np.int64) for band in header['factors']]
+        self.lock = threading.Lock()
+        self.maps = None
+
+    def _map(self):
+        '''
+        (bands, masks) memory maps of the file, mapped again after close
+        '''
+        with self.lock:
+            if self.maps is None:
+                bands = []
+                masks = []
+                packed = (self.grid.ysize, packed_width(self.grid.xsize))
+                for band in self.header['factors']:
+                    shape = (self.grid.ysize, self.grid.xsize) if band['bits'] == BYTE else packed
+                    bands.append(np.memmap(self.file, dtype=np.uint8, mode=self.mode, offset=band['data'], shape=shape))
+                    masks.append(np.memmap(self.file, dtype=np.uint8, mode=self.mode, offset=band['nodata'], shape=packed))
+                self.maps = (bands, masks)
+            return self.maps
+
+    @property
+    def bands(self):
+        return self._map()[0]
+
+    @property
+    def masks(self):
+        return self._map()[1]
+
+    def close(self):
+        '''
+        releases the memory maps, they are unmapped when no strip read from them is used any more.
+        A stack which is read again is mapped again.
+        '''
+        with self.lock:
+            self.maps = None
+
+    @classmethod
+    def open(cls, file):
+        with open(file, 'rb') as f:
+            magic, offset, length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != FILE_MAGIC:
+                raise IOError(str(file) + ' is not a factor stack')
+            f.seek(offset)
+            header = json.loads(f.read(length).decode('utf8'))
+        if header.get('version') != VERSION:
+            raise IOError('Unsupported factor stack version ' + str(header.get('version')))
+        return cls(file, header)
+
+    @classmethod
+    def create(cls, file, factors, grid, block_rows=DEFAULT_BLOCK_ROWS):
+        '''
+        writes the class codes of the factors (read on the grid) into a new stack file and returns it opened for reading
+        '''
+        packed_size = grid.ysize * packed_width(grid.xsize)
+        bands = []
+        maps = []
+        offset = _aligned(PREAMBLE.size)
+        for factor in factors:
+            bits, codes = factor_bits(factor)
+            size = grid.ysize * grid.xsize if bits == BYTE else packed_size
+            bands.append({'name': factor.name, 'bits': bits, 'codes': codes, 'data': offset, 'nodata': _aligned(offset + size)})
+            maps.append(CodeMap(codes, 256 if bits == BYTE else 2))
+            offset = _aligned(bands[-1]['nodata'] + packed_size)
+        header = {'version': VERSION, 'factors': bands,
+                  'grid': {'geotransform': list(grid.geotransform), 'xsize': grid.xsize,
+                           'ysize': grid.ysize, 'projection': grid.projection}}
+
+        with open(file, 'wb') as f:
+            f.truncate(offset)
+        stack = cls(file, header, mode='r+')
+        datasets = [factor.open(grid) for factor in factors]
+        for row_off, rows in grid.windows(block_rows):
+            for i, (factor, dataset, code_map) in enumerate(zip(factors, datasets, maps)):
+                codes, valid = factor.read_codes(dataset, row_off, rows)
+                indices = np.zeros(codes.shape, dtype=np.uint8)
+                indices[valid] = code_map.indices(codes[valid])
+                if bands[i]['bits'] == BYTE:
+                    stack.bands[i][row_off:row_off + rows] = indices
+                else:
+                    stack.bands[i][row_off:row_off + rows] = np.packbits(indices, axis=1)
+                stack.masks[i][row_off:row_off + rows] = np.packbits(~valid, axis=1)
+        for band, code_map in zip(bands, maps):
+            band['codes'] = code_map.codes
+        for band in stack.bands + stack.masks:
+            band.flush()
+        stack = None
+
+        data = json.dumps(header).encode('utf8')
+        with open(file, 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+            f.seek(0)
+            f.write(PREAMBLE.pack(FILE_MAGIC, offset, len(data)))
+        return cls.open(file)
+
+    def indices(self, i, row_off, rows):
+        '''
+        class indices of factor i for a strip of rows (a view into the file for uint8 bands)
+        '''
+        band = self.bands[i][row_off:row_off + rows]
+        if self.bits[i] == BYTE:
+            return band
+        return np.unpackbits(band, axis=1, count=self.grid.xsize)
+
+    def nodata(self, i, row_off, rows):
+        '''
+        nodata mask of factor i for a strip of rows
+        '''
+        return np.unpackbits(self.masks[i][row_off:row_off + rows], axis=1, count=self.grid.xsize).astype(bool)
+
+    def factors(self):
+        '''
+        StackFactors of all bands, to be used instead of the Factors the stack was written from
+        '''
+        return [StackFactor(name, self.file, i) for i, name in enumerate(self.names)]
+
+    @property
+    def size(self):
+        return os.path.getsize(self.file)
+
+
+# stacks opened in this process, the least recently used ones are closed
+_open_stacks = OrderedDict()
+_open_stacks_lock = threading.Lock()
+
+
+def open_stack(file):
+    '''
+    opens a factor stack once per process (again if the file was rewritten). At most
+    MAX_OPEN_STACKS stacks stay open, a stack closed in between is mapped again when it is read.
+    '''
+    status = os.stat(file)
+    path = os.path.abspath(file)
+    key = (path, status.st_mtime_ns, status.st_size)
+    with _open_stacks_lock:
+        stack = _open_stacks.pop(key, None)
+        if stack is None:
+            stack = FactorStack.open(file)
+            # a rewritten file replaces the stack of its previous version
+            for old in [old for old in _open_stacks if old[0] == path]:
+                _open_stacks.pop(old).close()
+        _open_stacks[key] = stack
+        while len(_open_stacks) > MAX_OPEN_STACKS:
+            _open_stacks.popitem(last=False)[1].close()
+    return stack
+
+
+class StackFactor(Factor):
+    '''
+    Factor read from band index of a factor stack file. It only keeps the file
+    name, so it can be passed to worker processes.
+    '''
+
+    def __init__(self, name, raster, index):
+        super().__init__(name, raster)
+        self.index = index
+
+    def open(self, grid):
+        stack = open_stack(self.raster)
+        if stack.grid.geotransform != grid.geotransform or stack.grid.xsize != grid.xsize or stack.grid.ysize != grid.ysize:
+            raise ValueError('The factor stack ' + str(self.raster) + ' was written on another grid')
+        return stack
+
+    def read(self, dataset, row_off, rows):
+        codes, valid = self.read_codes(dataset, row_off, rows)
+        values = codes.astype(np.float64)
+        values[~valid] = np.nan
+        return values
+
+    def read_codes(self, dataset, row_off, rows):
+        codes = dataset.codes[self.index]
+        if codes.size == 0:
+            return np.zeros((rows, dataset.grid.xsize), dtype=np.int64), np.zeros((rows, dataset.grid.xsize), dtype=bool)
+        return codes[dataset.indices(self.index, row_off, rows)], ~dataset.nodata(self.index, row_off, rows)
+
+    def read_values(self, dataset, row_off, rows, table):
+        # the table is applied to the class codes of the band once, the strip is a lookup by index
+        codes = dataset.codes[self.index]
+        lookup = np.append(table.apply(codes.astype(np.float64)), np.nan)
+        indices = dataset.indices(self.index, row_off, rows)
+        # nodata pixels point to the nan entry behind the classes
+        indices = np.where(dataset.nodata(self.index, row_off, rows), codes.size, indices)
+        return lookup[indices]
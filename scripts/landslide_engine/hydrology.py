@@ -0,0 +1,695 @@
+# -*- coding: utf-8 -*-
+
+"""
+Native flow routing, topographic wetness index and stream power index.
+
+The specific catchment area (upslope area per unit contour width) replaces
+the dgm that was given as AREA to the SAGA tools. It is calculated in square
+tiles with a halo of one cell (two for the accumulation), so the memory use follows the memory budget
+and not the extent of the dgm (without budget the dgm is one tile):
+
+1. Depressions are filled with the parallel priority-flood of Barnes et al.
+   (2016). Every tile is flooded from its border cells, which start with a
+   label each (cells next to nodata or the dgm border drain to the outlet
+   label). Where two labels meet inside a tile, and between the border cells
+   of neighbouring tiles, the spill elevation is recorded. The graph of labels
+   and spill elevations (a few labels per border cell) is solved once, the
+   filled elevation of a cell is the larger of its elevation in the tile and
+   the spill elevation of its label.
+2. Flats, also the filled depressions, drain towards their lower edge. Every
+   flat cell gets its distance (in cells) to the nearest cell of the same
+   elevation with a lower neighbour. The distances are calculated per tile and
+   passed over the tile borders until they do not change any more.
+3. Flow is routed with D8 or with multiple flow directions (Freeman 1991), on
+   flats towards the smaller distance, and accumulated per tile in topological
+   order (waves of cells whose donors are done, vectorised with numpy). The
+   flow leaving a tile is passed to its neighbour, where the cells waiting for
+   it go on; the tile receiving the highest flow is next. Every cell is done
+   once, the tiles which wait for flow are kept in memory (a few) or in
+   temporary rasters.
+
+The filled dgm, the labels, the flat distances and the accumulation state
+are kept in temporary rasters in the scratch folder (default: the folder of
+the catchment area).
+
+The priority-flood is a loop in Python over the cells (a heap operation per
+cell, about 2 to 4 microseconds each), only the accumulation is vectorised.
+All three steps together take about 5 to 7 microseconds per cell on one core,
+so a dgm of 10^9 cells (e.g. 30 000 x 30 000 pixels) needs one and a half to
+two hours; the memory budget limits the memory, not the time.
+"""
+
+import heapq
+import math
+import os
+from array import array
+from collections import OrderedDict, deque
+
+import numpy as np
+from osgeo import gdal
+
+from .raster_io import (RasterGrid, DEFAULT_BLOCK_ROWS, open_raster, open_on_grid,
+                        read_window, read_block, create_raster, write_window, delete_raster, make_folder)
+from .tiling import Tile, tile_size_for_budget
+
+# flow routing methods
+D8 = 0
+MFD = 1
+
+# exponent of the multiple flow direction method (Freeman 1991)
+MFD_EXPONENT = 1.1
+
+# smallest tan(slope) used for the TWI and SPI, flat cells would give infinite values
+MIN_TAN_SLOPE = 0.001
+
+# neighbour rows, columns and distances (in cells): N, NE, E, SE, S, SW, W, NW
+NEIGHBOURS = [(-1, 0, 1.0), (-1, 1, math.sqrt(2)), (0, 1, 1.0), (1, 1, math.sqrt(2)),
+              (1, 0, 1.0), (1, -1, math.sqrt(2)), (0, -1, 1.0), (-1, -1, math.sqrt(2))]
+
+# memory per pixel of a tile, measured with tracemalloc on 256 and 512 pixel tiles: flood
+# 48 bytes, flat distances 70, accumulation 200 (MFD, 120 with D8) plus 45 for every tile
+# kept in memory (ACCUMULATION_TILES); benchmarks/memory_benchmark.py checks the peak
+HYDROLOGY_BYTES_PER_PIXEL = 384
+
+# tiles of the flow accumulation which are kept in memory, the flow along a tile border
+# passes between the two tiles many times
+ACCUMULATION_TILES = 4
+
+# tiles are multiples of the block size of the temporary rasters
+TILE_ALIGNMENT = 256
+
+# label of the cells which drain out of the dgm (border of the dgm, next to nodata)
+OUTLET = 0
+
+# flat distance of cells that do not reach a lower edge (yet)
+UNREACHED = np.iinfo(np.int32).max
+
+WORK_RASTER_OPTIONS = ['TILED=YES', 'BIGTIFF=IF_SAFER']
+
+
+def hydrology_tile_size(grid, memory_budget):
+    '''
+    edge length of the tiles for the memory budget (bytes), without budget one tile covers the grid
+    '''
+    if not memory_budget:
+        return max(grid.xsize, grid.ysize)
+    size = tile_size_for_budget(memory_budget, HYDROLOGY_BYTES_PER_PIXEL)
+    return max(TILE_ALIGNMENT, size // TILE_ALIGNMENT * TILE_ALIGNMENT)
+
+
+class TileLayout:
+    '''
+    Square tiles of the grid with a halo of one cell. The border cells of
+    every tile have a label of their own (1, 2, ...), OUTLET is 0.
+    '''
+
+    def __init__(self, grid, size):
+        self.grid = grid
+        self.size = size
+        self.tile_rows = (grid.ysize + size - 1) // size
+        self.tile_cols = (grid.xsize + size - 1) // size
+        self.tiles = [Tile(grid, col_off, row_off, min(size, grid.xsize - col_off), min(size, grid.ysize - row_off), 1)
+                      for row_off in range(0, grid.ysize, size) for col_off in range(0, grid.xsize, size)]
+        self.rows = np.array([tile.rows for tile in self.tiles], dtype=np.int64)
+        self.cols = np.array([tile.cols for tile in self.tiles], dtype=np.int64)
+        # at most 2 * (rows + cols) border cells per tile
+        self.label_base = np.concatenate([[1], 1 + np.cumsum(2 * (self.rows + self.cols))])
+
+    @property
+    def label_count(self):
+        return int(self.label_base[-1])
+
+    def tile_of(self, rows, cols):
+        return (rows // self.size) * self.tile_cols + cols // self.size
+
+    def neighbours(self, number):
+        '''
+        numbers of the (up to 8) tiles around a tile
+        '''
+        row, col = divmod(number, self.tile_cols)
+        return [r * self.tile_cols + c for r in range(max(0, row - 1), min(self.tile_rows, row + 2))
+                for c in range(max(0, col - 1), min(self.tile_cols, col + 2)) if (r, c) != (row, col)]
+
+    def border_labels(self, rows, cols):
+        '''
+        labels of border cells given by their rows and columns in the grid
+        '''
+        number = self.tile_of(rows, cols)
+        r = rows % self.size
+        c = cols % self.size
+        tile_rows = self.rows[number]
+        tile_cols = self.cols[number]
+        index = np.where(r == 0, c, np.where(r == tile_rows - 1, tile_cols + c,
+                         np.where(c == 0, 2 * tile_cols + r - 1, 2 * tile_cols + tile_rows + r - 3)))
+        return self.label_base[number] + index
+
+    def read(self, dataset, number, halo=1):
+        '''
+        block of a tile including a halo as float64 array, nan for nodata and outside the grid
+        '''
+        tile = self.tiles[number]
+        tile = Tile(self.grid, tile.col_off, tile.row_off, tile.cols, tile.rows, halo)
+        block = np.full((tile.rows + 2 * halo, tile.cols + 2 * halo), np.nan)
+        row = tile.pad_row_off - tile.row_off + halo
+        col = tile.pad_col_off - tile.col_off + halo
+        block[row:row + tile.pad_rows, col:col + tile.pad_cols] = read_block(dataset, tile.pad_col_off, tile.pad_row_off, tile.pad_cols, tile.pad_rows)
+        return block
+
+    def read_core(self, dataset, number):
+        tile = self.tiles[number]
+        return read_block(dataset, tile.col_off, tile.row_off, tile.cols, tile.rows)
+
+    def write_core(self, dataset, number, array):
+        tile = self.tiles[number]
+        write_window(dataset, array, tile.row_off, col_off=tile.col_off)
+
+    def grid_index(self, number, cells, halo=1):
+        '''
+        cell numbers in the grid (row * xsize + col) of flat indices of a tile block with halo
+        '''
+        tile = self.tiles[number]
+        rows, cols = np.divmod(cells, tile.cols + 2 * halo)
+        return (tile.row_off - halo + rows) * self.grid.xsize + tile.col_off - halo + cols
+
+    def block_index(self, number, cells, halo=1):
+        '''
+        flat indices in the tile block with halo of cell numbers of the grid, -1 outside the tile core
+        '''
+        tile = self.tiles[number]
+        rows, cols = np.divmod(cells, self.grid.xsize)
+        rows = rows - tile.row_off
+        cols = cols - tile.col_off
+        inside = (rows >= 0) & (rows < tile.rows) & (cols >= 0) & (cols < tile.cols)
+        return np.where(inside, (rows + halo) * (tile.cols + 2 * halo) + cols + halo, -1)
+
+
+def _offsets(block):
+    '''
+    flat offsets of the 8 neighbours in a block
+    '''
+    return [row * block.shape[1] + col for row, col, distance in NEIGHBOURS]
+
+
+def _core(block, halo=1):
+    '''
+    flat mask of the cells of a block without its halo
+    '''
+    core = np.zeros(block.shape, dtype=bool)
+    core[halo:-halo, halo:-halo] = True
+    return core.ravel()
+
+
+def _pad(dem, halo=1):
+    '''
+    block of a dgm array with a nodata halo, so the dgm border drains to the outlet
+    '''
+    block = np.full((dem.shape[0] + 2 * halo, dem.shape[1] + 2 * halo), np.nan)
+    block[halo:-halo, halo:-halo] = dem
+    return block
+
+
+def _fill_tile(block, labels):
+    '''
+    priority-flood of a tile block with halo (nan = nodata). labels is a
+    block of the labels of the border cells (-1 elsewhere). Cells next to
+    nodata or the grid border drain to OUTLET.
+    Returns the filled elevations (nan for nodata) and labels (-1 for nodata)
+    of the tile and the spill elevations between labels as arrays (label, label, elevation).
+    '''
+    offsets = _offsets(block)
+    elevation = block.ravel()
+    valid = ~np.isnan(elevation)
+    cells = valid & _core(block)
+    outlet = np.zeros(elevation.size, dtype=bool)
+    for offset in offsets:
+        # the wrap around only hits the halo
+        outlet |= ~np.roll(valid, -offset)
+    outlet &= cells
+    label = np.where(cells, labels.ravel(), -1).astype(np.int64)
+    border = cells & (label > 0)
+    label[outlet & ~border] = OUTLET
+
+    # border cells of the dgm or next to nodata spill into the outlet at their own elevation
+    spill = dict(((OUTLET, int(label[cell])), float(elevation[cell])) for cell in np.flatnonzero(border & outlet).tolist())
+    seeds = border | outlet
+    filled = array('d', np.nan_to_num(elevation, nan=-np.inf).tobytes())
+    owner = array('q', label.tobytes())
+    closed = bytearray((~cells | seeds).astype(np.uint8).tobytes())
+    open_cells = [(filled[cell], cell) for cell in np.flatnonzero(seeds).tolist()]
+    heapq.heapify(open_cells)
+    pit = deque()
+    while open_cells or pit:
+        if pit:
+            cell = pit.popleft()
+        else:
+            cell = heapq.heappop(open_cells)[1]
+        level = filled[cell]
+        own = owner[cell]
+        for offset in offsets:
+            neighbour = cell + offset
+            if closed[neighbour]:
+                other = owner[neighbour]
+                if other != own and other >= 0:
+                    # two labels meet, the lower of the two cells spills into the other region
+                    key = (own, other) if own < other else (other, own)
+                    height = level if level > filled[neighbour] else filled[neighbour]
+                    if height < spill.get(key, math.inf):
+                        spill[key] = height
+                continue
+            closed[neighbour] = 1
+            owner[neighbour] = own
+            if filled[neighbour] <= level:
+                # depression or flat: raised to the cell it drains to
+                filled[neighbour] = level
+                pit.append(neighbour)
+            else:
+                heapq.heappush(open_cells, (filled[neighbour], neighbour))
+
+    filled = np.frombuffer(filled, dtype=np.float64).copy()
+    filled[~valid] = np.nan
+    owner = np.frombuffer(owner, dtype=np.int64).reshape(block.shape)[1:-1, 1:-1]
+    keys = np.array(list(spill.keys()), dtype=np.int64).reshape(-1, 2)
+    return (filled.reshape(block.shape)[1:-1, 1:-1], owner.astype(np.int32),
+            (keys[:, 0], keys[:, 1], np.array(list(spill.values()), dtype=np.float64)))
+
+
+def _tile_labels(layout, number, block):
+    '''
+    block of the labels of the border cells of a tile, -1 elsewhere
+    '''
+    tile = layout.tiles[number]
+    labels = np.full(block.shape, -1, dtype=np.int64)
+    border = np.zeros(block.shape, dtype=bool)
+    border[1:-1, 1:-1] = True
+    border[2:-2, 2:-2] = False
+    rows, cols = np.nonzero(border)
+    labels[rows, cols] = layout.border_labels(tile.row_off - 1 + rows, tile.col_off - 1 + cols)
+    return labels
+
+
+def _border_edges(layout, number, block, labels):
+    '''
+    spill elevations between the border cells of a tile and the border cells of its neighbours
+    '''
+    elevation = block.ravel()
+    halo = ~_core(block)
+    cells = np.flatnonzero((labels.ravel() > 0) & ~np.isnan(elevation))
+    edges = []
+    for offset in _offsets(block):
+        neighbours = cells + offset
+        across = halo[neighbours] & ~np.isnan(elevation[neighbours])
+        here = cells[across]
+        there = layout.grid_index(number, neighbours[across])
+        edges.append((labels.ravel()[here], layout.border_labels(there // layout.grid.xsize, there % layout.grid.xsize),
+                      np.maximum(elevation[here], elevation[neighbours[across]])))
+    return tuple(np.concatenate(part) for part in zip(*edges))
+
+
+def _solve_spill(edges, count):
+    '''
+    lowest spill elevation from every label to the outlet (minimax path over the spill graph)
+    '''
+    first = np.concatenate([edge[0] for edge in edges] + [edge[1] for edge in edges])
+    second = np.concatenate([edge[1] for edge in edges] + [edge[0] for edge in edges])
+    height = np.concatenate([edge[2] for edge in edges] * 2)
+    order = np.argsort(first, kind='stable')
+    start = np.searchsorted(first[order], np.arange(count + 1)).tolist()
+    second = second[order].tolist()
+    height = height[order].tolist()
+
+    spill = [math.inf] * count
+    spill[OUTLET] = -math.inf
+    queue = [(-math.inf, OUTLET)]
+    while queue:
+        level, label = heapq.heappop(queue)
+        if level > spill[label]:
+            continue
+        for k in range(start[label], start[label + 1]):
+            other = second[k]
+            over = height[k] if height[k] > level else level
+            if over < spill[other]:
+                spill[other] = over
+                heapq.heappush(queue, (over, other))
+    return np.array(spill)
+
+
+def _flat_distances(elevation, distance):
+    '''
+    distance (in cells) of every cell of a tile block to the lower edge of
+    its flat: 0 for cells with a lower neighbour or next to nodata, otherwise
+    the shortest path over cells of the same elevation. The halo of distance
+    holds the known distances of the neighbouring tiles (nan if unknown).
+    Returns the distances of the tile (UNREACHED if not connected to a lower edge yet, -1 for nodata).
+    '''
+    offsets = _offsets(elevation)
+    values = elevation.ravel()
+    core = _core(elevation)
+    cells = core & ~np.isnan(values)
+    known = distance.ravel()
+    halo = ~core & ~np.isnan(values) & ~np.isnan(known) & (known < UNREACHED)
+    drains = np.zeros(values.size, dtype=bool)
+    for offset in offsets:
+        # nan neighbours (nodata, outside the grid) are outlets
+        drains |= ~(np.roll(values, -offset) >= values)
+    result = np.full(values.size, UNREACHED, dtype=np.int64)
+    result[halo] = known[halo]
+    result[cells & drains] = 0
+
+    front = np.flatnonzero((cells & drains) | halo)
+    while front.size:
+        reached = []
+        for offset in offsets:
+            neighbours = front + offset
+            inside = (neighbours >= 0) & (neighbours < values.size)
+            sources = front[inside]
+            neighbours = neighbours[inside]
+            steps = result[sources] + 1
+            better = core[neighbours] & (values[neighbours] == values[sources]) & (steps < result[neighbours])
+            np.minimum.at(result, neighbours[better], steps[better])
+            reached.append(neighbours[better])
+        front = np.unique(np.concatenate(reached))
+    result[~cells] = -1
+    return result.reshape(elevation.shape)[1:-1, 1:-1]
+
+
+def _drops(values, distance, cells, offset, length):
+    '''
+    slope from cells to the neighbour at offset, 0 if it is not lower. On
+    flats (cells with a distance > 0 have no lower neighbour) the decrease
+    of the flat distance is used instead.
+    '''
+    here = values[cells]
+    there = values[cells + offset]
+    drop = (here - there) / length
+    flat = (there == here) & (distance[cells + offset] < distance[cells])
+    slope = (distance[cells] - distance[cells + offset]) / length
+    return np.where(drop > 0, drop, np.where(flat, slope, 0.0))
+
+
+def _flow(values, distance, cells, offsets, lengths, method, exponent):
+    '''
+    receiver of every cell (D8, -1 without lower neighbour) or the sum of its flow weights (MFD)
+    '''
+    if method == MFD:
+        total = np.zeros(values.size)
+        for offset, length in zip(offsets, lengths):
+            total[cells] += np.power(_drops(values, distance, cells, offset, length), exponent)
+        return total
+    best = np.zeros(cells.size)
+    receiver = np.full(values.size, -1, dtype=np.int64)
+    for offset, length in zip(offsets, lengths):
+        drop = _drops(values, distance, cells, offset, length)
+        steeper = drop > best
+        best[steeper] = drop[steeper]
+        receiver[cells[steeper]] = cells[steeper] + offset
+    return receiver
+
+
+class AccumulationTile:
+    '''
+    Flow accumulation of a tile block with a halo of two cells (filled
+    elevations and flat distances, nan = nodata). Every cell keeps its
+    accumulated area and the number of its donors which are not done yet
+    (-1 when it is done). A cell is done as soon as all its donors are done
+    (waves in topological order); the cells waiting for flow of a
+    neighbouring tile continue when it arrives (add).
+    '''
+
+    def __init__(self, elevation, distance, cell_x, cell_y, method=D8, state=None, exponent=MFD_EXPONENT):
+        self.shape = (elevation.shape[0] - 4, elevation.shape[1] - 4)
+        self.method = method
+        self.exponent = exponent
+        self.offsets = _offsets(elevation)
+        self.lengths = [math.hypot(row * cell_y, col * cell_x) for row, col, step in NEIGHBOURS]
+        self.values = elevation.ravel()
+        self.distance = np.where(np.isnan(distance), UNREACHED, distance).ravel()
+        self.core = _core(elevation, 2)
+        valid = ~np.isnan(self.values)
+        cells = np.flatnonzero(self.core & valid)
+        # the donors in the halo belong to the neighbouring tiles, their flow arrives with add
+        sources = np.flatnonzero(_core(elevation, 1) & valid)
+        self.flow = _flow(self.values, self.distance, sources, self.offsets, self.lengths, method, exponent)
+        self.accumulated = np.zeros(self.values.size)
+        self.remaining = np.full(self.values.size, -1, dtype=np.int64)
+        if state is None:
+            self.accumulated[cells] = cell_x * cell_y
+            receivers = self.shares(sources)[0]
+            self.remaining[cells] = np.bincount(receivers, minlength=self.values.size)[cells]
+        else:
+            self.accumulated[self.core] = state[0].ravel()
+            self.remaining[self.core] = state[1].ravel()
+        self.ready = cells[self.remaining[cells] == 0]
+        self.waiting = int(np.count_nonzero(self.remaining[cells] >= 0))
+
+    def shares(self, cells):
+        '''
+        (receivers, area) of the flow from cells to their lower neighbours, one entry per donor and receiver
+        '''
+        if self.method != MFD:
+            receiver = self.flow[cells]
+            donors = receiver >= 0
+            return receiver[donors], self.accumulated[cells[donors]]
+        receivers = []
+        area = []
+        for offset, length in zip(self.offsets, self.lengths):
+            drop = _drops(self.values, self.distance, cells, offset, length)
+            donors = cells[drop > 0]
+            receivers.append(donors + offset)
+            area.append(self.accumulated[donors] * np.power(drop[drop > 0], self.exponent) / self.flow[donors])
+        return np.concatenate(receivers), np.concatenate(area)
+
+    def add(self, cells, area, donors):
+        '''
+        adds the flow of done donors of the neighbouring tiles (block indices, area, number of donors)
+        '''
+        np.add.at(self.accumulated, cells, area)
+        np.add.at(self.remaining, cells, -donors)
+        cells = np.unique(cells)
+        self.ready = np.concatenate([self.ready, cells[self.remaining[cells] == 0]])
+
+    def run(self):
+        '''
+        does all cells which are ready, returns the flow leaving the tile as (block indices in the halo, area, donors)
+        '''
+        wave = self.ready
+        self.ready = wave[:0]
+        leaving = []
+        while wave.size:
+            self.remaining[wave] = -1
+            self.waiting -= wave.size
+            receivers, area = self.shares(wave)
+            inside = self.core[receivers]
+            np.add.at(self.accumulated, receivers[inside], area[inside])
+            np.add.at(self.remaining, receivers[inside], -1)
+            leaving.append((receivers[~inside], area[~inside]))
+            targets = np.unique(receivers[inside])
+            wave = targets[self.remaining[targets] == 0]
+        if not leaving:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64))
+        receivers, area = [np.concatenate(part) for part in zip(*leaving)]
+        cells, index = np.unique(receivers, return_inverse=True)
+        return cells, np.bincount(index, area, cells.size), np.bincount(index, minlength=cells.size)
+
+    def state(self):
+        '''
+        accumulated area and donors which are not done yet of the tile cells
+        '''
+        return self.accumulated[self.core].reshape(self.shape), self.remaining[self.core].reshape(self.shape)
+
+
+def fill_depressions(dem):
+    '''
+    depression-filled copy of a dgm array (nan = nodata), flats stay flat
+    '''
+    block = _pad(np.asarray(dem, dtype=np.float64))
+    return _fill_tile(block, np.full(block.shape, -1))[0]
+
+
+def specific_catchment_area(dem, cell_x, cell_y, method=D8):
+    '''
+    specific catchment area (upslope area / cell width, in map units) of a dgm array (nan = nodata), as one tile
+    '''
+    cell_x = abs(cell_x)
+    cell_y = abs(cell_y)
+    filled = fill_depressions(dem)
+    distance = _flat_distances(_pad(filled), np.full((filled.shape[0] + 2, filled.shape[1] + 2), np.nan))
+    tile = AccumulationTile(_pad(filled, 2), _pad(distance.astype(np.float64), 2), cell_x, cell_y, method)
+    tile.run()
+    sca = tile.state()[0] / cell_x
+    sca[np.isnan(filled)] = np.nan
+    return sca
+
+
+def _fill_tiles(layout, dgm, filled, labels):
+    '''
+    fills the depressions of all tiles (first pass: per tile, second pass: raised to the spill elevation of their label)
+    '''
+    edges = []
+    for number in range(len(layout.tiles)):
+        block = layout.read(dgm, number)
+        if np.isnan(block[1:-1, 1:-1]).all():
+            layout.write_core(filled, number, block[1:-1, 1:-1])
+            layout.write_core(labels, number, np.full(block[1:-1, 1:-1].shape, -1, dtype=np.int32))
+            continue
+        border = _tile_labels(layout, number, block)
+        elevation, label, spill = _fill_tile(block, border)
+        edges += [spill, _border_edges(layout, number, block, border)]
+        layout.write_core(filled, number, elevation)
+        layout.write_core(labels, number, label)
+    if not edges:
+        return
+    spill = _solve_spill(edges, layout.label_count)
+    for number in range(len(layout.tiles)):
+        elevation = layout.read_core(filled, number)
+        label = layout.read_core(labels, number)
+        valid = ~np.isnan(label)
+        elevation[valid] = np.maximum(elevation[valid], spill[label[valid].astype(np.int64)])
+        layout.write_core(filled, number, elevation)
+
+
+def _flat_tiles(layout, filled, flats):
+    '''
+    flat distances of all tiles, tiles are calculated again while the distances on the border of a neighbour change.
+    Returns the highest filled elevation of every tile.
+    '''
+    heights = [-math.inf] * len(layout.tiles)
+    pending = list(range(len(layout.tiles)))
+    while pending:
+        remaining = set(pending)
+        changed = set()
+        for number in pending:
+            remaining.discard(number)
+            elevation = layout.read(filled, number)
+            known = layout.read(flats, number)
+            distance = _flat_distances(elevation, known)
+            if not np.isnan(elevation[1:-1, 1:-1]).all():
+                heights[number] = float(np.nanmax(elevation[1:-1, 1:-1]))
+            previous = np.nan_to_num(known[1:-1, 1:-1], nan=-1)
+            if not (np.array_equal(distance[0], previous[0]) and np.array_equal(distance[-1], previous[-1]) and
+                    np.array_equal(distance[:, 0], previous[:, 0]) and np.array_equal(distance[:, -1], previous[:, -1])):
+                # neighbours that were calculated before this tile read its old border
+                changed.update(other for other in layout.neighbours(number) if other not in remaining)
+            layout.write_core(flats, number, distance.astype(np.int32))
+        pending = sorted(changed)
+    return heights
+
+
+def _accumulate_tiles(layout, filled, flats, work, output, cell_x, cell_y, method, heights):
+    '''
+    accumulates the flow of all tiles. A tile is visited again when flow of a
+    neighbouring tile arrives, the tile receiving the highest flow first.
+    The last ACCUMULATION_TILES tiles stay in memory, the state of the others
+    is kept in work (accumulated area and donors which are not done yet).
+    Every cell is done once.
+    '''
+    accumulated, remaining = work
+    inflow = [[] for tile in layout.tiles]
+    visited = [False] * len(layout.tiles)
+    tiles = OrderedDict()
+    queue = [(-heights[number], number) for number in range(len(layout.tiles))]
+    heapq.heapify(queue)
+    priority = dict((number, -heights[number]) for number in range(len(layout.tiles)))
+    while priority:
+        # tiles in memory go on while flow arrives, the others wait in the order of their highest inflow
+        waiting = [number for number in tiles if number in priority]
+        if waiting:
+            number = min(waiting, key=priority.get)
+        else:
+            key, number = heapq.heappop(queue)
+            if priority.get(number) != key:
+                # the tile was queued again with a higher priority or was visited in memory
+                continue
+        del priority[number]
+        tile = tiles.pop(number, None)
+        if tile is None:
+            state = None
+            if visited[number]:
+                state = (layout.read_core(accumulated, number), layout.read_core(remaining, number).astype(np.int64))
+            tile = AccumulationTile(layout.read(filled, number, 2), layout.read(flats, number, 2), cell_x, cell_y, method, state)
+            visited[number] = True
+        for cells, area, donors in inflow[number]:
+            tile.add(layout.block_index(number, cells, 2), area, donors)
+        inflow[number] = []
+        leaving = tile.run()
+        if tile.waiting:
+            tiles[number] = tile
+            if len(tiles) > ACCUMULATION_TILES:
+                evicted, old = tiles.popitem(last=False)
+                layout.write_core(accumulated, evicted, old.state()[0])
+                layout.write_core(remaining, evicted, old.state()[1].astype(np.int16))
+        else:
+            sca = tile.state()[0] / cell_x
+            sca[np.isnan(tile.values.reshape(tile.shape[0] + 4, -1)[2:-2, 2:-2])] = np.nan
+            layout.write_core(output, number, sca.astype(np.float32))
+        cells = layout.grid_index(number, leaving[0], 2)
+        receivers = layout.tile_of(cells // layout.grid.xsize, cells % layout.grid.xsize)
+        for other in np.unique(receivers).tolist():
+            mine = receivers == other
+            inflow[other].append((cells[mine], leaving[1][mine], leaving[2][mine]))
+            key = -float(np.max(tile.values[leaving[0][mine]]))
+            if key < priority.get(other, math.inf):
+                priority[other] = key
+                heapq.heappush(queue, (key, other))
+
+
+def catchment_area(dgm, file, method=D8, memory_budget=0, scratch=None):
+    '''
+    calculates the specific catchment area of a dgm raster and writes it as
+    Float32 raster. With a memory budget (bytes) the dgm is processed in
+    tiles. The temporary rasters are written to scratch (default: the folder of file).
+    '''
+    dataset = open_raster(dgm)
+    grid = RasterGrid.from_dataset(dataset)
+    layout = TileLayout(grid, hydrology_tile_size(grid, memory_budget))
+    folder = scratch or os.path.dirname(file)
+    make_folder(folder)
+    make_folder(os.path.dirname(file))
+    name = os.path.splitext(os.path.basename(file))[0]
+    work = dict((key, os.path.join(folder, name + '_' + key + '.tif')) for key in ['filled', 'labels', 'flats', 'accumulated', 'remaining'])
+    try:
+        filled = create_raster(work['filled'], grid, gdal.GDT_Float64, options=WORK_RASTER_OPTIONS)
+        labels = create_raster(work['labels'], grid, gdal.GDT_Int32, -1, options=WORK_RASTER_OPTIONS)
+        _fill_tiles(layout, dataset, filled, labels)
+        labels = None
+        delete_raster(work['labels'])
+        flats = create_raster(work['flats'], grid, gdal.GDT_Int32, -1, options=WORK_RASTER_OPTIONS)
+        # no distances are known before the first pass
+        flats.GetRasterBand(1).Fill(-1)
+        heights = _flat_tiles(layout, filled, flats)
+        # donors not done yet are at most 8, the nodata value is never used
+        state = (create_raster(work['accumulated'], grid, gdal.GDT_Float64, options=WORK_RASTER_OPTIONS),
+                 create_raster(work['remaining'], grid, gdal.GDT_Int16, -32768, options=WORK_RASTER_OPTIONS))
+        output = create_raster(file, grid)
+        _accumulate_tiles(layout, filled, flats, state, output, abs(grid.geotransform[1]), abs(grid.geotransform[5]), method, heights)
+        output = None
+    finally:
+        # closing the datasets before they are deleted
+        filled = labels = flats = state = None
+        for work_file in work.values():
+            delete_raster(work_file)
+    return file
+
+
+def wetness_indices(sca, slope, folder, block_rows=DEFAULT_BLOCK_ROWS):
+    '''
+    calculates TWI = ln(sca / tan(slope)) and SPI = sca * tan(slope) on the
+    grid of the slope raster (degrees) and writes TWI.tif and SPI.tif to folder.
+    The catchment area raster may cover a larger extent (tiled mode).
+    Returns the files as {'TWI': file, 'SPI': file} dictionary.
+    '''
+    make_folder(folder)
+    slope_dataset = open_raster(slope)
+    grid = RasterGrid.from_dataset(slope_dataset)
+    sca_dataset = open_on_grid(sca, grid)
+    files = {'TWI': os.path.join(folder, 'TWI.tif'), 'SPI': os.path.join(folder, 'SPI.tif')}
+    twi_dataset = create_raster(files['TWI'], grid)
+    spi_dataset = create_raster(files['SPI'], grid)
+    for row_off, rows in grid.windows(block_rows):
+        tan_slope = np.maximum(np.tan(np.radians(read_window(slope_dataset, row_off, rows))), MIN_TAN_SLOPE)
+        area = read_window(sca_dataset, row_off, rows)
+        write_window(twi_dataset, np.log(area / tan_slope).astype(np.float32), row_off)
+        write_window(spi_dataset, (area * tan_slope).astype(np.float32), row_off)
+    # closing the datasets flushes them to disk
+    twi_dataset = None
+    spi_dataset = None
+    return files
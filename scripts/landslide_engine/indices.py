@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+Statistical index and weighting factor tables.
+
+The statistical index (SI) of a class is ln(landslide density of the class /
+landslide density of the study area). The weighting factor (WF) method
+multiplies all SI values of a factor with the weight of the factor, which is
+its total SI (tsi, sum of SI * landslide pixels over the classes) scaled to
+1..10 over all factors. Tables use the flat reclassification format
+['min','max','value',...] of the scripts.
+"""
+
+import numpy as np
+
+
+def statistical_index_table(landslides_per_class, pixel_per_class, landslide_count, unique_values):
+    '''
+    si value of every class as flat reclassification table (same as create_statistical_index_list of the scripts)
+    '''
+    table = []
+    density = landslide_count / sum(pixel_per_class.values())
+    for key in unique_values:
+        if key in landslides_per_class:
+            si = np.log((landslides_per_class.get(key) / pixel_per_class.get(key)) / density)
+        elif key in pixel_per_class:
+            # ln(0) is undefined, classes without landslides count 0.1 landslide pixels
+            si = np.log((0.1 / pixel_per_class.get(key)) / density)
+        else:
+            # class does not appear in the viewshed
+            si = 0
+        table += [key, key, str(si)]
+    return table
+
+
+def factor_index_tables(factor_tables, landslide_count):
+    '''
+    si tables of a list of FactorTables
+    '''
+    return [statistical_index_table(table.landslides_per_class(), table.pixel_per_class(),
+                                    landslide_count, table.unique_values())
+            for table in factor_tables]
+
+
+def total_statistical_index(table, landslides_per_class):
+    '''
+    tsi of a factor: sum of si * landslide pixels over all classes
+    '''
+    return sum(float(table[i + 2]) * landslides_per_class.get(table[i], 0)
+               for i in range(0, len(table), 3))
+
+
+def weight_factors(tsi_list):
+    '''
+    scales the tsi values of all factors to weights between 1 and 10
+    '''
+    low = min(tsi_list)
+    high = max(tsi_list)
+    return [((tsi - low) / (high - low)) * 9 + 1 for tsi in tsi_list]
+
+
+def weight_coefficients(tsi_list):
+    '''
+    a and b of the weighting factors as linear function a * tsi + b of the tsi
+    (a weighted sum of si values is a * the tsi weighted sum + b * the si sum)
+    '''
+    low = min(tsi_list)
+    high = max(tsi_list)
+    scale = 9 / (high - low)
+    return scale, 1 - scale * low
+
+
+def scale_table(table, weight):
+    '''
+    copy of a si table with all values multiplied by weight
+    '''
+    scaled = list(table)
+    for i in range(2, len(scaled), 3):
+        scaled[i] = str(float(scaled[i]) * weight)
+    return scaled
+
+
+def write_index_file(file, table, weight=None):
+    '''
+    writes the class: value pairs of a table (and the weight) like the <factor>_si.txt files of the scripts
+    '''
+    with open(file, 'w', encoding='utf8') as f:
+        for i in range(0, len(table), 3):
+            f.write(table[i] + ': ' + table[i + 2] + ', ')
+        if weight is not None:
+            f.write('WF: ' + str(weight))
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+Intermediate files of a run: in memory while they fit, otherwise on scratch disk.
+
+The scripts write many rasters which are only read by the next step (terrain
+derivatives, class codes, clipped and classified rasters). Intermediates
+which are written and read in this process (the block engine, GDAL in
+process) are kept in GDAL's in-memory file system (/vsimem/) as long as
+their estimated size fits into the memory limit. All other intermediates,
+and the ones that do not fit, are written to a folder of this run in the
+scratch folder (a local disk instead of a network share). The GDAL and SAGA
+algorithms of QGIS processing run as separate processes and can not read
+/vsimem/, so their inputs and outputs always go to the scratch folder.
+
+Every intermediate is registered with the number of its consumers; the last
+release() deletes it. close() deletes whatever is left at the end of the run.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+from osgeo import gdal
+
+from .raster_io import is_virtual, delete_raster
+
+# root of the in-memory intermediates of all runs in this process
+VSIMEM_ROOT = '/vsimem/landslide_intermediates'
+
+
+def delete_file(path):
+    '''
+    deletes a raster or vector file with its side car files (in memory or on disk)
+    '''
+    if gdal.IdentifyDriver(str(path)) is not None:
+        delete_raster(path)
+    elif is_virtual(path):
+        gdal.Unlink(str(path))
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def delete_folder(folder):
+    if is_virtual(folder):
+        for name in gdal.ReadDirRecursive(str(folder)) or []:
+            if not name.endswith('/'):
+                gdal.Unlink(str(folder) + '/' + name)
+    else:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+class Intermediates:
+    '''
+    Intermediate files and folders of one run with their remaining consumers
+    '''
+
+    def __init__(self, memory_limit=0, scratch=None):
+        # bytes of intermediates kept in /vsimem/ at the same time (0 = none)
+        self.memory_limit = memory_limit
+        self.scratch = scratch or tempfile.gettempdir()
+        # several jobs of the worker run in one process
+        self.run_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.memory = 0
+        self.disk_folder = None
+
+    @property
+    def memory_folder(self):
+        return VSIMEM_ROOT + '/' + self.run_id
+
+    def _scratch_folder(self):
+        if self.disk_folder is None:
+            if not os.path.exists(self.scratch):
+                os.makedirs(self.scratch)
+            self.disk_folder = tempfile.mkdtemp(prefix='landslide_', dir=self.scratch)
+        return self.disk_folder
+
+    def _register(self, name, size, uses, in_process, folder):
+        with self.lock:
+            in_memory = in_process and self.memory_limit > 0 and self.memory + size <= self.memory_limit
+            parent = self.memory_folder if in_memory else self._scratch_folder()
+            root, extension = os.path.splitext(name)
+            path = parent + '/' + name if in_memory else os.path.join(parent, name)
+            number = 1
+            while path in self.entries:
+                # a name is used twice (e.g. per tile), the files must not overwrite each other
+                number += 1
+                unique = root + '_' + str(number) + extension
+                path = parent + '/' + unique if in_memory else os.path.join(parent, unique)
+            self.entries[path] = {'bytes': size if in_memory else 0, 'uses': uses, 'folder': folder}
+            if in_memory:
+                self.memory += size
+            elif folder:
+                os.makedirs(path)
+            return path
+
+    def file(self, name, size=0, uses=1, in_process=True):
+        '''
+        path of a new intermediate file (name with extension). It is kept in
+        memory if it is only used in this process and size (estimated bytes)
+        fits into the memory limit, otherwise it is in the scratch folder.
+        The file is deleted after uses calls of release().
+        '''
+        return self._register(name, size, uses, in_process, False)
+
+    def folder(self, name, size=0, uses=1, in_process=True):
+        '''
+        path of a new intermediate folder for several files (like file)
+        '''
+        return self._register(name, size, uses, in_process, True)
+
+    def release(self, path):
+        '''
+        one consumer of an intermediate has finished, the last one deletes it.
+        Paths which are no intermediates (inputs, cached files) are ignored.
+        '''
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return False
+            entry['uses'] -= 1
+            if entry['uses'] > 0:
+                return False
+            del self.entries[path]
+            self.memory -= entry['bytes']
+        if entry['folder']:
+            delete_folder(path)
+        else:
+            delete_file(path)
+        return True
+
+    def close(self):
+        '''
+        deletes all remaining intermediates and the scratch folder of the run
+        '''
+        with self.lock:
+            entries = list(self.entries.items())
+            self.entries = {}
+            self.memory = 0
+        for path, entry in entries:
+            if entry['folder']:
+                delete_folder(path)
+            else:
+                delete_file(path)
+        delete_folder(self.memory_folder)
+        if self.disk_folder is not None:
+            shutil.rmtree(self.disk_folder, ignore_errors=True)
+            self.disk_folder = None
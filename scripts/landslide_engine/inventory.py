@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental update of the counts when the landslide inventory changes.
+
+Every incremental run of the SI, WF and combined scripts (block engine) writes a manifest to its output folder: the
+settings and input files of the run, the factors the counts were made from,
+the contingency tables and the landslide pixels (flat grid indices, in
+inventory_pixels.npy). A later run into the same folder with a new landslide
+raster and otherwise the same inputs compares the landslide pixels with the
+recorded ones. Only the strips with added or removed landslide pixels are
+read from the factors, their class codes are added to or subtracted from the
+landslide counts of the stored tables; the pixels per class do not depend on
+the inventory and are kept. Terrain derivatives, road distances and the full
+counting pass are skipped, the si and wf values follow from the updated counts.
+
+If instead one factor input was replaced (e.g. a new landuse raster) and the
+landslides are the same, replaced_input finds it. Only this factor is counted
+again, the other tables are kept, and the sums recorded in the manifest (the
+Float64 si sum and tsi weighted sum, see mapping) are updated with
+mapping.replace_factor. The maps written from them may be quantized.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .raster_io import DEFAULT_BLOCK_ROWS, RasterGrid, open_on_grid, read_window, landslide_pixels
+from .reclassify import ReclassTable
+from .statistics import Factor, FactorTable, ClassCounter
+from .factor_stack import StackFactor
+from .cache import source_file
+
+# files in the output folder
+INVENTORY_MANIFEST = 'inventory_manifest.json'
+INVENTORY_PIXELS = 'inventory_pixels.npy'
+
+# 2: the maps entry records the Float64 sums instead of the si map
+VERSION = 2
+
+
+def inventory_pixels(landslides, grid, block_rows=DEFAULT_BLOCK_ROWS):
+    '''
+    flat grid indices (row * xsize + col, ascending) of all landslide pixels
+    '''
+    dataset = open_on_grid(landslides, grid)
+    pixels = [np.zeros(0, dtype=np.int64)]
+    for row_off, rows in grid.windows(block_rows):
+        pixels.append(np.flatnonzero(landslide_pixels(read_window(dataset, row_off, rows))).astype(np.int64) + row_off * grid.xsize)
+    return np.concatenate(pixels)
+
+
+def diff_inventory(previous, current):
+    '''
+    flat indices of the landslide pixels added and removed between two inventories
+    '''
+    return (np.setdiff1d(current, previous, assume_unique=True),
+            np.setdiff1d(previous, current, assume_unique=True))
+
+
+def file_stamp(source):
+    '''
+    [size, modification time] of the file of a layer source, None if it does not exist
+    '''
+    file = source_file(source)
+    if not os.path.exists(file):
+        return None
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def counter_state(counter):
+    return {'offset': int(counter.offset), 'counts': counter.counts.tolist()}
+
+
+def counter_from_state(state):
+    counter = ClassCounter()
+    counter.offset = state['offset']
+    counter.counts = np.array(state['counts'], dtype=np.int64)
+    return counter
+
+
+def factor_state(factor):
+    if isinstance(factor, StackFactor):
+        return {'name': factor.name, 'raster': factor.raster, 'stack_index': factor.index}
+    if factor.table is None:
+        return {'name': factor.name, 'raster': factor.raster}
+    return {'name': factor.name, 'raster': factor.raster, 'table': factor.table.table,
+            'range_boundaries': factor.table.range_boundaries}
+
+
+def factor_from_state(state):
+    if 'stack_index' in state:
+        return StackFactor(state['name'], state['raster'], state['stack_index'])
+    table = None
+    if 'table' in state:
+        table = ReclassTable(state['table'], state['range_boundaries'])
+    return Factor(state['name'], state['raster'], table)
+
+
+class InventoryManifest:
+    '''
+    Settings, factors, contingency tables and landslide count of a run
+    '''
+
+    def __init__(self, settings, grid, factors, factor_tables, landslide_count, stamps=None, maps=None):
+        # json round trip, so settings compare equal to loaded ones
+        self.settings = json.loads(json.dumps(settings))
+        self.grid = grid
+        self.factors = list(factors)
+        self.factor_tables = factor_tables
+        self.landslide_count = int(landslide_count)
+        if stamps is None:
+            stamps = input_stamps(self.settings, self.factors)
+        self.stamps = stamps
+        # {'si_sum': file, 'tsi_sum': file or None, 'stamps': {...}} of the sums written by the run (map_state)
+        self.maps = maps
+
+    @classmethod
+    def load(cls, folder):
+        '''
+        the manifest of an output folder, None if there is none (or of another version)
+        '''
+        file = os.path.join(folder, INVENTORY_MANIFEST)
+        if not os.path.exists(file) or not os.path.exists(os.path.join(folder, INVENTORY_PIXELS)):
+            return None
+        with open(file, encoding='utf8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != VERSION:
+            return None
+        grid = RasterGrid(manifest['grid']['geotransform'], manifest['grid']['xsize'],
+                          manifest['grid']['ysize'], manifest['grid']['projection'])
+        factor_tables = []
+        for state in manifest['tables']:
+            table = FactorTable(state['name'])
+            table.grid_pixels = counter_from_state(state['grid_pixels'])
+            table.pixels = counter_from_state(state['pixels'])
+            table.landslides = counter_from_state(state['landslides'])
+            factor_tables.append(table)
+        return cls(manifest['settings'], grid, [factor_from_state(state) for state in manifest['factors']],
+                   factor_tables, manifest['landslide_count'], manifest['stamps'], manifest.get('maps'))
+
+    def save(self, folder, pixels):
+        '''
+        writes the manifest and the landslide pixels of the run to the output folder
+        '''
+        np.save(os.path.join(folder, INVENTORY_PIXELS), pixels)
+        manifest = {
+            'version': VERSION,
+            'settings': self.settings,
+            'grid': {'geotransform': list(self.grid.geotransform), 'xsize': self.grid.xsize,
+                     'ysize': self.grid.ysize, 'projection': self.grid.projection},
+            'factors': [factor_state(factor) for factor in self.factors],
+            'stamps': self.stamps,
+            'tables': [{'name': table.name, 'grid_pixels': counter_state(table.grid_pixels),
+                        'pixels': counter_state(table.pixels), 'landslides': counter_state(table.landslides)}
+                       for table in self.factor_tables],
+            'landslide_count': self.landslide_count,
+            'maps': self.maps,
+        }
+        file = os.path.join(folder, INVENTORY_MANIFEST)
+        # the manifest is replaced at once, an interrupted run leaves the old one
+        with open(file + '.tmp', 'w', encoding='utf8') as f:
+            json.dump(manifest, f)
+        os.replace(file + '.tmp', file)
+        return file
+
+    def pixels(self, folder):
+        return np.load(os.path.join(folder, INVENTORY_PIXELS))
+
+    def mismatch(self, settings, grid):
+        '''
+        why the manifest can not be updated for a run with these settings, None if it can
+        '''
+        if json.loads(json.dumps(settings)) != self.settings:
+            return 'the inputs or settings differ from the previous run'
+        if not self.same_grid(grid):
+            return 'the grid of the dgm changed'
+        if input_stamps(self.settings, self.factors) != self.stamps:
+            return 'an input or factor raster changed or no longer exists'
+        return None
+
+    def same_grid(self, grid):
+        return grid.geotransform == self.grid.geotransform and grid.xsize == self.grid.xsize and grid.ysize == self.grid.ysize
+
+    def replaced_input(self, settings, grid, factor_inputs):
+        '''
+        name of the input which is the only difference to the previous run, if it is one of
+        factor_inputs ({input: factor name}), the sums of the run are unchanged
+        and the replaced factor raster can still be read. Otherwise None.
+        '''
+        settings = json.loads(json.dumps(settings))
+        if not self.same_grid(grid) or self.maps is None:
+            return None
+        if dict(settings, inputs=None) != dict(self.settings, inputs=None):
+            return None
+        stamps = input_stamps(settings, [])
+        changed = [name for name in settings['inputs']
+                   if settings['inputs'][name] != self.settings['inputs'].get(name) or stamps[name] != self.stamps.get(name)]
+        if len(changed) != 1 or changed[0] not in factor_inputs:
+            return None
+        # all factor rasters of the previous run are read, the replaced one for its old si values
+        if input_stamps({}, self.factors) != {key: value for key, value in self.stamps.items() if key.startswith('factor:')}:
+            return None
+        if any(file_stamp(self.maps[name]) != self.maps['stamps'][name] for name in self.maps['stamps']):
+            return None
+        return changed[0]
+
+    def factor_index(self, name):
+        return [factor.name for factor in self.factors].index(name)
+
+
+def map_state(si_sum, tsi_sum=None):
+    '''
+    maps entry of a manifest for the Float64 si sum and tsi weighted sum written by a run
+    (the SI script writes no tsi weighted sum)
+    '''
+    sums = {'si_sum': si_sum, 'tsi_sum': tsi_sum}
+    return dict(sums, stamps=dict((name, file_stamp(file)) for name, file in sums.items() if file is not None))
+
+
+def input_stamps(settings, factors):
+    '''
+    size and modification time of the input files of the settings and of the factor rasters
+    '''
+    stamps = {}
+    for name, source in sorted(settings.get('inputs', {}).items()):
+        stamps[name] = file_stamp(source)
+    for factor in factors:
+        stamps['factor:' + factor.name] = file_stamp(factor.raster)
+    return stamps
+
+
+def update_counts(factor_tables, factors, grid, viewshed, added, removed, landslide_count, block_rows=DEFAULT_BLOCK_ROWS):
+    '''
+    adds the class codes of the added landslide pixels to the landslide counts
+    of the FactorTables and subtracts the ones of the removed pixels. Only the
+    strips with changed pixels are read. Returns the tables and the new
+    number of landslide pixels.
+    '''
+    changed = np.concatenate([added, removed])
+    sign = np.concatenate([np.ones(added.size), -np.ones(removed.size)])
+    order = np.argsort(changed, kind='stable')
+    changed = changed[order]
+    sign = sign[order]
+    datasets = None
+    for row_off, rows in grid.windows(block_rows):
+        start, stop = np.searchsorted(changed, [row_off * grid.xsize, (row_off + rows) * grid.xsize])
+        if start == stop:
+            continue
+        if datasets is None:
+            datasets = [factor.open(grid) for factor in factors]
+        row, col = np.divmod(changed[start:stop] - row_off * grid.xsize, grid.xsize)
+        in_viewshed = viewshed.window(row_off, rows)[row, col]
+        for factor, table, dataset in zip(factors, factor_tables, datasets):
+            codes, valid = factor.read_codes(dataset, row_off, rows)
+            counted = valid[row, col] & in_viewshed
+            table.landslides.add(codes[row, col][counted], sign[start:stop][counted])
+    return factor_tables, landslide_count + int(added.size) - int(removed.size)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+Several risk maps from one factor stack.
+
+The SI map and the WF map use the same class codes and the same si values,
+the WF map only weights them per factor. Both maps (and the histograms for
+their ROC curves) are therefore produced in one pass over the factor rasters,
+the landslide raster and the viewshed mask, without writing si rasters per
+factor.
+
+When one factor is replaced, replace_factor updates the maps of a previous
+run block by block: the si values of the old factor are subtracted from the
+si sum and the new ones added. The weighting factors are a linear function
+of the tsi (weight_coefficients), so the WF map is rebuilt from the si sum
+and the tsi weighted sum, which is updated the same way. Only the old and the
+new factor raster are read (all factors only for strips where the old factor
+was nodata and the new one is not). Both sums are kept as Float64 rasters
+next to the maps: a Float32 sum would be rounded again by every replacement
+and drift away from a full run, the maps themselves may be quantized.
+"""
+
+import numpy as np
+from osgeo import gdal
+
+from .raster_io import DEFAULT_BLOCK_ROWS, open_on_grid, read_window, create_raster, write_window, landslide_pixels
+from .reclassify import ReclassTable, MIN_INCLUSIVE_MAX_INCLUSIVE
+from .roc import RiskHistogram
+from .indices import weight_coefficients
+from .viewshed import ViewshedMask
+from .output import temporary_file, replace_raster
+
+# data types of the risk maps and of the running sums which replace_factor updates
+MAP_DATA_TYPE = gdal.GDT_Float32
+SUM_DATA_TYPE = gdal.GDT_Float64
+
+
+def risk_maps(factors, index_tables, weights, outputs, grid, landslides=None, viewshed=None, block_rows=DEFAULT_BLOCK_ROWS, options=None,
+              data_types=None):
+    '''
+    writes one risk map per output file (with the GTiff creation options). Map k is the sum over all factors of
+    weights[k][i] * index value of the class of factor i (index_tables[i] is
+    a flat si table). data_types are the GDAL data types of the outputs (default MAP_DATA_TYPE).
+    With a landslide raster the RiskHistograms of all maps inside the viewshed are returned,
+    otherwise an empty list.
+    '''
+    if data_types is None:
+        data_types = [MAP_DATA_TYPE] * len(outputs)
+    tables = [ReclassTable(table, MIN_INCLUSIVE_MAX_INCLUSIVE) for table in index_tables]
+    datasets = [factor.open(grid) for factor in factors]
+    output_datasets = [create_raster(output, grid, data_type, options=options) for output, data_type in zip(outputs, data_types)]
+    landslide_dataset = open_on_grid(landslides, grid) if landslides is not None else None
+    if viewshed is None:
+        viewshed = ViewshedMask.everything(grid)
+    elif not isinstance(viewshed, ViewshedMask):
+        viewshed = ViewshedMask.from_raster(viewshed, grid, block_rows)
+    histograms = [RiskHistogram() for output in outputs] if landslide_dataset is not None else []
+
+    for row_off, rows in grid.windows(block_rows):
+        totals = [np.zeros((rows, grid.xsize)) for output in outputs]
+        for i, (factor, table, dataset) in enumerate(zip(factors, tables, datasets)):
+            values = factor.read_values(dataset, row_off, rows, table)
+            for total, factor_weights in zip(totals, weights):
+                # nan (nodata) propagates like in the raster calculator
+                total += factor_weights[i] * values
+        if landslide_dataset is not None:
+            is_landslide = landslide_pixels(read_window(landslide_dataset, row_off, rows))
+            in_viewshed = viewshed.window(row_off, rows)
+        for k, total in enumerate(totals):
+            # the histogram sees the values as they are stored in the map
+            risk = stored_values(total, data_types[k])
+            write_window(output_datasets[k], risk, row_off)
+            if landslide_dataset is not None:
+                valid = ~np.isnan(risk) & in_viewshed
+                histograms[k].add(risk[valid].astype(np.float64), is_landslide[valid])
+
+    # closing the datasets flushes them to disk
+    output_datasets = None
+    return histograms
+
+
+def stored_values(total, data_type):
+    '''
+    the values of a block as they are stored in a raster of the data type
+    '''
+    return total if data_type == SUM_DATA_TYPE else total.astype(np.float32)
+
+
+def replace_factor(factors, index_tables, tsi_list, index, old_factor, old_table, old_tsi, sums, maps, grid,
+                   landslides=None, viewshed=None, block_rows=DEFAULT_BLOCK_ROWS, options=None):
+    '''
+    updates the maps of a previous run after factor index was replaced by factors[index].
+    sums are the si sum and the tsi weighted sum (map with the tsi as weights) of the previous
+    run (SUM_DATA_TYPE), they are read and written again; the tsi weighted sum may be None
+    if no wf map is written. maps are the si map and the wf map (MAP_DATA_TYPE), they are written
+    from the sums, None is not written. old_factor, old_table and old_tsi are the replaced
+    factor, its si table and tsi. Returns the RiskHistograms of the written maps like risk_maps.
+    '''
+    tables = [ReclassTable(table, MIN_INCLUSIVE_MAX_INCLUSIVE) for table in index_tables]
+    old_table = ReclassTable(old_table, MIN_INCLUSIVE_MAX_INCLUSIVE)
+    with_tsi = sums[1] is not None
+    if maps[1] is not None and not with_tsi:
+        raise ValueError('the wf map is written from the tsi weighted sum')
+    scale, offset = weight_coefficients(tsi_list) if with_tsi else (None, None)
+    sum_count = 2 if with_tsi else 1
+    sum_datasets = [open_on_grid(file, grid) for file in sums[:sum_count]]
+    old_dataset = old_factor.open(grid)
+    new_dataset = factors[index].open(grid)
+    datasets = None
+    # the sums are written first, the maps are written from them
+    outputs = [(file, SUM_DATA_TYPE) for file in sums[:sum_count]] + [(file, MAP_DATA_TYPE) for file in maps if file is not None]
+    temporary = [temporary_file(output) for output, data_type in outputs]
+    output_datasets = [create_raster(file, grid, data_type, options=options) for file, (output, data_type) in zip(temporary, outputs)]
+    landslide_dataset = open_on_grid(landslides, grid) if landslides is not None else None
+    if viewshed is None:
+        viewshed = ViewshedMask.everything(grid)
+    elif not isinstance(viewshed, ViewshedMask):
+        viewshed = ViewshedMask.from_raster(viewshed, grid, block_rows)
+    histograms = [RiskHistogram() for file in maps if file is not None] if landslide_dataset is not None else []
+
+    for row_off, rows in grid.windows(block_rows):
+        old = old_factor.read_values(old_dataset, row_off, rows, old_table)
+        new = factors[index].read_values(new_dataset, row_off, rows, tables[index])
+        si_sum = read_window(sum_datasets[0], row_off, rows) - old + new
+        if with_tsi:
+            tsi_sum = read_window(sum_datasets[1], row_off, rows) - old * old_tsi + new * tsi_list[index]
+        # the maps have no value where the old factor was nodata, these pixels are summed up again
+        missing = np.isnan(old) & ~np.isnan(new)
+        if missing.any():
+            if datasets is None:
+                datasets = [factor.open(grid) for factor in factors]
+            si_sum[missing] = 0.0
+            if with_tsi:
+                tsi_sum[missing] = 0.0
+            for i, (factor, table, dataset) in enumerate(zip(factors, tables, datasets)):
+                values = factor.read_values(dataset, row_off, rows, table)[missing]
+                si_sum[missing] += values
+                if with_tsi:
+                    tsi_sum[missing] += values * tsi_list[i]
+        totals = [si_sum] + ([tsi_sum] if with_tsi else [])
+        totals += [total for file, total in zip(maps, [si_sum, scale * tsi_sum + offset * si_sum if with_tsi else None]) if file is not None]
+        if landslide_dataset is not None:
+            is_landslide = landslide_pixels(read_window(landslide_dataset, row_off, rows))
+            in_viewshed = viewshed.window(row_off, rows)
+        for k, (total, (output, data_type)) in enumerate(zip(totals, outputs)):
+            risk = stored_values(total, data_type)
+            write_window(output_datasets[k], risk, row_off)
+            if landslide_dataset is not None and k >= sum_count:
+                valid = ~np.isnan(risk) & in_viewshed
+                histograms[k - sum_count].add(risk[valid].astype(np.float64), is_landslide[valid])
+
+    output_datasets = None
+    sum_datasets = None
+    for (output, data_type), file in zip(outputs, temporary):
+        replace_raster(file, output)
+    return histograms
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+Output profiles of the result rasters.
+
+By default the scripts write uncompressed striped GeoTIFFs. The compressed
+profile writes tiled GeoTIFFs with DEFLATE (or ZSTD if GDAL has it) and a
+predictor. The cloud optimized profile writes the same while processing and
+converts every result into a Cloud-Optimized GeoTIFF with internal overviews
+afterwards, so QGIS can show the risk map at any zoom without reading all
+pixels.
+
+Risk maps and si rasters can also be stored as int16 with scale and offset
+in the band metadata (value = stored * scale + offset, nodata -32768). The
+scale is chosen from the value range of the raster, the rounding error is at
+most half a scale step. GDAL and QGIS apply scale and offset when reading,
+read_block does too.
+"""
+
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from .raster_io import DEFAULT_BLOCK_ROWS, RasterGrid, open_raster, read_window, create_raster, write_window, delete_raster
+
+# profiles
+PLAIN = 'plain'
+COMPRESSED = 'compressed'
+CLOUD_OPTIMIZED = 'cog'
+PROFILES = [PLAIN, COMPRESSED, CLOUD_OPTIMIZED]
+
+# nodata and largest stored value of quantized rasters
+QUANTIZED_NODATA = -32768
+QUANTIZED_MAX = 32767
+
+# edge length of the tiles and of the COG blocks
+TILE_SIZE = 512
+
+
+def compression():
+    '''
+    ZSTD if the GTiff driver of this GDAL build supports it, otherwise DEFLATE
+    '''
+    options = gdal.GetDriverByName('GTiff').GetMetadataItem('DMD_CREATIONOPTIONLIST') or ''
+    return 'ZSTD' if 'ZSTD' in options else 'DEFLATE'
+
+
+def predictor(data_type):
+    '''
+    horizontal differencing for integers, floating point predictor for floats
+    '''
+    return '3' if data_type in (gdal.GDT_Float32, gdal.GDT_Float64) else '2'
+
+
+class OutputProfile:
+    '''
+    Creation options of the result rasters and the conversion of a finished raster
+    '''
+
+    def __init__(self, profile=PLAIN, quantize=False):
+        if profile not in PROFILES:
+            raise ValueError('unknown output profile ' + repr(profile) + ', expected one of ' + ', '.join(PROFILES))
+        self.profile = profile
+        self.quantize = quantize
+
+    def creation_options(self, data_type=gdal.GDT_Float32):
+        '''
+        GTiff creation options of a raster which is written block by block
+        '''
+        if self.profile == PLAIN:
+            return []
+        return ['TILED=YES', 'BLOCKXSIZE=' + str(TILE_SIZE), 'BLOCKYSIZE=' + str(TILE_SIZE),
+                'COMPRESS=' + compression(), 'PREDICTOR=' + predictor(data_type), 'BIGTIFF=IF_SAFER']
+
+    def processing_options(self, data_type=gdal.GDT_Float32):
+        '''
+        creation options as OPTIONS string of the gdal processing algorithms
+        '''
+        return '|'.join(self.creation_options(data_type))
+
+    def finish(self, file, quantize=None, block_rows=DEFAULT_BLOCK_ROWS):
+        '''
+        converts a finished raster in place: int16 quantization (if requested)
+        and Cloud-Optimized GeoTIFF with overviews. Returns the file.
+        '''
+        if quantize is None:
+            quantize = self.quantize
+        if quantize:
+            quantized = temporary_file(file)
+            quantize_raster(file, quantized, self.creation_options(gdal.GDT_Int16), block_rows)
+            replace_raster(quantized, file)
+        if self.profile == CLOUD_OPTIMIZED:
+            converted = temporary_file(file)
+            cloud_optimize(file, converted)
+            replace_raster(converted, file)
+        return file
+
+
+def temporary_file(file):
+    root, extension = os.path.splitext(file)
+    return root + '.tmp' + extension
+
+
+def replace_raster(source, target):
+    '''
+    replaces target (with its side car files) by source
+    '''
+    delete_raster(target)
+    os.replace(source, target)
+
+
+def quantization(minimum, maximum):
+    '''
+    scale and offset mapping [minimum, maximum] to [-32767, 32767]
+    '''
+    offset = (maximum + minimum) / 2.0
+    scale = (maximum - minimum) / (2.0 * QUANTIZED_MAX)
+    return (scale or 1.0), offset
+
+
+def quantize_raster(source, output, options=None, block_rows=DEFAULT_BLOCK_ROWS):
+    '''
+    writes a float raster as int16 with scale and offset, returns (scale, offset).
+    A raster without valid pixels is written as all nodata (scale 1, offset 0).
+    '''
+    dataset = open_raster(source)
+    grid = RasterGrid.from_dataset(dataset)
+    try:
+        minimum, maximum = dataset.GetRasterBand(1).ComputeRasterMinMax(False)
+    except RuntimeError:
+        # GDAL raises without a valid pixel
+        minimum = maximum = None
+    if minimum is None or np.isnan(minimum):
+        # all nodata, every pixel is written as QUANTIZED_NODATA
+        scale, offset = 1.0, 0.0
+    else:
+        scale, offset = quantization(minimum, maximum)
+    output_dataset = create_raster(output, grid, gdal.GDT_Int16, QUANTIZED_NODATA, options=options)
+    band = output_dataset.GetRasterBand(1)
+    band.SetScale(scale)
+    band.SetOffset(offset)
+    for row_off, rows in grid.windows(block_rows):
+        values = read_window(dataset, row_off, rows)
+        stored = np.full(values.shape, QUANTIZED_NODATA, dtype=np.int16)
+        valid = ~np.isnan(values)
+        stored[valid] = np.clip(np.rint((values[valid] - offset) / scale), -QUANTIZED_MAX, QUANTIZED_MAX)
+        write_window(output_dataset, stored, row_off)
+    band = None
+    output_dataset = None
+    return scale, offset
+
+
+def cloud_optimize(source, output):
+    '''
+    copies a raster into a Cloud-Optimized GeoTIFF with internal overviews.
+    Without the COG driver (GDAL < 3.1) a tiled GeoTIFF with overviews is written.
+    '''
+    dataset = open_raster(source)
+    data_type = dataset.GetRasterBand(1).DataType
+    if gdal.GetDriverByName('COG') is not None:
+        options = ['COMPRESS=' + compression(), 'PREDICTOR=YES', 'BLOCKSIZE=' + str(TILE_SIZE),
+                   'OVERVIEWS=AUTO', 'RESAMPLING=AVERAGE', 'BIGTIFF=IF_SAFER', 'NUM_THREADS=ALL_CPUS']
+        gdal.Translate(output, dataset, format='COG', creationOptions=options)
+        return output
+    copy = gdal.Translate(output, dataset, format='GTiff', creationOptions=OutputProfile(COMPRESSED).creation_options(data_type))
+    levels = []
+    size = max(copy.RasterXSize, copy.RasterYSize)
+    while size > TILE_SIZE:
+        size //= 2
+        levels.append(2 ** (len(levels) + 1))
+    if levels:
+        copy.BuildOverviews('AVERAGE', levels)
+    copy = None
+    return output
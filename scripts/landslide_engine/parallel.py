@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Worker pool for the block engines.
+
+Work is split into independent tasks (row ranges of the grid or single
+factors) which open their own GDAL datasets. The results are returned in task
+order and merged by the caller, so a parallel run gives exactly the same
+result as a sequential one.
+"""
+
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def can_spawn_processes():
+    '''
+    True if worker processes can be started. Inside the QGIS application
+    sys.executable is QGIS itself, there a thread pool is used instead
+    (GDAL I/O and most numpy operations release the GIL).
+    '''
+    name = os.path.basename(sys.executable or '').lower()
+    return name.startswith('python')
+
+
+def parallel_map(function, tasks, workers=1, processes=True):
+    '''
+    calls function(*task) for every task with up to workers processes (or
+    threads) and returns the results in task order
+    '''
+    tasks = list(tasks)
+    if workers <= 1 or len(tasks) <= 1:
+        return [function(*task) for task in tasks]
+    if processes and can_spawn_processes():
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        futures = [executor.submit(function, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def row_ranges(grid, parts, block_rows):
+    '''
+    splits the rows of the grid into up to parts ranges (start, stop) aligned to block_rows
+    '''
+    blocks = (grid.ysize + block_rows - 1) // block_rows
+    parts = max(1, min(parts, blocks))
+    ranges = []
+    for part in range(parts):
+        start = (blocks * part // parts) * block_rows
+        stop = min(grid.ysize, (blocks * (part + 1) // parts) * block_rows)
+        if stop > start:
+            ranges.append((start, stop))
+    return ranges
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""
+Road proximity on the dgm grid.
+
+The road lines are reprojected to the CRS of the dgm and burnt directly on
+the dgm grid, the distances (in map units, between pixel centres like
+gdal:proximity) come from an exact Euclidean distance transform (Felzenszwalb
+& Huttenlocher 2012): a column pass and a lower envelope of parabolas per row,
+both linear in the number of pixels and vectorized over all columns/rows.
+With a maximum distance only strips with a halo of that distance are burnt
+and transformed, farther pixels get max_distance + one pixel size. The pixel
+size is taken as metres, so the dgm needs a projected CRS.
+"""
+
+import math
+import uuid
+
+import numpy as np
+from osgeo import gdal, osr
+
+from .raster_io import DEFAULT_BLOCK_ROWS, create_raster, write_window
+from .reclassify import parse_table
+from .cache import source_file
+
+
+def largest_break(table):
+    '''
+    largest finite class break of a reclassification table (e.g. 90 for the roads table)
+    '''
+    minimum, maximum, values = parse_table(table)
+    breaks = np.concatenate([minimum, maximum])
+    return float(breaks[np.isfinite(breaks)].max())
+
+
+def reproject_lines(vector, grid):
+    '''
+    copies the features of a vector file in the CRS of the grid to /vsimem/, returns the temporary file
+    '''
+    # unique name, several jobs may burn roads at the same time
+    temporary = '/vsimem/landslide_roads_' + uuid.uuid4().hex + '.gpkg'
+    gdal.VectorTranslate(temporary, source_file(vector), format='GPKG', dstSRS=grid.projection or None)
+    return temporary
+
+
+def burn_lines(lines, grid, row_off=0, rows=None):
+    '''
+    burns the features of a vector file (in the CRS of the grid) on rows of the grid from row_off (all touched pixels)
+    and returns a boolean array, only the window is held in memory
+    '''
+    if rows is None:
+        rows = grid.ysize - row_off
+    x0, dx, rx, y0, ry, dy = grid.geotransform
+    dataset = gdal.GetDriverByName('MEM').Create('', grid.xsize, rows, 1, gdal.GDT_Byte)
+    dataset.SetGeoTransform((x0 + row_off * rx, dx, rx, y0 + row_off * dy, ry, dy))
+    if grid.projection:
+        dataset.SetProjection(grid.projection)
+    gdal.Rasterize(dataset, lines, burnValues=[1], allTouched=True)
+    return dataset.GetRasterBand(1).ReadAsArray() > 0
+
+
+def _column_distances(mask, cell_x, cell_y):
+    '''
+    squared distance to the nearest feature pixel in the same column (large value if there is none)
+    '''
+    rows, cols = mask.shape
+    # larger than any distance inside the block
+    far = 4.0 * ((rows * cell_y) ** 2 + (cols * cell_x) ** 2) + 1.0
+    index = np.arange(rows)[:, None]
+    # last feature row above (or at) every pixel and first feature row below
+    above = np.maximum.accumulate(np.where(mask, index, -1), axis=0)
+    below = np.minimum.accumulate(np.where(mask, index, rows)[::-1], axis=0)[::-1]
+    distance = np.minimum(np.where(above >= 0, index - above, rows + cols),
+                          np.where(below < rows, below - index, rows + cols)).astype(np.float64)
+    squared = (distance * cell_y) ** 2
+    squared[distance >= rows + cols] = far
+    return squared
+
+
+def _row_envelope(squared, cell_x):
+    '''
+    lower envelope of the parabolas (x - q)^2 + f(q) of every row, vectorized over all rows
+    '''
+    rows, cols = squared.shape
+    all_rows = np.arange(rows)
+    positions = np.arange(cols) * abs(cell_x)
+    # locations of the parabolas of the envelope and the boundaries between them
+    v = np.zeros((rows, cols), dtype=np.int64)
+    z = np.full((rows, cols + 1), np.inf)
+    z[:, 0] = -np.inf
+    k = np.zeros(rows, dtype=np.int64)
+    for q in range(1, cols):
+        f_q = squared[:, q] + positions[q] ** 2
+        while True:
+            vk = v[all_rows, k]
+            s = (f_q - (squared[all_rows, vk] + positions[vk] ** 2)) / (2.0 * (positions[q] - positions[vk]))
+            hidden = s <= z[all_rows, k]
+            if not hidden.any():
+                break
+            # parabolas hidden by the new one are removed (k never drops below 0, z[0] is -inf)
+            k[hidden] -= 1
+        k += 1
+        v[all_rows, k] = q
+        z[all_rows, k] = s
+        z[all_rows, k + 1] = np.inf
+
+    result = np.empty((rows, cols))
+    k = np.zeros(rows, dtype=np.int64)
+    for x in range(cols):
+        while True:
+            ahead = z[all_rows, k + 1] < positions[x]
+            if not ahead.any():
+                break
+            k[ahead] += 1
+        vk = v[all_rows, k]
+        result[:, x] = (positions[x] - positions[vk]) ** 2 + squared[all_rows, vk]
+    return result
+
+
+def distance_transform(mask, cell_x, cell_y):
+    '''
+    exact Euclidean distance (map units) of every pixel to the nearest True pixel of mask
+    '''
+    if mask.size == 0:
+        return np.zeros(mask.shape)
+    return np.sqrt(_row_envelope(_column_distances(mask, cell_x, cell_y), cell_x))
+
+
+def proximity_raster(vector, grid, output, max_distance=None, block_rows=DEFAULT_BLOCK_ROWS):
+    '''
+    writes the distance to the features of a vector file on the grid as
+    Float32 raster. With max_distance the distances are exact up to
+    max_distance and calculated strip by strip, farther pixels get
+    max_distance + one pixel size, and the lines are burnt strip by strip.
+    The grid needs a projected CRS.
+    '''
+    if grid.projection and osr.SpatialReference(grid.projection).IsGeographic():
+        # the pixel size is used as metres (and the maximum distance is given in metres)
+        raise ValueError('The road distances need a projected CRS of the dgm, not a geographic one')
+    cell_x = abs(grid.geotransform[1])
+    cell_y = abs(grid.geotransform[5])
+    lines = reproject_lines(vector, grid)
+    try:
+        dataset = create_raster(output, grid)
+        if max_distance is None:
+            write_window(dataset, distance_transform(burn_lines(lines, grid), cell_x, cell_y).astype(np.float32), 0)
+        else:
+            halo = int(math.ceil(max_distance / cell_y))
+            beyond = max_distance + max(cell_x, cell_y)
+            for row_off, rows in grid.windows(block_rows):
+                # the lines are burnt per strip with its halo, the grid is never burnt as a whole
+                top = max(0, row_off - halo)
+                bottom = min(grid.ysize, row_off + rows + halo)
+                mask = burn_lines(lines, grid, top, bottom - top)
+                distance = distance_transform(mask, cell_x, cell_y)[row_off - top:row_off - top + rows]
+                distance[distance > max_distance] = beyond
+                write_window(dataset, distance.astype(np.float32), row_off)
+    finally:
+        gdal.Unlink(lines)
+    dataset = None
+    return output
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+Block-wise raster access on a common reference grid.
+
+All engines read their inputs window by window on the grid of one reference
+raster (the dgm or the risk map), so pixels of different layers can be
+compared by array index without writing warped copies to disk.
+"""
+
+import os
+
+import numpy as np
+from osgeo import gdal
+
+gdal.UseExceptions()
+
+# nodata value used by all rasters written by the scripts
+NODATA = -9999
+
+# number of raster rows read at once
+DEFAULT_BLOCK_ROWS = 256
+
+
+class RasterGrid:
+    '''
+    Geotransform, size and projection of a raster used as reference grid
+    '''
+
+    def __init__(self, geotransform, xsize, ysize, projection=''):
+        self.geotransform = tuple(geotransform)
+        self.xsize = int(xsize)
+        self.ysize = int(ysize)
+        self.projection = projection
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        return cls(dataset.GetGeoTransform(), dataset.RasterXSize, dataset.RasterYSize, dataset.GetProjection())
+
+    @classmethod
+    def from_path(cls, path):
+        return cls.from_dataset(open_raster(path))
+
+    @property
+    def extent(self):
+        '''
+        extent as (xmin, ymin, xmax, ymax)
+        '''
+        x0, dx, _, y0, _, dy = self.geotransform
+        x1 = x0 + dx * self.xsize
+        y1 = y0 + dy * self.ysize
+        return (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+    @property
+    def pixel_count(self):
+        return self.xsize * self.ysize
+
+    def matches(self, dataset):
+        '''
+        True if the dataset has exactly the same pixel grid
+        '''
+        if dataset.RasterXSize != self.xsize or dataset.RasterYSize != self.ysize:
+            return False
+        other = dataset.GetGeoTransform()
+        # tolerate rounding in the geotransform up to 1/1000 pixel
+        tolerance = abs(self.geotransform[1]) / 1000.0
+        return all(abs(a - b) <= tolerance for a, b in zip(self.geotransform, other))
+
+    def windows(self, block_rows=DEFAULT_BLOCK_ROWS, row_start=0, row_stop=None):
+        '''
+        yields (row offset, number of rows) of horizontal strips covering the
+        grid (or the rows row_start..row_stop)
+        '''
+        if row_stop is None:
+            row_stop = self.ysize
+        row_off = row_start
+        while row_off < row_stop:
+            rows = min(block_rows, row_stop - row_off)
+            yield row_off, rows
+            row_off += rows
+
+
+def open_raster(source):
+    '''
+    opens a raster path (or returns an already opened gdal dataset)
+    '''
+    if isinstance(source, gdal.Dataset):
+        return source
+    dataset = gdal.Open(str(source))
+    if dataset is None:
+        raise IOError('Could not open raster ' + str(source))
+    return dataset
+
+
+def open_on_grid(source, grid):
+    '''
+    opens a raster so that it can be read on the reference grid.
+    Rasters with a different grid are wrapped in a virtual warped dataset
+    (nearest neighbour), which replaces the gdal:warpreproject step.
+    '''
+    dataset = open_raster(source)
+    if grid.matches(dataset):
+        return dataset
+    options = gdal.WarpOptions(format='VRT',
+                               outputBounds=grid.extent,
+                               width=grid.xsize,
+                               height=grid.ysize,
+                               dstSRS=grid.projection or None,
+                               resampleAlg='near',
+                               outputType=gdal.GDT_Float32,
+                               dstNodata=NODATA)
+    return gdal.Warp('', dataset, options=options)
+
+
+def write_on_grid(source, grid, file):
+    '''
+    writes a raster on the reference grid to file (e.g. the window of a tile of a larger raster), returns file
+    '''
+    gdal.Translate(str(file), open_on_grid(source, grid))
+    return file
+
+
+def read_window(dataset, row_off, rows, band=1):
+    '''
+    reads a strip of rows as float64 array, nodata pixels are set to nan
+    '''
+    return read_block(dataset, 0, row_off, dataset.RasterXSize, rows, band)
+
+
+def read_block(dataset, col_off, row_off, cols, rows, band=1):
+    '''
+    reads a rectangular block as float64 array, nodata pixels are set to nan.
+    Scale and offset of the band (quantized rasters) are applied.
+    '''
+    raster_band = dataset.GetRasterBand(band)
+    array = raster_band.ReadAsArray(col_off, row_off, cols, rows).astype(np.float64)
+    nodata = raster_band.GetNoDataValue()
+    if nodata is not None and not np.isnan(nodata):
+        array[array == nodata] = np.nan
+    scale = raster_band.GetScale()
+    offset = raster_band.GetOffset()
+    if (scale is not None and scale != 1.0) or offset:
+        array = array * (1.0 if scale is None else scale) + (offset or 0.0)
+    return array
+
+
+def landslide_pixels(array):
+    '''
+    boolean array of landslide pixels (valid pixels with a value > 0)
+    '''
+    return np.nan_to_num(array, nan=0.0) > 0
+
+
+def create_raster(path, grid, data_type=gdal.GDT_Float32, nodata=NODATA, driver='GTiff', options=None):
+    '''
+    creates an empty single band raster on the reference grid
+    '''
+    dataset = gdal.GetDriverByName(driver).Create(str(path), grid.xsize, grid.ysize, 1, data_type, options or [])
+    dataset.SetGeoTransform(grid.geotransform)
+    if grid.projection:
+        dataset.SetProjection(grid.projection)
+    if nodata is not None:
+        dataset.GetRasterBand(1).SetNoDataValue(nodata)
+    return dataset
+
+
+def write_window(dataset, array, row_off, nodata=NODATA, col_off=0):
+    '''
+    writes a strip of rows (or a block starting at col_off), nan is written as nodata
+    '''
+    if nodata is not None and np.issubdtype(array.dtype, np.floating):
+        array = np.where(np.isnan(array), nodata, array)
+    dataset.GetRasterBand(1).WriteArray(array, col_off, row_off)
+
+
+def delete_raster(file):
+    '''
+    deletes a raster file including its side car files (.aux.xml, .sgrd, ...)
+    '''
+    driver = gdal.IdentifyDriver(str(file))
+    if driver is not None:
+        driver.Delete(str(file))
+
+
+def is_virtual(path):
+    '''
+    True for paths of GDAL's virtual file systems (/vsimem/, /vsizip/, ...)
+    '''
+    return str(path).replace('\\', '/').startswith('/vsi')
+
+
+def make_folder(folder):
+    '''
+    creates a folder on disk if it does not exist (folders in /vsimem/ need not be created)
+    '''
+    if folder and not is_virtual(folder) and not os.path.exists(folder):
+        os.makedirs(folder)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+Vectorized reclassification with the tables of native:reclassifybytable.
+
+A table in the flat format ['min','max','value','min','max','value',...]
+('' means minus or plus infinity) is compiled once:
+range tables become sorted break arrays which are applied with
+np.searchsorted, tables of single integer values (like the statistical index
+tables) become a dense lookup array indexed by class code.
+"""
+
+import numpy as np
+
+from .raster_io import (RasterGrid, DEFAULT_BLOCK_ROWS, open_raster, open_on_grid,
+                        read_window, create_raster, write_window)
+from .parallel import parallel_map
+
+# RANGE_BOUNDARIES of native:reclassifybytable
+MIN_EXCLUSIVE_MAX_INCLUSIVE = 0
+MIN_INCLUSIVE_MAX_EXCLUSIVE = 1
+MIN_INCLUSIVE_MAX_INCLUSIVE = 2
+MIN_EXCLUSIVE_MAX_EXCLUSIVE = 3
+
+
+def parse_table(table):
+    '''
+    returns min, max and value arrays of a flat reclassification table
+    '''
+    if len(table) % 3 != 0:
+        raise ValueError('A reclassification table needs 3 entries (min, max, value) per row')
+    minimum = np.array([float(value) if str(value) != '' else -np.inf for value in table[0::3]])
+    maximum = np.array([float(value) if str(value) != '' else np.inf for value in table[1::3]])
+    values = np.array([float(value) for value in table[2::3]])
+    return minimum, maximum, values
+
+
+class ReclassTable:
+    '''
+    Compiled reclassification table. Values which match no row keep their
+    value (NODATA_FOR_MISSING False), nan (nodata) stays nan.
+    '''
+
+    def __init__(self, table, range_boundaries=MIN_EXCLUSIVE_MAX_INCLUSIVE):
+        self.range_boundaries = range_boundaries
+        # flat table as given, e.g. to write it into a manifest
+        self.table = [str(value) for value in table]
+        minimum, maximum, values = parse_table(table)
+        self.exact = (minimum.size > 0 and np.array_equal(minimum, maximum)
+                      and np.all(np.isfinite(minimum)) and np.all(minimum == np.round(minimum))
+                      and range_boundaries == MIN_INCLUSIVE_MAX_INCLUSIVE)
+        if self.exact:
+            self._compile_lookup(minimum.astype(np.int64), values)
+        else:
+            self._compile_breaks(minimum, maximum, values)
+
+    def _compile_lookup(self, codes, values):
+        self.offset = int(codes.min())
+        self.lookup = np.full(int(codes.max()) - self.offset + 1, np.nan)
+        # the first row wins like in the processing tool
+        self.lookup[codes[::-1] - self.offset] = values[::-1]
+
+    def _compile_breaks(self, minimum, maximum, values):
+        order = np.lexsort((maximum, minimum))
+        self.minimum = minimum[order]
+        self.maximum = maximum[order]
+        self.values = values[order]
+        # overlapping rows can not be resolved with one searchsorted,
+        # they are applied row by row in reversed table order instead
+        self.overlapping = bool(np.any(self.minimum[1:] < self.maximum[:-1]))
+        if self.range_boundaries == MIN_INCLUSIVE_MAX_INCLUSIVE:
+            # a break of two touching rows matches both, the lower one wins in the search but the first in the table
+            self.overlapping |= bool(np.any((self.minimum[1:] == self.maximum[:-1]) & (order[1:] < order[:-1])))
+        self.rows = (minimum, maximum, values)
+
+    def output_values(self):
+        '''
+        sorted distinct values of a range table which covers all numbers without gaps,
+        otherwise None (unmatched values keep their value)
+        '''
+        if self.exact or self.overlapping or self.minimum.size == 0:
+            return None
+        if self.minimum[0] != -np.inf or self.maximum[-1] != np.inf or np.any(self.minimum[1:] != self.maximum[:-1]):
+            return None
+        if self.range_boundaries == MIN_EXCLUSIVE_MAX_EXCLUSIVE and self.minimum.size > 1:
+            # the break values themselves match no row
+            return None
+        return sorted(set(self.values.tolist()))
+
+    def _row_match(self, array, minimum, maximum):
+        if self.range_boundaries in (MIN_EXCLUSIVE_MAX_INCLUSIVE, MIN_EXCLUSIVE_MAX_EXCLUSIVE):
+            above = array > minimum
+        else:
+            above = array >= minimum
+        if self.range_boundaries in (MIN_EXCLUSIVE_MAX_INCLUSIVE, MIN_INCLUSIVE_MAX_INCLUSIVE):
+            below = array <= maximum
+        else:
+            below = array < maximum
+        return above & below
+
+    def apply(self, array):
+        '''
+        reclassifies a float array (nan = nodata) and returns a new float64 array
+        '''
+        result = np.array(array, dtype=np.float64)
+        valid = ~np.isnan(result)
+        if self.exact:
+            values = result[valid]
+            index = values.astype(np.int64) - self.offset
+            matched = (values == np.round(values)) & (index >= 0) & (index < self.lookup.size)
+            new_values = np.full(values.shape, np.nan)
+            new_values[matched] = self.lookup[index[matched]]
+            matched &= ~np.isnan(new_values)
+            values[matched] = new_values[matched]
+            result[valid] = values
+            return result
+        if self.overlapping:
+            minimum, maximum, values = self.rows
+            output = result.copy()
+            for row in range(minimum.size - 1, -1, -1):
+                output[valid & self._row_match(result, minimum[row], maximum[row])] = values[row]
+            return output
+        values = result[valid]
+        if self.range_boundaries in (MIN_EXCLUSIVE_MAX_INCLUSIVE, MIN_INCLUSIVE_MAX_INCLUSIVE):
+            # first row with max >= value
+            row = np.searchsorted(self.maximum, values, side='left')
+        else:
+            # first row with max > value
+            row = np.searchsorted(self.maximum, values, side='right')
+        inside = row < self.maximum.size
+        row = np.minimum(row, self.maximum.size - 1)
+        matched = inside & self._row_match(values, self.minimum[row], self.maximum[row])
+        values[matched] = self.values[row[matched]]
+        result[valid] = values
+        return result
+
+
+def apply_tables(array, tables):
+    '''
+    applies a chain of ReclassTables (None entries are skipped)
+    '''
+    for table in tables:
+        if table is not None:
+            array = table.apply(array)
+    return array
+
+
+def reclassify_raster(raster, tables, output, grid=None, block_rows=DEFAULT_BLOCK_ROWS, options=None):
+    '''
+    reclassifies a raster block by block with one or more ReclassTables and
+    writes a Float32 raster on the grid (default: grid of the input raster)
+    with the GTiff creation options
+    '''
+    if isinstance(tables, ReclassTable):
+        tables = [tables]
+    if grid is None:
+        grid = RasterGrid.from_dataset(open_raster(raster))
+    dataset = open_on_grid(raster, grid)
+    output_dataset = create_raster(output, grid, options=options)
+    for row_off, rows in grid.windows(block_rows):
+        block = apply_tables(read_window(dataset, row_off, rows), tables)
+        write_window(output_dataset, block.astype(np.float32), row_off)
+    output_dataset = None
+    return output
+
+
+def reclassify_rasters(jobs, grid=None, block_rows=DEFAULT_BLOCK_ROWS, workers=1, options=None):
+    '''
+    runs reclassify_raster for a list of (raster, tables, output) jobs, with
+    several workers one raster per worker. Returns the output files in job order.
+    '''
+    tasks = [(raster, tables, output, grid, block_rows, options) for raster, tables, output in jobs]
+    return parallel_map(reclassify_raster, tasks, workers)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+Single pass ROC calculation for landslide risk maps.
+
+Instead of reclassifying the risk map and running zonal statistics for every
+threshold, the risk map and the landslide raster are read once and the risk
+values are collected in a fine histogram, split into landslide and
+non-landslide pixels. TPR and FPR for any threshold and the AUC follow from
+cumulative sums over this histogram.
+"""
+
+import numpy as np
+
+from .raster_io import (RasterGrid, DEFAULT_BLOCK_ROWS, open_raster, open_on_grid,
+                        read_window, landslide_pixels)
+
+# number of histogram bins, the bin width is at most 2 * range / DEFAULT_BINS
+DEFAULT_BINS = 65536
+
+
+class RiskHistogram:
+    '''
+    Histogram of risk values for landslide and non-landslide pixels.
+    If no value range is given, the range grows while data is added by
+    doubling the bin width, so the risk map only has to be read once.
+    '''
+
+    def __init__(self, bins=DEFAULT_BINS, value_range=None):
+        # an even number of bins is needed to merge neighbours when the range grows
+        self.bins = bins + bins % 2
+        self.landslide = np.zeros(self.bins, dtype=np.int64)
+        self.stable = np.zeros(self.bins, dtype=np.int64)
+        self.min_value = np.inf
+        self.max_value = -np.inf
+        self.lower = None
+        self.width = None
+        self.fixed = value_range is not None
+        if self.fixed:
+            self.lower = float(value_range[0])
+            self.width = (float(value_range[1]) - self.lower) / self.bins or 1.0
+
+    @property
+    def upper(self):
+        return self.lower + self.width * self.bins
+
+    @property
+    def centers(self):
+        return self.lower + (np.arange(self.bins) + 0.5) * self.width
+
+    @property
+    def landslide_count(self):
+        return int(self.landslide.sum())
+
+    @property
+    def stable_count(self):
+        return int(self.stable.sum())
+
+    def _cover(self, vmin, vmax):
+        '''
+        grows the histogram range until [vmin, vmax] is inside
+        '''
+        if self.lower is None:
+            span = vmax - vmin
+            if span <= 0:
+                span = max(abs(vmin), 1.0) * 1e-6
+            self.lower = vmin
+            self.width = span / (self.bins - 1)
+            return
+        half = self.bins // 2
+        while vmin < self.lower or vmax >= self.upper:
+            landslide = self.landslide.reshape(half, 2).sum(axis=1)
+            stable = self.stable.reshape(half, 2).sum(axis=1)
+            self.landslide = np.zeros(self.bins, dtype=np.int64)
+            self.stable = np.zeros(self.bins, dtype=np.int64)
+            if vmin < self.lower:
+                # extend to the left, old bins end up in the upper half
+                self.lower -= self.width * self.bins
+                self.landslide[half:] = landslide
+                self.stable[half:] = stable
+            else:
+                self.landslide[:half] = landslide
+                self.stable[:half] = stable
+            self.width *= 2
+
+    def add(self, values, is_landslide):
+        '''
+        adds 1d arrays of valid risk values and the matching landslide flags
+        '''
+        if values.size == 0:
+            return
+        vmin = float(values.min())
+        vmax = float(values.max())
+        self.min_value = min(self.min_value, vmin)
+        self.max_value = max(self.max_value, vmax)
+        if not self.fixed:
+            self._cover(vmin, vmax)
+        index = ((values - self.lower) / self.width).astype(np.int64)
+        np.clip(index, 0, self.bins - 1, out=index)
+        self.landslide += np.bincount(index[is_landslide], minlength=self.bins)
+        self.stable += np.bincount(index[~is_landslide], minlength=self.bins)
+
+    def merge(self, other):
+        '''
+        adds the counts of another histogram with the same bins
+        '''
+        if other.lower is None:
+            return
+        if self.lower is None:
+            self.lower, self.width = other.lower, other.width
+        if other.lower != self.lower or other.width != self.width or other.bins != self.bins:
+            raise ValueError('Histograms with different bins can not be merged')
+        self.landslide += other.landslide
+        self.stable += other.stable
+        self.min_value = min(self.min_value, other.min_value)
+        self.max_value = max(self.max_value, other.max_value)
+
+    def thresholds(self, iterations):
+        '''
+        equally spaced thresholds between min and max, like the original ROC loop
+        '''
+        step = (self.max_value - self.min_value) / (float(iterations) + 1)
+        return self.min_value + step * np.arange(1, int(iterations) + 1)
+
+    def _totals(self):
+        landslide_total = self.landslide_count
+        stable_total = self.stable_count
+        if landslide_total == 0 or stable_total == 0:
+            raise ValueError('The risk map needs landslide and non-landslide pixels to calculate a ROC')
+        return landslide_total, stable_total
+
+    def curve(self, thresholds):
+        '''
+        returns tpr and fpr arrays, pixels with a risk value > threshold are positive
+        '''
+        landslide_total, stable_total = self._totals()
+        # tail[k] = pixels in bins k..end, tail[bins] = 0
+        landslide_tail = np.append(np.cumsum(self.landslide[::-1])[::-1], 0)
+        stable_tail = np.append(np.cumsum(self.stable[::-1])[::-1], 0)
+        first_positive = np.searchsorted(self.centers, np.asarray(thresholds, dtype=np.float64), side='right')
+        tpr = landslide_tail[first_positive] / landslide_total
+        fpr = stable_tail[first_positive] / stable_total
+        return tpr, fpr
+
+    def auc(self):
+        '''
+        area under the ROC curve using every bin edge as threshold
+        (pixels inside the same bin count as ties)
+        '''
+        landslide_total, stable_total = self._totals()
+        # roc points from the highest bin downwards, starting at (0, 0)
+        tpr = np.append(0.0, np.cumsum(self.landslide[::-1]) / landslide_total)
+        fpr = np.append(0.0, np.cumsum(self.stable[::-1]) / stable_total)
+        return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2.0))
+
+
+def risk_histogram(risk_map, landslides, mask=None, bins=DEFAULT_BINS, block_rows=DEFAULT_BLOCK_ROWS):
+    '''
+    reads the risk map, the landslide raster and an optional mask raster
+    (pixels >= 1 are used) once and returns the filled RiskHistogram
+    '''
+    risk_dataset = open_raster(risk_map)
+    grid = RasterGrid.from_dataset(risk_dataset)
+    landslide_dataset = open_on_grid(landslides, grid)
+    mask_dataset = open_on_grid(mask, grid) if mask is not None else None
+
+    histogram = RiskHistogram(bins)
+    for row_off, rows in grid.windows(block_rows):
+        risk = read_window(risk_dataset, row_off, rows)
+        valid = ~np.isnan(risk)
+        if mask_dataset is not None:
+            valid &= np.nan_to_num(read_window(mask_dataset, row_off, rows), nan=0.0) >= 1
+        is_landslide = landslide_pixels(read_window(landslide_dataset, row_off, rows))
+        histogram.add(risk[valid], is_landslide[valid])
+    return histogram
+
+
+def write_roc(file, tpr, fpr):
+    '''
+    writes tpr,fpr pairs line by line (same format as the processing based ROC)
+    '''
+    with open(file, 'w') as f:
+        for tpr_value, fpr_value in zip(tpr, fpr):
+            f.write(str(tpr_value) + ',' + str(fpr_value) + '\n')
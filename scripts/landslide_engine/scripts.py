@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+
+"""
+Settings and methods shared by the processing scripts.
+
+The SI, WF, combined and ROC scripts are separate QGIS processing algorithms
+(ExampleProcessingAlgorithm in every file), but they prepare the factors the
+same way. The reclassification tables, the road distance settings and the
+methods for terrain derivatives, catchment area, cache and output files are
+kept here once; the algorithms inherit them from ScriptMixin:
+
+    class ExampleProcessingAlgorithm(ScriptMixin, QgsProcessingAlgorithm):
+
+The methods use the attributes set in processAlgorithm (output, tracer,
+intermediates, terrain_engine, flow_method, memory_budget, dgm). QGIS is only
+imported when a processing tool is run, so the engine can still be used
+without QGIS.
+"""
+
+import csv
+import os
+
+from .raster_io import RasterGrid, is_virtual, open_raster, write_on_grid
+from .reclassify import ReclassTable
+from .statistics import Factor
+from .terrain import terrain_derivatives
+from .hydrology import catchment_area, wetness_indices
+from .parallel import parallel_map
+from .inventory import InventoryManifest, inventory_pixels, diff_inventory
+
+# reclassification tables of the continuous factors, flat ['min','max','class',...], '' means - or + infinity
+TWI_TABLE = ['','-7','0','-7','0','1','0','7','2','7','','3']
+SPI_TABLE = ['','250','0','250','500','1','500','750','2','750','1000','3','1000','','4']
+SLOPE_TABLE = ['','10','0','10','20','1','20','30','2','30','40','3','40','50','4','50','','6']
+ASPECT_TABLE = ['0','45','0','45','90','1','90','135','2','135','180','3','180','225','4','225','270','5','270','315','6','315','360','7']
+C_PLAN_TABLE = ['','0','0','0','','1']
+C_PROF_TABLE = ['','0','0','0','','1']
+ROADS_TABLE = ['','30','0','30','60','1','60','90','2','90','','3']
+DGM_TABLE = ['','500','0','500','1000','1','1000','1500','2','1500','2000','3','2000','','4']
+
+# factor name, terrain output and table of the terrain derivatives, in the factor order of the scripts
+TERRAIN_FACTORS = [('twi', 'TWI', TWI_TABLE), ('spi', 'SPI', SPI_TABLE), ('slope', 'SLOPE', SLOPE_TABLE),
+                   ('aspect', 'ASPECT', ASPECT_TABLE), ('plan_curvature', 'C_PLAN', C_PLAN_TABLE),
+                   ('profile_curvature', 'C_PROF', C_PROF_TABLE)]
+
+# tables of the terrain factors, part of the cache key of the class code rasters
+TERRAIN_TABLES = dict((name, table) for name, output, table in TERRAIN_FACTORS)
+
+# settings of the road distances (processing path), part of the cache key of derived rasters
+ROADS_PARAMETERS = {'TARGET_CRS':'EPSG:32648','WIDTH':30,'HEIGHT':30}
+
+# processing providers whose algorithms run command line tools in separate processes (they can not read or write /vsimem/)
+SEPARATE_PROVIDERS = ['gdal', 'saga']
+
+# names of the 13 factors, in the order of the si rasters
+RASTER_NAMES = ['dgm','precip','soil','landuse','lithosphere','waterbodies','roads','twi','spi','slope','aspect','plan_curvature','profile_curvature']
+
+# raster inputs of the SI, WF and combined scripts (the roads are a vector layer)
+RASTER_INPUTS = ['landslides', 'dgm', 'viewshed', 'soil', 'lithosphere', 'landuse', 'waterbodies', 'precipation']
+
+# inputs which are used as factor rasters as they are (input: factor name), an incremental run rebuilds only a replaced one
+FACTOR_INPUTS = {'soil':'soil','lithosphere':'lithosphere','landuse':'landuse','waterbodies':'waterbodies','precipation':'precip'}
+
+
+def terrain_factors(terrain=None):
+    '''
+    Factors of the terrain derivatives with their tables. The raster is the
+    file in terrain ({output: file}) or the output name if terrain is None.
+    '''
+    return [Factor(name, output if terrain is None else terrain[output], ReclassTable(table))
+            for name, output, table in TERRAIN_FACTORS]
+
+
+def unique_values_from_csv(file):
+    '''
+    Returns an array of the parameter classes for each raster
+    '''
+    with open(file) as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        i = 0
+        list = []
+        for row in csv_reader:
+            if i != 0:
+                # str->float->int->str to remove decimal places
+                list.append(str(int(float(row[0]))))
+            i += 1
+        return list
+
+
+def zonal_statistics_as_dic_from_csv(file):
+    '''
+    reads the zonal statistics as dic from csv
+    '''
+    with open(file) as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        i = 0
+        dic = {}
+        for row in csv_reader:
+            if i != 0:
+                # str->float->int->str to remove decimal places
+                dic.update({str(int(float(row[0]))): float(row[3])})
+            i += 1
+        return dic
+
+
+class ScriptMixin:
+    """
+    Methods shared by the processing algorithms, mixed into QgsProcessingAlgorithm.
+    """
+
+    def terrainDerivatives(self, dgm):
+        """
+        Calculates slope, aspect, curvature, twi and spi of a dgm file (or a dgm tile) and returns the files as dictionary.
+        Both engines derive twi and spi from the native specific catchment area of the whole dgm.
+        """
+        if self.terrain_engine == 0:
+            terrain = self.tracer.traced(lambda: terrain_derivatives(dgm, self.terrainFolder()), 'native:terrainderivatives')
+            sca = self.catchmentArea()
+            terrain.update(self.tracer.traced(lambda: wetness_indices(sca, terrain['SLOPE'], self.terrainFolder()), 'native:wetnessindices'))
+            return terrain
+        # SAGA grids in the terrain folder of the run
+        saga_grid = lambda name: os.path.join(self.terrainFolder(), name+'.sdat')
+        slopeaspectcurvature = self.run("saga:slopeaspectcurvature", {'ELEVATION':dgm,'SLOPE':saga_grid('SLOPE'),'ASPECT':saga_grid('ASPECT'),'C_GENE':saga_grid('C_GENE'),'C_PROF':saga_grid('C_PROF'),'C_PLAN':saga_grid('C_PLAN'),'C_TANG':saga_grid('C_TANG'),'C_LONG':saga_grid('C_LONG'),'C_CROS':saga_grid('C_CROS'),'C_MINI':saga_grid('C_MINI'),'C_MAXI':saga_grid('C_MAXI'),'C_TOTA':saga_grid('C_TOTA'),'C_ROTO':saga_grid('C_ROTO'),'METHOD':6,'UNIT_SLOPE':1,'UNIT_ASPECT':1})
+        terrain = {'SLOPE':slopeaspectcurvature['SLOPE'],'ASPECT':slopeaspectcurvature['ASPECT'],'C_PLAN':slopeaspectcurvature['C_PLAN'],'C_PROF':slopeaspectcurvature['C_PROF']}
+        # the specific catchment area of the whole dgm, not the dgm itself
+        sca = self.catchmentArea()
+        grid = RasterGrid.from_path(dgm)
+        if not grid.matches(open_raster(sca)):
+            # a dgm tile (tiled mode): SAGA needs the catchment area on the grid of the tile slope
+            sca = write_on_grid(sca, grid, os.path.join(self.terrainFolder(), 'SCA_tile.tif'))
+        twi = self.run("saga:topographicwetnessindextwi", {'SLOPE':terrain['SLOPE'],'AREA':sca,'TRANS':None,'TWI':saga_grid('TWI'),'CONV':0,'METHOD':0})
+        spi = self.run("saga:streampowerindex", {'SLOPE':terrain['SLOPE'],'AREA':sca,'SPI':saga_grid('SPI'),'CONV':0})
+        terrain.update({'TWI':twi['TWI'],'SPI':spi['SPI']})
+        return terrain
+
+    def catchmentArea(self):
+        """
+        Returns the specific catchment area raster of the whole dgm, it is calculated once per run in tiles of the memory budget.
+        """
+        if self.catchment_area is None:
+            folder = self.terrainFolder()
+            scratch = None
+            if self.memory_budget > 0 and is_virtual(folder):
+                # the temporary rasters of the tiles would hold the whole dgm in memory
+                scratch = self.intermediates.folder('hydrology', in_process=False)
+            self.catchment_area = self.tracer.traced(lambda: catchment_area(self.dgm, os.path.join(folder, 'SCA.tif'), self.flow_method, self.memory_budget, scratch), 'native:catchmentarea')
+            if scratch is not None:
+                self.intermediates.release(scratch)
+        return self.catchment_area
+
+    def terrainFolder(self):
+        """
+        Returns the intermediate folder of the terrain derivatives (in memory for the native engine if they fit), it is created once per run.
+        """
+        if self.terrain_folder is None:
+            # slope, aspect, two curvatures, twi, spi and catchment area as Float32
+            self.terrain_folder = self.intermediates.folder('terrain', RasterGrid.from_path(self.dgm).pixel_count * 4 * 7, in_process=self.in_process and self.terrain_engine == 0)
+        return self.terrain_folder
+
+    def terrainParameters(self):
+        """
+        Returns the settings of the terrain derivatives, part of the cache key of derived rasters.
+        """
+        if self.terrain_engine == 0:
+            return {'tool':'native','method':'zevenbergen_thorne','UNIT_SLOPE':1,'UNIT_ASPECT':1,'FLOW':self.flow_method}
+        return {'tool':'saga','METHOD':6,'UNIT_SLOPE':1,'UNIT_ASPECT':1,'TWI_METHOD':0,'CONV':0,'AREA':'native','FLOW':self.flow_method}
+
+    def roadsDistance(self, roads):
+        """
+        Calculates the euclidian distance to the roads and returns the file as dictionary.
+        """
+        from qgis.core import QgsCoordinateReferenceSystem
+        roads_utm = self.run("native:reprojectlayer", {'INPUT':roads,'TARGET_CRS':QgsCoordinateReferenceSystem(ROADS_PARAMETERS['TARGET_CRS']),'OPERATION':'+proj=pipeline +step +proj=unitconvert +xy_in=deg +xy_out=rad +step +proj=utm +zone=48 +ellps=WGS84','OUTPUT':self.intermediates.file('roads_utm.gpkg', in_process=self.inProcess('native:reprojectlayer', 'gdal:rasterize'))})
+        roads_raster = self.run("gdal:rasterize", {'INPUT':roads_utm['OUTPUT'],'FIELD':'','BURN':1,'USE_Z':False,'UNITS':1,'WIDTH':ROADS_PARAMETERS['WIDTH'],'HEIGHT':ROADS_PARAMETERS['HEIGHT'],'EXTENT':None,'NODATA':0,'OPTIONS':'','DATA_TYPE':5,'INIT':None,'INVERT':False,'EXTRA':'','OUTPUT':self.intermediates.file('roads.tif', in_process=False)})
+        roads_distance = self.run("gdal:proximity", {'INPUT':roads_raster['OUTPUT'],'BAND':1,'VALUES':'','UNITS':0,'MAX_DISTANCE':0,'REPLACE':0,'NODATA':0,'OPTIONS':'','EXTRA':'','DATA_TYPE':5,'OUTPUT':self.intermediates.file('roads_distance.tif', in_process=False)})
+        self.intermediates.release(roads_utm['OUTPUT'])
+        self.intermediates.release(roads_raster['OUTPUT'])
+        return {'OUTPUT':roads_distance['OUTPUT']}
+
+    def inputSources(self, parameters, context):
+        """
+        Returns the files of all input layers, their hashes are recorded in the statistics catalog.
+        """
+        inputs = dict((name, self.rasterSource(parameters, name, context)) for name in RASTER_INPUTS)
+        inputs['roads'] = self.parameterAsVectorLayer(parameters, 'roads', context).source()
+        return inputs
+
+    def outputFile(self, name):
+        """
+        Returns the path of a file in the output folder.
+        """
+        return os.path.join(self.output, name)
+
+    def run(self, algorithm, parameters, context=None, **args):
+        """
+        Runs a processing tool, traced as tool of the current stage (keyword arguments, e.g. factor, are stored with it).
+        A tool run in a worker thread needs its own context.
+        """
+        from qgis import processing
+        return self.tracer.traced(lambda: processing.run(algorithm, parameters, context=context), algorithm, **args)
+
+    def inProcess(self, *algorithms):
+        """
+        True if an intermediate is only written and read by algorithms (processing ids) which run in this process
+        (native QGIS algorithms), so it may be kept in memory; the GDAL and SAGA algorithms need it on disk.
+        """
+        return not any(algorithm.split(':')[0] in SEPARATE_PROVIDERS for algorithm in algorithms)
+
+    def threadSafe(self, *algorithms):
+        """
+        True if the processing tools (algorithm ids) may run in worker threads at the same time: native algorithms
+        without FlagNoThreading. The algorithms of the other providers (GDAL, SAGA) run one after the other.
+        """
+        from qgis.core import QgsApplication, QgsProcessingAlgorithm
+        registry = QgsApplication.processingRegistry()
+        for algorithm_id in algorithms:
+            algorithm = registry.algorithmById(algorithm_id)
+            if algorithm is None or algorithm.provider() is None or algorithm.provider().id() != 'native':
+                return False
+            if algorithm.flags() & QgsProcessingAlgorithm.FlagNoThreading:
+                return False
+        return True
+
+    def runTools(self, function, tasks, workers, *algorithms):
+        """
+        Calls function(*task) for every task, in up to workers threads if the processing tools it runs are thread safe.
+        Returns the results in task order.
+        """
+        return parallel_map(function, tasks, workers if self.threadSafe(*algorithms) else 1, processes=False)
+
+    def clipFactors(self, rasters, mask, workers=1):
+        """
+        Writes the unique values report of the classified factors and clips them to the viewshed (processing path),
+        up to workers factors at the same time where the tools allow it. Returns the clipped rasters in factor order.
+        """
+        self.runTools(self.uniqueValuesReport, zip(RASTER_NAMES, rasters), workers, "native:rasterlayeruniquevaluesreport")
+        clipped = self.runTools(self.clipFactor, zip(RASTER_NAMES, rasters, [mask] * len(rasters)), workers, "gdal:cliprasterbymasklayer")
+        # the classified rasters are only read by the report and the clip (inputs are not released)
+        for raster in rasters:
+            self.intermediates.release(raster)
+        return clipped
+
+    def uniqueValuesReport(self, name, raster):
+        """
+        Unique values report of one factor, with its own processing context.
+        """
+        from qgis.core import QgsProcessingContext
+        context = QgsProcessingContext()
+        # only the table of the report is read, the optional html report is not written
+        self.run("native:rasterlayeruniquevaluesreport", {'INPUT':raster,'BAND':1,'OUTPUT_TABLE':self.outputFile(name+'_unique_values.csv')}, context, factor=name)
+
+    def clipFactor(self, name, raster, mask):
+        """
+        Viewshed clip of one factor, with its own processing context.
+        """
+        from qgis.core import QgsProcessingContext
+        context = QgsProcessingContext()
+        clip_result = self.run("gdal:cliprasterbymasklayer", {'INPUT':raster,'MASK':mask,'SOURCE_CRS':None,'TARGET_CRS':None,'TARGET_EXTENT':None,'NODATA':None,'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':False,'OPTIONS':'','DATA_TYPE':0,'EXTRA':'','OUTPUT':self.intermediates.file(name+'_clipped.tif', in_process=False)}, context, factor=name)
+        return clip_result['OUTPUT']
+
+    def countFactors(self, clipped, landslides, workers=1):
+        """
+        Zonal statistics of the clipped factors with the landslides and with themselves (processing path), up to workers
+        factors at the same time where the tools allow it. Returns (landslide pixels per class, pixels per class,
+        unique values) in factor order.
+        """
+        return self.runTools(self.countFactor, zip(RASTER_NAMES, clipped, [landslides] * len(clipped)), workers, "native:rasterlayerzonalstats")
+
+    def countFactor(self, name, clipped, landslides):
+        """
+        Landslide pixels and pixels per class of one clipped factor, with its own processing context.
+        """
+        from qgis.core import QgsProcessingContext
+        context = QgsProcessingContext()
+        self.run("native:rasterlayerzonalstats", {'INPUT':landslides,'BAND':1,'ZONES':clipped,'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE': self.outputFile(name+'_zonal.csv')}, context, factor=name)
+        self.run("native:rasterlayerzonalstats", {'INPUT':clipped,'BAND':1,'ZONES':clipped,'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE': self.outputFile(name+'_class_pixel.csv')}, context, factor=name)
+        return (zonal_statistics_as_dic_from_csv(self.outputFile(name+'_zonal.csv')),
+                zonal_statistics_as_dic_from_csv(self.outputFile(name+'_class_pixel.csv')),
+                unique_values_from_csv(self.outputFile(name+'_unique_values.csv')))
+
+    def siRasters(self, rasters, reclass_tables, clipped, extent, options, workers=1):
+        """
+        Reclassifies the classified factors with their si tables and warps them to the extent (processing path),
+        up to workers factors at the same time where the tools allow it. Returns the si rasters in factor order.
+        """
+        si_rasters = self.runTools(self.siRaster, zip(RASTER_NAMES, rasters, reclass_tables), workers, "native:reclassifybytable")
+        warped = self.runTools(self.warpSiRaster, zip(RASTER_NAMES, si_rasters, [extent] * len(rasters), [options] * len(rasters)), workers, "gdal:warpreproject")
+        for raster in si_rasters + list(clipped):
+            self.intermediates.release(raster)
+        return warped
+
+    def siRaster(self, name, raster, reclass_table):
+        """
+        si raster of one factor, with its own processing context.
+        """
+        from qgis.core import QgsProcessingContext
+        context = QgsProcessingContext()
+        si_raster = self.run("native:reclassifybytable", {'INPUT_RASTER':raster,'RASTER_BAND':1,'TABLE':reclass_table,'NO_DATA':-9999,'RANGE_BOUNDARIES':2,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':self.intermediates.file(name+'_si.tif', in_process=self.inProcess('native:reclassifybytable', 'gdal:warpreproject'))}, context, factor=name)
+        return si_raster['OUTPUT']
+
+    def warpSiRaster(self, name, si_raster, extent, options):
+        """
+        si raster of one factor warped to the extent, with its own processing context.
+        """
+        from qgis.core import QgsProcessingContext
+        context = QgsProcessingContext()
+        # warp every raster to project extent to avoid problems with the raster calculator
+        si_raster_warped = self.run("gdal:warpreproject", {'INPUT':si_raster,'SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':options,'DATA_TYPE':0,'TARGET_EXTENT':extent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':False,'EXTRA':'','OUTPUT':self.outputFile('si_value_data/si_values_'+name+'.tif')}, context, factor=name)
+        return si_raster_warped['OUTPUT']
+
+    def previousRun(self, settings, grid, landslides, block_rows, feedback):
+        """
+        Compares an incremental run with the inventory manifest of the previous run in the output folder.
+        Returns the manifest (None for a full run), the replaced factor input (None if only the landslides changed),
+        the landslide pixels of this run and the added and removed ones.
+        """
+        manifest = InventoryManifest.load(self.output)
+        replaced = None
+        reason = 'there is no manifest of a previous run' if manifest is None else manifest.mismatch(settings, grid)
+        if reason is not None and manifest is not None:
+            replaced = manifest.replaced_input(settings, grid, FACTOR_INPUTS)
+            if replaced is not None:
+                reason = None
+        pixels = inventory_pixels(landslides, grid, block_rows)
+        added = removed = None
+        if reason is None:
+            added, removed = diff_inventory(manifest.pixels(self.output), pixels)
+            feedback.pushInfo('landslide inventory: '+str(added.size)+' pixels added, '+str(removed.size)+' pixels removed')
+            if replaced is not None and (added.size or removed.size):
+                reason = replaced+' and the landslides changed'
+        if reason is not None:
+            feedback.pushInfo('full run, '+reason)
+            return None, None, pixels, added, removed
+        return manifest, replaced, pixels, added, removed
+
+    def cached(self, cache, name, inputs, parameters, build):
+        """
+        Returns the cached result of build() for the input files and parameters, without cache build() is called.
+        """
+        if cache is None:
+            return build()
+        return cache.cached(name, inputs, parameters, build)
+
+    def rasterSource(self, parameters, name, context):
+        """
+        Returns the file of a raster layer parameter, which is read directly by the block engine.
+        """
+        return self.parameterAsRasterLayer(parameters, name, context).source()
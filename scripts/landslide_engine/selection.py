@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+"""
+Factor subset search.
+
+The si values of all factors are computed once for the pixels inside the
+viewshed and kept as a stack (one float32 row per factor, in memory or as
+memory mapped file) together with the landslide flags of these pixels. A
+subset of factors is then scored without touching the rasters again: the
+running sum of the selected factors is updated by one row of the stack and
+the AUC comes from a RiskHistogram of the sum. Pixels with nodata in one of
+the selected factors are left out, like in the risk map (nan propagates).
+
+Forward selection, backward elimination and leave-one-out evaluate
+n (n + 1) / 2, n (n + 1) / 2 and n + 1 subsets of n factors.
+"""
+
+import numpy as np
+
+from .raster_io import DEFAULT_BLOCK_ROWS, open_on_grid, read_window, landslide_pixels
+from .reclassify import ReclassTable, MIN_INCLUSIVE_MAX_INCLUSIVE
+from .roc import RiskHistogram
+from .viewshed import ViewshedMask
+
+# search strategies
+FORWARD = 'forward'
+BACKWARD = 'backward'
+LEAVE_ONE_OUT = 'leave_one_out'
+STRATEGIES = [FORWARD, BACKWARD, LEAVE_ONE_OUT]
+
+
+class SiStack:
+    '''
+    si values of all factors for the pixels inside the viewshed
+    '''
+
+    def __init__(self, names, values, is_landslide):
+        self.names = names
+        # (factors, pixels), nan = nodata
+        self.values = values
+        self.is_landslide = is_landslide
+
+    @classmethod
+    def from_factors(cls, factors, index_tables, grid, landslides, viewshed=None, file=None, block_rows=DEFAULT_BLOCK_ROWS):
+        '''
+        reads all factors once and keeps their si values inside the viewshed.
+        With a file the stack is a memory mapped file instead of an array.
+        '''
+        if viewshed is None:
+            viewshed = ViewshedMask.everything(grid)
+        elif not isinstance(viewshed, ViewshedMask):
+            viewshed = ViewshedMask.from_raster(viewshed, grid, block_rows)
+        pixels = viewshed.count()
+        shape = (len(factors), pixels)
+        if file is None:
+            values = np.empty(shape, dtype=np.float32)
+        else:
+            values = np.lib.format.open_memmap(file, mode='w+', dtype=np.float32, shape=shape)
+        is_landslide = np.empty(pixels, dtype=bool)
+
+        tables = [ReclassTable(table, MIN_INCLUSIVE_MAX_INCLUSIVE) for table in index_tables]
+        datasets = [factor.open(grid) for factor in factors]
+        landslide_dataset = open_on_grid(landslides, grid)
+        offset = 0
+        for row_off, rows in grid.windows(block_rows):
+            in_viewshed = viewshed.window(row_off, rows)
+            count = int(np.count_nonzero(in_viewshed))
+            for i, (factor, table, dataset) in enumerate(zip(factors, tables, datasets)):
+                si = factor.read_values(dataset, row_off, rows, table)
+                values[i, offset:offset + count] = si[in_viewshed]
+            is_landslide[offset:offset + count] = landslide_pixels(read_window(landslide_dataset, row_off, rows))[in_viewshed]
+            offset += count
+        return cls([factor.name for factor in factors], values, is_landslide)
+
+    def row(self, i):
+        '''
+        si values of factor i (nodata as 0) and its nodata flags
+        '''
+        values = self.values[i].astype(np.float64)
+        nodata = np.isnan(values)
+        values[nodata] = 0.0
+        return values, nodata
+
+
+class RunningSum:
+    '''
+    sum of the si values of a subset of factors, updated factor by factor
+    '''
+
+    def __init__(self, stack, subset=()):
+        self.stack = stack
+        self.subset = []
+        self.total = np.zeros(stack.values.shape[1])
+        # number of selected factors with nodata per pixel
+        self.missing = np.zeros(stack.values.shape[1], dtype=np.int16)
+        for i in subset:
+            self.add(i)
+
+    def _changed(self, i, sign):
+        values, nodata = self.stack.row(i)
+        return self.total + sign * values, self.missing + sign * nodata
+
+    def add(self, i):
+        self.total, self.missing = self._changed(i, 1)
+        self.subset.append(i)
+
+    def remove(self, i):
+        self.total, self.missing = self._changed(i, -1)
+        self.subset.remove(i)
+
+    def auc_with(self, i, sign=1):
+        '''
+        AUC of the subset with factor i added (sign 1) or removed (sign -1), the subset itself is not changed
+        '''
+        total, missing = self._changed(i, sign)
+        return subset_auc(total, missing, self.stack.is_landslide)
+
+    def auc(self):
+        return subset_auc(self.total, self.missing, self.stack.is_landslide)
+
+
+def subset_auc(total, missing, is_landslide):
+    '''
+    histogram AUC of a risk sum, pixels with nodata in a selected factor are left out
+    '''
+    valid = missing == 0
+    histogram = RiskHistogram()
+    histogram.add(total[valid], is_landslide[valid])
+    return histogram.auc()
+
+
+def forward_selection(stack):
+    '''
+    starts with no factor and adds the factor which gives the highest AUC until all factors are used.
+    Returns every evaluated subset as (subset, auc).
+    '''
+    running = RunningSum(stack)
+    remaining = list(range(len(stack.names)))
+    evaluated = []
+    while remaining:
+        scores = [(running.auc_with(i), i) for i in remaining]
+        evaluated += [(tuple(sorted(running.subset + [i])), auc) for auc, i in scores]
+        best = max(scores)[1]
+        running.add(best)
+        remaining.remove(best)
+    return evaluated
+
+
+def backward_elimination(stack):
+    '''
+    starts with all factors and removes the factor whose removal gives the highest AUC until one factor is left.
+    Returns every evaluated subset as (subset, auc).
+    '''
+    running = RunningSum(stack, range(len(stack.names)))
+    evaluated = [(tuple(running.subset), running.auc())]
+    while len(running.subset) > 1:
+        scores = [(running.auc_with(i, -1), i) for i in running.subset]
+        evaluated += [(tuple(sorted(j for j in running.subset if j != i)), auc) for auc, i in scores]
+        running.remove(max(scores)[1])
+    return evaluated
+
+
+def leave_one_out(stack):
+    '''
+    all factors and all subsets without one factor, returns (subset, auc) pairs
+    '''
+    running = RunningSum(stack, range(len(stack.names)))
+    evaluated = [(tuple(running.subset), running.auc())]
+    evaluated += [(tuple(j for j in running.subset if j != i), running.auc_with(i, -1)) for i in list(running.subset)]
+    return evaluated
+
+
+def search_subsets(stack, strategies=STRATEGIES):
+    '''
+    runs the strategies and returns the evaluated subsets ranked by AUC
+    (best first) as list of (subset, auc, strategies) tuples
+    '''
+    functions = {FORWARD: forward_selection, BACKWARD: backward_elimination, LEAVE_ONE_OUT: leave_one_out}
+    subsets = {}
+    for strategy in strategies:
+        for subset, auc in functions[strategy](stack):
+            found = subsets.setdefault(subset, [auc, []])
+            if strategy not in found[1]:
+                found[1].append(strategy)
+    return sorted(((subset, auc, found) for subset, (auc, found) in subsets.items()),
+                  key=lambda item: (-item[1], len(item[0])))
+
+
+def write_subset_table(file, ranked, names):
+    '''
+    writes the ranked subsets as csv: rank, auc, number of factors, factors, strategies
+    '''
+    with open(file, 'w', encoding='utf8') as f:
+        f.write('rank,auc,factor_count,factors,strategies\n')
+        for rank, (subset, auc, strategies) in enumerate(ranked, 1):
+            f.write(str(rank) + ',' + str(auc) + ',' + str(len(subset)) + ',' +
+                    ' '.join(names[i] for i in subset) + ',' + ' '.join(strategies) + '\n')
+    return file
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""
+One pass contingency tables for the conditioning factors.
+
+All factor rasters (classified on the fly) and the landslide raster are read
+strip by strip on the dgm grid, the viewshed comes from a ViewshedMask. For
+every factor the pixels per class (whole grid and inside the viewshed) and
+the landslide pixels per class are counted with bincounts. The result replaces the unique values reports, the zonal
+statistics and their csv files.
+"""
+
+import numpy as np
+
+from .raster_io import DEFAULT_BLOCK_ROWS, open_on_grid, read_window, landslide_pixels
+from .reclassify import apply_tables
+from .viewshed import ViewshedMask
+from .parallel import parallel_map, row_ranges
+
+
+class Factor:
+    '''
+    Conditioning factor: name, raster and the ReclassTable which turns the
+    raster values into class codes (None for rasters which are already classified)
+    '''
+
+    def __init__(self, name, raster, table=None):
+        self.name = name
+        self.raster = raster
+        self.table = table
+
+    def open(self, grid):
+        '''
+        opens the raster for reading on the grid (the dataset given to read)
+        '''
+        return open_on_grid(self.raster, grid)
+
+    def read(self, dataset, row_off, rows):
+        '''
+        reads a strip of class codes (as float, nan = nodata)
+        '''
+        return apply_tables(read_window(dataset, row_off, rows), [self.table])
+
+    def read_codes(self, dataset, row_off, rows):
+        '''
+        reads a strip as integer class codes and valid mask
+        '''
+        return class_codes(self.read(dataset, row_off, rows))
+
+    def read_values(self, dataset, row_off, rows, table):
+        '''
+        reads a strip of class codes reclassified with a ReclassTable (e.g. si values)
+        '''
+        return table.apply(self.read(dataset, row_off, rows))
+
+
+class ClassCounter:
+    '''
+    Pixel counts per integer class code. The count array grows with the
+    smallest and largest code seen so far.
+    '''
+
+    def __init__(self):
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def _cover(self, low, high):
+        if self.counts.size == 0:
+            self.offset = low
+            self.counts = np.zeros(high - low + 1, dtype=np.int64)
+            return
+        new_low = min(low, self.offset)
+        new_high = max(high, self.offset + self.counts.size - 1)
+        if new_low == self.offset and new_high == self.offset + self.counts.size - 1:
+            return
+        counts = np.zeros(new_high - new_low + 1, dtype=np.int64)
+        start = self.offset - new_low
+        counts[start:start + self.counts.size] = self.counts
+        self.offset = new_low
+        self.counts = counts
+
+    def add(self, codes, weights=None):
+        '''
+        adds a 1d array of integer class codes (optionally weighted)
+        '''
+        if codes.size == 0:
+            return
+        self._cover(int(codes.min()), int(codes.max()))
+        counts = np.bincount(codes - self.offset, weights=weights, minlength=self.counts.size)
+        self.counts += counts.astype(np.int64)
+
+    def merge(self, other):
+        if other.counts.size == 0:
+            return
+        self._cover(other.offset, other.offset + other.counts.size - 1)
+        start = other.offset - self.offset
+        self.counts[start:start + other.counts.size] += other.counts
+
+    def get(self, code):
+        index = int(code) - self.offset
+        if 0 <= index < self.counts.size:
+            return int(self.counts[index])
+        return 0
+
+    def codes(self):
+        '''
+        class codes with at least one pixel, ascending
+        '''
+        return np.flatnonzero(self.counts) + self.offset
+
+    def as_dict(self):
+        '''
+        {class: count} with the class as string like in the zonal statistics csv files
+        '''
+        return {str(int(code)): float(self.counts[code - self.offset]) for code in self.codes()}
+
+
+class FactorTable:
+    '''
+    Contingency table of one conditioning factor
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        # all pixels on the grid (replaces the unique values report)
+        self.grid_pixels = ClassCounter()
+        # pixels inside the viewshed
+        self.pixels = ClassCounter()
+        # landslide pixels inside the viewshed
+        self.landslides = ClassCounter()
+
+    def add(self, codes, valid, in_viewshed, is_landslide):
+        '''
+        adds a block of class codes with the valid, viewshed and landslide masks
+        '''
+        self.grid_pixels.add(codes[valid])
+        counted = valid & in_viewshed
+        self.pixels.add(codes[counted])
+        self.landslides.add(codes[counted & is_landslide])
+
+    def merge(self, other):
+        self.grid_pixels.merge(other.grid_pixels)
+        self.pixels.merge(other.pixels)
+        self.landslides.merge(other.landslides)
+
+    def unique_values(self):
+        return [str(int(code)) for code in self.grid_pixels.codes()]
+
+    def pixel_per_class(self):
+        return self.pixels.as_dict()
+
+    def landslides_per_class(self):
+        return self.landslides.as_dict()
+
+
+def class_codes(array):
+    '''
+    converts a block read by read_window into integer class codes and a valid mask
+    '''
+    valid = ~np.isnan(array)
+    # truncation like str(int(float(value))) in the csv readers
+    codes = np.zeros(array.shape, dtype=np.int64)
+    codes[valid] = array[valid].astype(np.int64)
+    return codes, valid
+
+
+def count_rows(factors, landslides, grid, viewshed, row_start, row_stop, block_rows=DEFAULT_BLOCK_ROWS):
+    '''
+    counts the rows row_start..row_stop of all factors (one task of contingency_tables).
+    Returns the list of FactorTables and the number of landslide pixels.
+    '''
+    tables = [FactorTable(factor.name) for factor in factors]
+    datasets = [factor.open(grid) for factor in factors]
+    landslide_dataset = open_on_grid(landslides, grid)
+
+    landslide_count = 0
+    for row_off, rows in grid.windows(block_rows, row_start, row_stop):
+        is_landslide = landslide_pixels(read_window(landslide_dataset, row_off, rows))
+        landslide_count += int(np.count_nonzero(is_landslide))
+        in_viewshed = viewshed.window(row_off, rows)
+        for factor, table, dataset in zip(factors, tables, datasets):
+            codes, valid = factor.read_codes(dataset, row_off, rows)
+            table.add(codes, valid, in_viewshed, is_landslide)
+    return tables, landslide_count
+
+
+def contingency_tables(factors, landslides, grid, viewshed=None, block_rows=DEFAULT_BLOCK_ROWS, workers=1):
+    '''
+    counts class pixels and landslide pixels for all factors in one pass.
+    factors is a list of Factors, all rasters are read on the grid. viewshed
+    can be a ViewshedMask or a viewshed raster (read once into a ViewshedMask).
+    With several workers the rows are split into ranges which are counted in
+    parallel and merged afterwards (the counts are identical).
+    Returns the list of FactorTables and the total number of landslide pixels.
+    '''
+    factors = list(factors)
+    if viewshed is None:
+        viewshed = ViewshedMask.everything(grid)
+    elif not isinstance(viewshed, ViewshedMask):
+        viewshed = ViewshedMask.from_raster(viewshed, grid, block_rows)
+
+    if workers <= 1:
+        return count_rows(factors, landslides, grid, viewshed, 0, grid.ysize, block_rows)
+
+    tasks = [(factors, landslides, grid, viewshed.subset(start, stop), start, stop, block_rows)
+             for start, stop in row_ranges(grid, workers * 2, block_rows)]
+    results = parallel_map(count_rows, tasks, workers)
+    tables = [FactorTable(factor.name) for factor in factors]
+    landslide_count = 0
+    for part_tables, part_count in results:
+        for table, part_table in zip(tables, part_tables):
+            table.merge(part_table)
+        landslide_count += part_count
+    return tables, landslide_count
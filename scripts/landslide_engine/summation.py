@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+N-way raster summation.
+
+All statistical index rasters are read window by window and added into one
+output in a single pass, instead of chaining gdal:rastercalculator calls that
+each write a full GeoTIFF. Running sums can still be written on request.
+"""
+
+import numpy as np
+
+from .raster_io import (RasterGrid, DEFAULT_BLOCK_ROWS, open_raster, open_on_grid,
+                        read_window, create_raster, write_window)
+
+
+def sum_rasters(rasters, output, grid=None, partial_sums=None, block_rows=DEFAULT_BLOCK_ROWS, options=None):
+    '''
+    adds all rasters into output, pixels which are nodata in any raster are nodata.
+    partial_sums is an optional {i: file} dict, the sum of rasters[0..i] is written to file.
+    options are the GTiff creation options of the written rasters. Returns the output file.
+    '''
+    if grid is None:
+        grid = RasterGrid.from_dataset(open_raster(rasters[0]))
+    datasets = [open_on_grid(raster, grid) for raster in rasters]
+    partial_sums = partial_sums or {}
+    partial_datasets = {i: create_raster(file, grid, options=options) for i, file in partial_sums.items()}
+    output_dataset = create_raster(output, grid, options=options)
+
+    for row_off, rows in grid.windows(block_rows):
+        total = read_window(datasets[0], row_off, rows)
+        for i in range(1, len(datasets)):
+            # nan (nodata) propagates like in the raster calculator
+            total += read_window(datasets[i], row_off, rows)
+            if i in partial_datasets:
+                write_window(partial_datasets[i], total.astype(np.float32), row_off)
+        write_window(output_dataset, total.astype(np.float32), row_off)
+
+    # closing the datasets flushes them to disk
+    partial_datasets = None
+    output_dataset = None
+    return output
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Native terrain derivatives.
+
+Slope, aspect, plan and profile curvature are calculated with the 9 parameter
+2nd order polynomial of Zevenbergen & Thorne (1987), the method 6 of
+saga:slopeaspectcurvature, directly on dgm strips with a halo of one row.
+Only the outputs used by the scripts are calculated and written. Missing
+neighbours (grid border, nodata) are mirrored at the centre cell like in SAGA.
+"""
+
+import os
+
+import numpy as np
+
+from .raster_io import RasterGrid, DEFAULT_BLOCK_ROWS, open_raster, read_window, create_raster, write_window, make_folder
+
+# outputs used by the scripts, named like the outputs of saga:slopeaspectcurvature
+TERRAIN_OUTPUTS = ['SLOPE', 'ASPECT', 'C_PLAN', 'C_PROF']
+
+
+def _mirror(a, b, centre):
+    '''
+    replaces a missing neighbour by the mirrored opposite neighbour (or the centre if both are missing)
+    '''
+    a_missing = np.isnan(a)
+    b_missing = np.isnan(b)
+    a = np.where(a_missing, np.where(b_missing, centre, 2 * centre - b), a)
+    b = np.where(b_missing, np.where(a_missing, centre, 2 * centre - a), b)
+    return a, b
+
+
+def terrain_block(dem, cell_x, cell_y, outputs=TERRAIN_OUTPUTS):
+    '''
+    calculates the outputs for a dgm block with one halo row/column on every
+    side (nan = nodata). cell_x and cell_y are the pixel sizes of the
+    geotransform (cell_y is negative for north-up rasters).
+    Returns a {output: array} dictionary for the inner block, slope and aspect in degrees.
+    '''
+    centre = dem[1:-1, 1:-1]
+    north, south = _mirror(dem[:-2, 1:-1], dem[2:, 1:-1], centre)
+    west, east = _mirror(dem[1:-1, :-2], dem[1:-1, 2:], centre)
+    north_west, south_east = _mirror(dem[:-2, :-2], dem[2:, 2:], centre)
+    north_east, south_west = _mirror(dem[:-2, 2:], dem[2:, :-2], centre)
+
+    # first and second derivatives in x (east) and y (row direction of the geotransform)
+    p = (east - west) / (2.0 * cell_x)
+    q = (south - north) / (2.0 * cell_y)
+    gradient = p * p + q * q
+
+    results = {}
+    if 'SLOPE' in outputs:
+        results['SLOPE'] = np.degrees(np.arctan(np.sqrt(gradient)))
+    if 'ASPECT' in outputs:
+        # direction of the steepest descent, clockwise from north. The y axis
+        # points north when cell_y is negative, flat cells have no aspect
+        north_component = -q if cell_y < 0 else q
+        aspect = np.degrees(np.arctan2(-p, north_component)) % 360.0
+        aspect[gradient == 0] = np.nan
+        results['ASPECT'] = aspect
+    if 'C_PLAN' in outputs or 'C_PROF' in outputs:
+        r = (west + east - 2.0 * centre) / (cell_x * cell_x)
+        t = (north + south - 2.0 * centre) / (cell_y * cell_y)
+        s = (south_east - south_west - north_east + north_west) / (4.0 * cell_x * cell_y)
+        sloped = gradient > 0
+        # flat cells have no curvature
+        safe = np.where(sloped, gradient, 1.0)
+        if 'C_PLAN' in outputs:
+            plan = -(t * p * p + r * q * q - 2.0 * s * p * q) / np.power(safe, 1.5)
+            results['C_PLAN'] = np.where(sloped, plan, 0.0)
+        if 'C_PROF' in outputs:
+            profile = -(r * p * p + t * q * q + 2.0 * s * p * q) / (safe * np.power(1.0 + safe, 1.5))
+            results['C_PROF'] = np.where(sloped, profile, 0.0)
+    return results
+
+
+def read_with_halo(dataset, grid, row_off, rows, halo=1):
+    '''
+    reads a strip with halo rows above and below and halo columns on both sides (nan outside the grid)
+    '''
+    top = max(0, row_off - halo)
+    bottom = min(grid.ysize, row_off + rows + halo)
+    block = np.full((rows + 2 * halo, grid.xsize + 2 * halo), np.nan)
+    start = halo - (row_off - top)
+    block[start:start + bottom - top, halo:halo + grid.xsize] = read_window(dataset, top, bottom - top)
+    return block
+
+
+def terrain_derivatives(dgm, folder, outputs=TERRAIN_OUTPUTS, block_rows=DEFAULT_BLOCK_ROWS):
+    '''
+    calculates the outputs strip by strip and writes them as Float32 rasters
+    (<output>.tif) to folder. Returns the files as {output: file} dictionary.
+    '''
+    make_folder(folder)
+    dataset = open_raster(dgm)
+    grid = RasterGrid.from_dataset(dataset)
+    cell_x = grid.geotransform[1]
+    cell_y = grid.geotransform[5]
+    files = dict((output, os.path.join(folder, output + '.tif')) for output in outputs)
+    output_datasets = dict((output, create_raster(file, grid)) for output, file in files.items())
+    for row_off, rows in grid.windows(block_rows):
+        block = read_with_halo(dataset, grid, row_off, rows)
+        for output, array in terrain_block(block, cell_x, cell_y, outputs).items():
+            write_window(output_datasets[output], array.astype(np.float32), row_off)
+    # closing the datasets flushes them to disk
+    output_datasets = None
+    return files
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tiled execution under a memory budget.
+
+Terrain derivatives need the whole dgm in memory when they are calculated by
+SAGA. In tiled mode the dgm is cut into tiles with a halo (the 3x3
+neighbourhood of the terrain derivatives), the derivatives are calculated per
+tile and only the class codes of the tile core are kept, in one Int16 raster
+per factor. All later passes read strips whose height is derived from the
+same budget, so the peak memory does not grow with the extent.
+"""
+
+import math
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from .raster_io import (NODATA, DEFAULT_BLOCK_ROWS, open_raster, read_block,
+                        create_raster, write_window, delete_raster, make_folder)
+from .reclassify import apply_tables
+from .statistics import Factor
+
+# neighbour pixels needed around a tile for 3x3 terrain derivatives
+TERRAIN_HALO = 1
+
+# memory of the terrain tools per dgm pixel: SAGA keeps the dgm and 12 outputs (52 bytes as
+# float32) plus twi and spi, the native derivatives measured 185 bytes per pixel of a strip
+TERRAIN_BYTES_PER_PIXEL = 256
+
+# memory per pixel and layer of a strip: measured 3 bytes per layer when the 13 factors and
+# the landslides are counted and 1.5 in the summation, the risk maps keep a float64 total per map
+STRIP_BYTES_PER_PIXEL = 16
+
+# smallest tile edge, smaller tiles only add overhead
+MIN_TILE_SIZE = 256
+
+CLASS_RASTER_OPTIONS = ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+
+
+def block_rows_for_budget(grid, memory_budget, layers):
+    '''
+    number of rows per strip so that strips of all layers fit into the
+    memory budget (bytes). Without budget the default strip height is used.
+    '''
+    if not memory_budget:
+        return DEFAULT_BLOCK_ROWS
+    rows = int(memory_budget // (grid.xsize * max(layers, 1) * STRIP_BYTES_PER_PIXEL))
+    return max(1, min(rows, grid.ysize))
+
+
+class Tile:
+    '''
+    Core window of a tile and the window including the halo (clipped to the grid)
+    '''
+
+    def __init__(self, grid, col_off, row_off, cols, rows, halo=TERRAIN_HALO):
+        self.col_off = col_off
+        self.row_off = row_off
+        self.cols = cols
+        self.rows = rows
+        self.pad_col_off = max(0, col_off - halo)
+        self.pad_row_off = max(0, row_off - halo)
+        self.pad_cols = min(grid.xsize, col_off + cols + halo) - self.pad_col_off
+        self.pad_rows = min(grid.ysize, row_off + rows + halo) - self.pad_row_off
+
+    @property
+    def inner_col_off(self):
+        return self.col_off - self.pad_col_off
+
+    @property
+    def inner_row_off(self):
+        return self.row_off - self.pad_row_off
+
+
+def tile_size_for_budget(memory_budget, bytes_per_pixel=TERRAIN_BYTES_PER_PIXEL, halo=TERRAIN_HALO):
+    '''
+    edge length of square tiles whose padded window fits into the memory budget (bytes)
+    '''
+    size = int(math.sqrt(memory_budget / float(bytes_per_pixel))) - 2 * halo
+    return max(MIN_TILE_SIZE, size)
+
+
+def tile_plan(grid, memory_budget, bytes_per_pixel=TERRAIN_BYTES_PER_PIXEL, halo=TERRAIN_HALO):
+    '''
+    list of Tiles covering the grid
+    '''
+    size = tile_size_for_budget(memory_budget, bytes_per_pixel, halo)
+    tiles = []
+    for row_off in range(0, grid.ysize, size):
+        for col_off in range(0, grid.xsize, size):
+            tiles.append(Tile(grid, col_off, row_off, min(size, grid.xsize - col_off), min(size, grid.ysize - row_off), halo))
+    return tiles
+
+
+def extract_tile(source, tile, file):
+    '''
+    writes the padded window of a raster to file
+    '''
+    gdal.Translate(str(file), open_raster(source), srcWin=[tile.pad_col_off, tile.pad_row_off, tile.pad_cols, tile.pad_rows])
+    return file
+
+
+def classify_tiled(dgm, grid, derive, factors, folder, memory_budget, feedback=None):
+    '''
+    calculates terrain derivatives tile by tile and writes their class codes.
+    derive(dgm_tile_file) returns a {key: file} dictionary of derived rasters,
+    factors is a list of Factors whose raster is such a key.
+    Returns Factors reading the class code rasters in folder (one per factor).
+    '''
+    make_folder(folder)
+    outputs = {}
+    for factor in factors:
+        file = os.path.join(folder, factor.name + '.tif')
+        outputs[factor.name] = (file, create_raster(file, grid, gdal.GDT_Int16, NODATA, options=CLASS_RASTER_OPTIONS))
+
+    tiles = tile_plan(grid, memory_budget)
+    tile_file = os.path.join(folder, 'dgm_tile.tif')
+    for number, tile in enumerate(tiles):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(100.0 * number / len(tiles))
+        extract_tile(dgm, tile, tile_file)
+        derived = derive(tile_file)
+        for factor in factors:
+            dataset = open_raster(derived[factor.raster])
+            block = read_block(dataset, tile.inner_col_off, tile.inner_row_off, tile.cols, tile.rows)
+            codes = apply_tables(block, [factor.table])
+            codes = np.where(np.isnan(codes), NODATA, codes).astype(np.int16)
+            write_window(outputs[factor.name][1], codes, tile.row_off, col_off=tile.col_off)
+            dataset = None
+        # the derived rasters of a tile are not needed any more
+        for file in set(derived.values()):
+            delete_raster(file)
+        delete_raster(tile_file)
+
+    classified = [Factor(factor.name, outputs[factor.name][0]) for factor in factors]
+    # closing the datasets flushes them to disk
+    outputs = None
+    return classified
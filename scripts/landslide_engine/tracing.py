@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stage tracing of the processing scripts.
+
+Every stage of a run (and every processing tool inside a stage) is recorded
+with its wall time, CPU time (of the process and of finished child processes
+like SAGA), the peak memory and the bytes read and written. The records are
+written as Chrome trace (trace.json, open it with chrome://tracing or
+https://ui.perfetto.dev) and summed up per stage and per tool, so it is easy
+to see whether SAGA, the clipping or the zonal statistics dominate a run.
+
+The peak memory of a stage is sampled: while a stage is open a background
+thread reads the resident memory of the process every SAMPLE_INTERVAL
+seconds. peak_memory is the highest value during the stage,
+peak_memory_increase the highest value minus the value at its start (the
+memory the stage needed on top of what was held before). The largest child
+process is only known as high-water mark over all children
+(peak_memory_children, recorded when it grew during the stage).
+
+Memory, CPU time and I/O counters are counters of the whole process. When
+several runs are traced in one process at the same time (the jobs of the
+worker), or one run traces tools in several threads, they include the other
+events; they are then left out and the event is marked as concurrent. The values need psutil, /proc (Linux) or the
+resource module; values which are not available are left out.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# trace file written to the output folder
+TRACE_FILE = 'trace.json'
+
+# categories of the trace events
+STAGE = 'stage'
+TOOL = 'tool'
+
+# measurements which are added up / maximized in the summary
+TOTALS = ['wall_seconds', 'cpu_seconds', 'bytes_read', 'bytes_written']
+PEAKS = ['peak_memory', 'peak_memory_increase', 'peak_memory_children']
+
+# seconds between two samples of the resident memory
+SAMPLE_INTERVAL = 0.02
+
+
+def cpu_seconds():
+    '''
+    user + system time of the process and of its finished child processes
+    '''
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def resident_memory():
+    '''
+    current resident memory of the process in bytes, None if unknown
+    '''
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def child_peak_memory():
+    '''
+    high-water mark of the resident memory of the largest finished child process in bytes, None if unknown
+    '''
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+
+class MemorySampler:
+    '''
+    Samples the resident memory of the process in a background thread while
+    windows (open stages) exist, every window keeps its maximum
+    '''
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        # window -> [value at the start, maximum]
+        self.windows = {}
+        self.thread = None
+
+    def open(self):
+        '''
+        opens a window, returns its key (None if the memory is unknown)
+        '''
+        value = resident_memory()
+        if value is None:
+            return None
+        key = object()
+        with self.lock:
+            self.windows[key] = [value, value]
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='memory sampler', daemon=True)
+                self.thread.start()
+        return key
+
+    def close(self, key):
+        '''
+        closes a window, returns (value at the start, maximum)
+        '''
+        self._sample()
+        with self.lock:
+            window = self.windows.pop(key, None)
+        return None if window is None else tuple(window)
+
+    def discard(self, key):
+        with self.lock:
+            self.windows.pop(key, None)
+
+    def _sample(self):
+        value = resident_memory()
+        if value is None:
+            return
+        with self.lock:
+            for window in self.windows.values():
+                if value > window[1]:
+                    window[1] = value
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.windows:
+                    self.thread = None
+                    return
+            self._sample()
+            time.sleep(self.interval)
+
+
+# one sampler for all tracers of the process
+_sampler = MemorySampler()
+
+
+class _Activity:
+    '''
+    Open events of all tracers of the process. Two open events are concurrent
+    if they belong to different tracers, or to the same tracer and different
+    threads (e.g. the tools of a stage run in worker threads); the stage opened
+    with Tracer.start has no thread, it contains the tools of all threads of its run.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # open events: [tracer (weak reference, a tracer of a run which failed disappears with it), thread, concurrent]
+        self.open_events = []
+
+    @staticmethod
+    def _concurrent(event, tracer, thread):
+        other = event[0]()
+        if other is not tracer:
+            return other is not None
+        return thread is not None and event[1] is not None and event[1] != thread
+
+    def open(self, tracer, thread):
+        '''
+        opens an event of tracer in thread (None for the stage of the run), returns it for close
+        '''
+        with self.lock:
+            self.open_events = [event for event in self.open_events if event[0]() is not None]
+            opened = [weakref.ref(tracer), thread, False]
+            for event in self.open_events:
+                if self._concurrent(event, tracer, thread):
+                    event[2] = opened[2] = True
+            self.open_events.append(opened)
+            return opened
+
+    def close(self, tracer, opened):
+        '''
+        closes an event opened with open, returns True if a concurrent event was open during it
+        '''
+        with self.lock:
+            self.open_events = [event for event in self.open_events if event is not opened]
+            return opened[2]
+
+    def forget(self, tracer):
+        with self.lock:
+            self.open_events = [event for event in self.open_events if event[0]() not in (tracer, None)]
+
+
+_activity = _Activity()
+
+
+def io_bytes():
+    '''
+    bytes read and written by the process, (None, None) if unknown
+    '''
+    if psutil is not None:
+        try:
+            counters = psutil.Process().io_counters()
+            return (counters.read_bytes, counters.write_bytes)
+        except (AttributeError, psutil.Error):
+            pass
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f if ':' in line)
+        return (int(counters['read_bytes']), int(counters['write_bytes']))
+    except (OSError, KeyError, ValueError):
+        return (None, None)
+
+
+class Tracer:
+    '''
+    Records the stages of one run and the tools called in them as trace events
+    '''
+
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        # stage opened with start: (name, arguments, snapshot)
+        self.current = None
+
+    def _snapshot(self, thread):
+        read, written = io_bytes()
+        return (time.perf_counter(), cpu_seconds(), read, written, child_peak_memory(),
+                _sampler.open(), _activity.open(self, thread))
+
+    def _record(self, name, category, args, snapshot):
+        start, cpu, read, written, child_memory, window, opened = snapshot
+        end = time.perf_counter()
+        memory = _sampler.close(window)
+        record = {'wall_seconds': end - start}
+        if _activity.close(self, opened):
+            # the process-wide counters include other runs or threads of the process
+            record['concurrent'] = True
+        else:
+            record['cpu_seconds'] = cpu_seconds() - cpu
+            if memory is not None:
+                record['peak_memory'] = memory[1]
+                record['peak_memory_increase'] = memory[1] - memory[0]
+            child_memory_end = child_peak_memory()
+            if child_memory_end and child_memory_end > (child_memory or 0):
+                record['peak_memory_children'] = child_memory_end
+            read_end, written_end = io_bytes()
+            if read is not None and read_end is not None:
+                record['bytes_read'] = read_end - read
+                record['bytes_written'] = written_end - written
+        record.update(args)
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': threading.get_ident(),
+                 'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6, 'args': record}
+        with self.lock:
+            self.events.append(event)
+
+    def start(self, name, **args):
+        '''
+        finishes the current stage and starts the next one, keyword arguments (e.g. factor) are stored with it
+        '''
+        self.finish()
+        self.current = (name, args, self._snapshot(None))
+
+    def finish(self):
+        '''
+        finishes the current stage
+        '''
+        if self.current is not None:
+            name, args, snapshot = self.current
+            self.current = None
+            self._record(name, STAGE, args, snapshot)
+
+    def close(self):
+        '''
+        drops the open stage of a run which failed, so other runs of the process are not marked as concurrent
+        '''
+        if self.current is not None:
+            _sampler.discard(self.current[2][5])
+            self.current = None
+        _activity.forget(self)
+
+    @contextmanager
+    def stage(self, name, category=STAGE, **args):
+        '''
+        context manager recording the enclosed code as one event
+        '''
+        snapshot = self._snapshot(threading.get_ident())
+        try:
+            yield
+        finally:
+            self._record(name, category, args, snapshot)
+
+    def traced(self, function, name, **args):
+        '''
+        calls function() as tool event of the current stage and returns its result,
+        keyword arguments (e.g. the factor of a worker thread) are stored with it
+        '''
+        if self.current is not None:
+            args = dict(self.current[1], stage=self.current[0], **args)
+        with self.stage(name, TOOL, **args):
+            return function()
+
+    def summary(self, category=STAGE):
+        '''
+        totals per event name of a category, sorted by wall time: list of (name, calls, record)
+        '''
+        totals = {}
+        for event in self.events:
+            if event['cat'] != category:
+                continue
+            calls, record = totals.get(event['name'], (0, {}))
+            for key, value in event['args'].items():
+                if key in PEAKS:
+                    record[key] = max(record.get(key, 0), value)
+                elif key in TOTALS:
+                    record[key] = record.get(key, 0) + value
+            totals[event['name']] = (calls + 1, record)
+        return sorted(((name, calls, record) for name, (calls, record) in totals.items()),
+                      key=lambda item: item[2]['wall_seconds'], reverse=True)
+
+    def summary_lines(self):
+        '''
+        readable summary of the stages and tools (one line each)
+        '''
+        lines = []
+        for category, title in [(STAGE, 'stages'), (TOOL, 'tools')]:
+            summary = self.summary(category)
+            if not summary:
+                continue
+            lines.append(title + ':')
+            for name, calls, record in summary:
+                line = '  {}: {:.2f} s wall'.format(name, record['wall_seconds'])
+                if 'cpu_seconds' in record:
+                    line += ', {:.2f} s cpu (process)'.format(record['cpu_seconds'])
+                line += ', {} call(s)'.format(calls)
+                if 'bytes_read' in record:
+                    line += ', {:.1f} MB read, {:.1f} MB written (process)'.format(record['bytes_read'] / 1048576.0, record['bytes_written'] / 1048576.0)
+                if 'peak_memory' in record:
+                    line += ', peak {:.0f} MB (+{:.0f} MB)'.format(record['peak_memory'] / 1048576.0, record['peak_memory_increase'] / 1048576.0)
+                lines.append(line)
+            if any('concurrent' in event['args'] for event in self.events if event['cat'] == category):
+                lines.append('  (memory, cpu and I/O are left out where other runs or threads were traced in this process at the same time)')
+        return lines
+
+    def write(self, file=TRACE_FILE):
+        '''
+        writes the events as Chrome trace (JSON object format)
+        '''
+        with open(file, 'w', encoding='utf8') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        return file
+
+    def report(self, feedback, file=TRACE_FILE):
+        '''
+        finishes the current stage, writes the trace file and the summary to the feedback (anything with pushInfo)
+        '''
+        self.finish()
+        self.write(file)
+        for line in self.summary_lines():
+            feedback.pushInfo(line)
+        feedback.pushInfo('trace written to ' + os.path.abspath(file))
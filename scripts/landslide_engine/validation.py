@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+k-fold cross-validation of the landslide inventory.
+
+The si and wf weights of the scripts are fitted and validated on the same
+landslide pixels, which overstates the AUC. Here the landslide pixels inside
+the viewshed are split into k folds, either randomly or by spatial blocks
+(all landslide pixels of a block end up in the same fold, so neighbouring
+pixels of one landslide can not be in the training and the test set).
+
+The class codes of all factors are read once into a ClassStack (pixels inside
+the viewshed, in memory or as memory mapped file). The landslide pixels per
+class and fold are counted from the stack; the training tables of a fold are
+the counts of the other folds, the pixels per class stay the same. The
+held-out landslide pixels are scored against the non-landslide pixels with a
+RiskHistogram of the si sum and of the weighted sum, the landslide pixels of
+the training folds are left out of the ROC. No raster is read again.
+"""
+
+import numpy as np
+
+from .raster_io import DEFAULT_BLOCK_ROWS, open_on_grid, read_window, landslide_pixels
+from .statistics import ClassCounter
+from .indices import statistical_index_table, total_statistical_index, weight_factors
+from .roc import RiskHistogram
+from .viewshed import ViewshedMask
+
+# partitions of the landslide pixels
+RANDOM = 'random'
+SPATIAL_BLOCKS = 'spatial_blocks'
+PARTITIONS = [RANDOM, SPATIAL_BLOCKS]
+
+# class code of nodata pixels in the stack
+NO_CLASS = np.iinfo(np.int32).min
+
+
+class ClassStack:
+    '''
+    class codes of all factors for the pixels inside the viewshed, the landslide
+    flags of these pixels and the grid positions of the landslide pixels
+    '''
+
+    def __init__(self, names, codes, is_landslide, landslide_rows, landslide_cols):
+        self.names = names
+        # (factors, pixels), NO_CLASS = nodata
+        self.codes = codes
+        self.is_landslide = is_landslide
+        # row and column of every landslide pixel, in the order of the stack
+        self.landslide_rows = landslide_rows
+        self.landslide_cols = landslide_cols
+
+    @classmethod
+    def from_factors(cls, factors, grid, landslides, viewshed=None, file=None, block_rows=DEFAULT_BLOCK_ROWS):
+        '''
+        reads the class codes of all factors once inside the viewshed.
+        With a file the stack is a memory mapped file instead of an array.
+        '''
+        if viewshed is None:
+            viewshed = ViewshedMask.everything(grid)
+        elif not isinstance(viewshed, ViewshedMask):
+            viewshed = ViewshedMask.from_raster(viewshed, grid, block_rows)
+        pixels = viewshed.count()
+        shape = (len(factors), pixels)
+        if file is None:
+            codes = np.empty(shape, dtype=np.int32)
+        else:
+            codes = np.lib.format.open_memmap(file, mode='w+', dtype=np.int32, shape=shape)
+        is_landslide = np.empty(pixels, dtype=bool)
+        landslide_rows = []
+        landslide_cols = []
+
+        datasets = [factor.open(grid) for factor in factors]
+        landslide_dataset = open_on_grid(landslides, grid)
+        offset = 0
+        for row_off, rows in grid.windows(block_rows):
+            in_viewshed = viewshed.window(row_off, rows)
+            count = int(np.count_nonzero(in_viewshed))
+            for i, (factor, dataset) in enumerate(zip(factors, datasets)):
+                block, valid = factor.read_codes(dataset, row_off, rows)
+                block[~valid] = NO_CLASS
+                codes[i, offset:offset + count] = block[in_viewshed]
+            block_landslides = landslide_pixels(read_window(landslide_dataset, row_off, rows)) & in_viewshed
+            is_landslide[offset:offset + count] = block_landslides[in_viewshed]
+            row, col = np.nonzero(block_landslides)
+            landslide_rows.append(row + row_off)
+            landslide_cols.append(col)
+            offset += count
+        return cls([factor.name for factor in factors], codes, is_landslide,
+                   np.concatenate(landslide_rows), np.concatenate(landslide_cols))
+
+    @property
+    def landslide_count(self):
+        return int(self.landslide_rows.size)
+
+
+def assign_folds(stack, k, partition=RANDOM, block_size=100, seed=0):
+    '''
+    fold (0..k-1) of every landslide pixel of the stack. Random folds have the
+    same size, spatial blocks of block_size x block_size pixels are given to the
+    smallest fold in random order.
+    '''
+    rng = np.random.default_rng(seed)
+    count = stack.landslide_count
+    if partition == RANDOM:
+        if count < k:
+            raise ValueError('{} landslide pixels can not be split into {} folds'.format(count, k))
+        folds = np.empty(count, dtype=np.int32)
+        folds[rng.permutation(count)] = np.arange(count) % k
+        return folds
+    if partition != SPATIAL_BLOCKS:
+        raise ValueError('unknown partition ' + repr(partition) + ', expected one of ' + ', '.join(PARTITIONS))
+
+    block_cols = int(stack.landslide_cols.max()) // block_size + 1 if count else 1
+    keys = (stack.landslide_rows // block_size) * block_cols + stack.landslide_cols // block_size
+    blocks, block_of_pixel, block_pixels = np.unique(keys, return_inverse=True, return_counts=True)
+    if blocks.size < k:
+        raise ValueError('{} blocks with landslides can not be split into {} folds, use smaller blocks'.format(blocks.size, k))
+    fold_of_block = np.empty(blocks.size, dtype=np.int32)
+    fold_pixels = np.zeros(k, dtype=np.int64)
+    for block in rng.permutation(blocks.size):
+        fold = int(np.argmin(fold_pixels))
+        fold_of_block[block] = fold
+        fold_pixels[fold] += block_pixels[block]
+    return fold_of_block[block_of_pixel.ravel()]
+
+
+def fold_counts(stack, folds, k):
+    '''
+    landslide pixels per class and fold from one pass over the stack:
+    one list of k ClassCounters per factor
+    '''
+    counts = []
+    for i in range(len(stack.names)):
+        codes = np.asarray(stack.codes[i])[stack.is_landslide]
+        valid = codes != NO_CLASS
+        counters = []
+        for fold in range(k):
+            counter = ClassCounter()
+            counter.add(codes[valid & (folds == fold)])
+            counters.append(counter)
+        counts.append(counters)
+    return counts
+
+
+def training_tables(factor_tables, landslide_count, counts, fold_sizes, fold):
+    '''
+    si tables and weighting factors of the factors without the landslide pixels of one fold.
+    The pixels per class are the ones of the whole study area.
+    '''
+    index_tables = []
+    tsi_list = []
+    training_count = landslide_count - fold_sizes[fold]
+    for factor_table, counters in zip(factor_tables, counts):
+        training = ClassCounter()
+        for other, counter in enumerate(counters):
+            if other != fold:
+                training.merge(counter)
+        landslides_per_class = training.as_dict()
+        table = statistical_index_table(landslides_per_class, factor_table.pixel_per_class(),
+                                        training_count, factor_table.unique_values())
+        index_tables.append(table)
+        tsi_list.append(total_statistical_index(table, landslides_per_class))
+    return index_tables, weight_factors(tsi_list)
+
+
+def lookup(codes, table):
+    '''
+    values of a flat si table for an array of class codes, nan for nodata and unknown classes
+    '''
+    if not table:
+        return np.full(codes.shape, np.nan)
+    keys = np.array([int(table[i]) for i in range(0, len(table), 3)], dtype=np.int64)
+    values = np.array([float(table[i]) for i in range(2, len(table), 3)])
+    order = np.argsort(keys)
+    keys = keys[order]
+    values = values[order]
+    index = np.clip(np.searchsorted(keys, codes), 0, keys.size - 1)
+    return np.where(keys[index] == codes, values[index], np.nan)
+
+
+def fold_histograms(stack, folds, fold, index_tables, weights):
+    '''
+    RiskHistograms of the si sum and the weighted sum for the held-out landslide
+    pixels of one fold and all non-landslide pixels
+    '''
+    scored = ~stack.is_landslide
+    scored[np.flatnonzero(stack.is_landslide)[folds == fold]] = True
+    si_sum = np.zeros(int(np.count_nonzero(scored)))
+    wf_sum = np.zeros(si_sum.size)
+    for i, (table, weight) in enumerate(zip(index_tables, weights)):
+        si = lookup(np.asarray(stack.codes[i])[scored], table)
+        si_sum += si
+        wf_sum += si * weight
+    is_landslide = stack.is_landslide[scored]
+    histograms = []
+    for risk in [si_sum, wf_sum]:
+        valid = ~np.isnan(risk)
+        histogram = RiskHistogram()
+        histogram.add(risk[valid], is_landslide[valid])
+        histograms.append(histogram)
+    return histograms
+
+
+def cross_validate(stack, factor_tables, landslide_count, k=5, partition=RANDOM, block_size=100, seed=0):
+    '''
+    k-fold cross-validation of the si and wf method. factor_tables and
+    landslide_count are the result of contingency_tables for the whole inventory.
+    Returns one record per fold: fold, landslide_pixels, auc_si, auc_wf.
+    '''
+    folds = assign_folds(stack, k, partition, block_size, seed)
+    counts = fold_counts(stack, folds, k)
+    fold_sizes = np.bincount(folds, minlength=k)
+    records = []
+    for fold in range(k):
+        index_tables, weights = training_tables(factor_tables, landslide_count, counts, fold_sizes, fold)
+        si_histogram, wf_histogram = fold_histograms(stack, folds, fold, index_tables, weights)
+        records.append({'fold': fold + 1, 'landslide_pixels': int(fold_sizes[fold]),
+                        'auc_si': si_histogram.auc(), 'auc_wf': wf_histogram.auc()})
+    return records
+
+
+def write_cross_validation(file, records):
+    '''
+    writes the AUC of every fold and their mean and standard deviation as csv
+    '''
+    auc_si = [record['auc_si'] for record in records]
+    auc_wf = [record['auc_wf'] for record in records]
+    with open(file, 'w', encoding='utf8') as f:
+        f.write('fold,landslide_pixels,auc_si,auc_wf\n')
+        for record in records:
+            f.write(str(record['fold']) + ',' + str(record['landslide_pixels']) + ',' +
+                    str(record['auc_si']) + ',' + str(record['auc_wf']) + '\n')
+        f.write('mean,' + str(sum(record['landslide_pixels'] for record in records)) + ',' +
+                str(float(np.mean(auc_si))) + ',' + str(float(np.mean(auc_wf))) + '\n')
+        f.write('std,,' + str(float(np.std(auc_si))) + ',' + str(float(np.std(auc_wf))) + '\n')
+    return file
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Raster viewshed mask.
+
+The viewshed raster is read once on the dgm grid and kept as a bit-packed
+boolean mask (1 bit per pixel). All block engines take their viewshed
+windows from this mask, so the viewshed never has to be polygonized and the
+factor rasters never have to be clipped.
+"""
+
+import numpy as np
+from osgeo import gdal
+
+from .raster_io import DEFAULT_BLOCK_ROWS, open_on_grid, read_window, create_raster
+
+
+def viewshed_pixels(array):
+    '''
+    visible pixels of a viewshed raster (formula A >= 1)
+    '''
+    return np.nan_to_num(array, nan=0.0) >= 1
+
+
+class ViewshedMask:
+    '''
+    Bit-packed viewshed mask on a reference grid
+    '''
+
+    def __init__(self, grid, bits, row_offset=0):
+        self.grid = grid
+        # one row of the grid per row of bits, 8 pixels per byte
+        self.bits = bits
+        # first grid row of bits (for subsets sent to worker processes)
+        self.row_offset = row_offset
+
+    @classmethod
+    def from_raster(cls, viewshed, grid, block_rows=DEFAULT_BLOCK_ROWS):
+        '''
+        reads the viewshed raster once on the grid
+        '''
+        dataset = open_on_grid(viewshed, grid)
+        bits = np.zeros((grid.ysize, (grid.xsize + 7) // 8), dtype=np.uint8)
+        for row_off, rows in grid.windows(block_rows):
+            visible = viewshed_pixels(read_window(dataset, row_off, rows))
+            bits[row_off:row_off + rows] = np.packbits(visible, axis=1)
+        return cls(grid, bits)
+
+    @classmethod
+    def everything(cls, grid):
+        '''
+        mask without hidden pixels (used when no viewshed is given)
+        '''
+        # padding bits at the end of a row are ignored by window()
+        bits = np.full((grid.ysize, (grid.xsize + 7) // 8), 255, dtype=np.uint8)
+        return cls(grid, bits)
+
+    def window(self, row_off, rows):
+        '''
+        boolean array of the visible pixels in a strip of rows
+        '''
+        start = row_off - self.row_offset
+        packed = self.bits[start:start + rows]
+        return np.unpackbits(packed, axis=1, count=self.grid.xsize).astype(bool)
+
+    def subset(self, row_start, row_stop):
+        '''
+        mask of the rows row_start..row_stop only
+        '''
+        start = row_start - self.row_offset
+        return ViewshedMask(self.grid, self.bits[start:start + row_stop - row_start], row_start)
+
+    def count(self):
+        '''
+        number of visible pixels
+        '''
+        row_stop = self.row_offset + self.bits.shape[0]
+        return sum(int(np.count_nonzero(self.window(row_off, rows)))
+                   for row_off, rows in self.grid.windows(DEFAULT_BLOCK_ROWS, self.row_offset, row_stop))
+
+    def write(self, file, block_rows=DEFAULT_BLOCK_ROWS):
+        '''
+        writes the mask as Byte raster (1 visible, 0 hidden), e.g. for the ROC script
+        '''
+        dataset = create_raster(file, self.grid, data_type=gdal.GDT_Byte, nodata=None)
+        band = dataset.GetRasterBand(1)
+        for row_off, rows in self.grid.windows(block_rows):
+            band.WriteArray(self.window(row_off, rows).astype(np.uint8), 0, row_off)
+        dataset = None
+        return file
@@ -21,12 +21,21 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterFeatureSource,
                        QgsProcessingParameterFolderDestination,
                        QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
                        QgsApplication)
 from qgis import processing
 import os
-import csv
+import sys
 
-class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
+# the engine package is located next to this script
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from landslide_engine.raster_io import RasterGrid, open_raster
+from landslide_engine.roc import risk_histogram, write_roc
+from landslide_engine.output import OutputProfile, PROFILES
+from landslide_engine.tracing import Tracer, TRACE_FILE
+from landslide_engine.scripts import ScriptMixin, zonal_statistics_as_dic_from_csv
+
+class ExampleProcessingAlgorithm(ScriptMixin, QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
     creates a new identical one.
@@ -47,6 +56,9 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     INPUT = 'INPUT'
     OUTPUT = 'OUTPUT'
 
+    # set by the worker (worker/landslide_worker.py): QGIS is already initialized and no layers are added to the project
+    headless = False
+
     def tr(self, string):
         """
         Returns a translatable string with the self.tr() function.
@@ -127,7 +139,17 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(
             QgsProcessingParameterVectorLayer(
                 "viewshed",
-                self.tr('viewshed')
+                self.tr('viewshed'),
+                optional=True
+            )
+        )
+
+        # viewshed_mask.tif written by the block engine of the si/wf scripts, can be used instead of the viewshed polygons
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                "viewshed_mask",
+                self.tr('viewshed mask (raster, replaces viewshed)'),
+                optional=True
             )
         )
         
@@ -142,20 +164,83 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             QgsProcessingParameterNumber( 'i', 'Iterations', type=QgsProcessingParameterNumber.Integer)
         )
 
+        # histogram: risk map and landslides are read once, processing: reclassification and zonal statistics per threshold
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "method",
+                self.tr('ROC method'),
+                options=[self.tr('histogram (single pass)'), self.tr('QGIS processing (per threshold)')],
+                defaultValue=0
+            )
+        )
+
+        # raster_clipped.tif of the processing method: plain GeoTIFF, tiled and compressed GeoTIFF or Cloud-Optimized GeoTIFF
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "output_profile",
+                self.tr('Output rasters'),
+                options=[self.tr('GeoTIFF (uncompressed)'), self.tr('compressed GeoTIFF'), self.tr('Cloud-Optimized GeoTIFF with overviews')],
+                defaultValue=0
+            )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
-        #set working dir
-        os.chdir(parameters["output"])
+        # all files are written to the output folder by absolute paths, the working directory is not changed
+        # (the worker runs several jobs in one process)
+        self.output = parameters["output"]
+
+        # stages and tools are traced, trace.json and a summary are written at the end
+        self.tracer = Tracer()
+        self.tracer.start('initialisation')
         
         # init some settings
-        QgsApplication.setPrefixPath((parameters["output"]), True) 
-        QgsApplication.initQgis()
-        
-        clip_raster = processing.run("gdal:cliprasterbymasklayer", {'INPUT':parameters['riskmap'],'MASK':parameters['viewshed'],'SOURCE_CRS':None,'TARGET_CRS':None,'TARGET_EXTENT':None,'NODATA':None,'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':False,'OPTIONS':'','DATA_TYPE':0,'EXTRA':'','OUTPUT':'raster_clipped.tif'})
+        # the worker initializes QGIS once for all jobs
+        if not self.headless:
+            QgsApplication.setPrefixPath((parameters["output"]), True)
+            QgsApplication.initQgis()
+
+        if self.parameterAsEnum(parameters, 'method', context) == 0:
+            risk_layer = self.parameterAsRasterLayer(parameters, 'riskmap', context)
+            landslide_layer = self.parameterAsRasterLayer(parameters, 'landslides', context)
+            grid = RasterGrid.from_path(risk_layer.source())
+            xmin, ymin, xmax, ymax = grid.extent
+            extent = str(xmin)+','+str(xmax)+','+str(ymin)+','+str(ymax)+' ['+risk_layer.crs().authid()+']'
+
+            self.tracer.start('viewshed')
+            viewshed_mask_layer = self.parameterAsRasterLayer(parameters, 'viewshed_mask', context)
+            if viewshed_mask_layer is not None:
+                viewshed_mask = viewshed_mask_layer.source()
+            elif parameters.get('viewshed') is not None:
+                # burn the viewshed polygons on the grid of the risk map instead of clipping the risk map
+                viewshed_mask = self.run("gdal:rasterize", {'INPUT':parameters['viewshed'],'FIELD':'','BURN':1,'USE_Z':False,'UNITS':0,'WIDTH':grid.xsize,'HEIGHT':grid.ysize,'EXTENT':extent,'NODATA':None,'OPTIONS':'','DATA_TYPE':0,'INIT':0,'INVERT':False,'EXTRA':'','OUTPUT':'TEMPORARY_OUTPUT'})['OUTPUT']
+            else:
+                raise QgsProcessingException(self.tr('A viewshed layer or a viewshed mask is needed'))
+
+            self.tracer.start('histogram')
+            # one pass over risk map and landslides, every threshold is derived from the histogram
+            histogram = risk_histogram(risk_layer.source(), landslide_layer.source(), viewshed_mask)
+            tpr, fpr = histogram.curve(histogram.thresholds(parameters['i']))
+            write_roc(self.outputFile('roc.txt'), tpr, fpr)
+            auc = histogram.auc()
+            with open (self.outputFile('auc.txt'), 'w') as f:
+                f.write(str(auc))
+            feedback.pushInfo('AUC: '+str(auc))
+            self.tracer.report(feedback, self.outputFile(TRACE_FILE))
+            return {}
+
+        if parameters.get('viewshed') is None:
+            raise QgsProcessingException(self.tr('The processing method needs the viewshed layer'))
+        self.tracer.start('clip')
+        profile = OutputProfile(PROFILES[self.parameterAsEnum(parameters, 'output_profile', context)])
+        # DATA_TYPE 0 keeps the data type of the risk map, the predictor depends on it
+        data_type = open_raster(self.parameterAsRasterLayer(parameters, 'riskmap', context).source()).GetRasterBand(1).DataType
+        clip_raster = self.run("gdal:cliprasterbymasklayer", {'INPUT':parameters['riskmap'],'MASK':parameters['viewshed'],'SOURCE_CRS':None,'TARGET_CRS':None,'TARGET_EXTENT':None,'NODATA':None,'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':False,'OPTIONS':profile.processing_options(data_type),'DATA_TYPE':0,'EXTRA':'','OUTPUT':self.outputFile('raster_clipped.tif')})
+        profile.finish(clip_raster['OUTPUT'])
         i = 0
-        stats = processing.run("native:rasterlayerstatistics", {'INPUT':clip_raster['OUTPUT'],'BAND':1,'OUTPUT_HTML_FILE':'TEMPORARY_OUTPUT'})
+        stats = self.run("native:rasterlayerstatistics", {'INPUT':clip_raster['OUTPUT'],'BAND':1,'OUTPUT_HTML_FILE':'TEMPORARY_OUTPUT'})
         step_size = (stats['MAX'] - stats['MIN'])/ (float(parameters['i']) + 1)
         threshold = stats['MIN']
         #processing.run("native:rasterlayerzonalstats", {'INPUT':parameters['landslides'],'BAND':1,'ZONES':parameters['landslides'],'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE':'landslides_pixel.csv'})
@@ -165,12 +250,13 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         fpr = []
         while i <= parameters['i'] - 1:
             threshold += step_size
+            self.tracer.start('threshold', threshold=threshold)
             reclass_table = ['',str(threshold),'0',str(threshold),'','1']
-            classified = processing.run("native:reclassifybytable", {'INPUT_RASTER':clip_raster['OUTPUT'],'RASTER_BAND':1,'TABLE':reclass_table,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-            processing.run("native:rasterlayerzonalstats", {'INPUT':parameters['landslides'],'BAND':1,'ZONES':classified['OUTPUT'],'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE': 'zonal'+str(i)+'.csv'})
-            processing.run("native:rasterlayerzonalstats", {'INPUT':classified['OUTPUT'],'BAND':1,'ZONES':classified['OUTPUT'],'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE': 'class'+str(i)+'.csv'})
-            pixel_zonal = zonal_statistics_as_dic_from_csv('zonal'+str(i)+'.csv')
-            class_values = zonal_statistics_as_dic_from_csv('class'+str(i)+'.csv')
+            classified = self.run("native:reclassifybytable", {'INPUT_RASTER':clip_raster['OUTPUT'],'RASTER_BAND':1,'TABLE':reclass_table,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
+            self.run("native:rasterlayerzonalstats", {'INPUT':parameters['landslides'],'BAND':1,'ZONES':classified['OUTPUT'],'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE': self.outputFile('zonal'+str(i)+'.csv')})
+            self.run("native:rasterlayerzonalstats", {'INPUT':classified['OUTPUT'],'BAND':1,'ZONES':classified['OUTPUT'],'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE': self.outputFile('class'+str(i)+'.csv')})
+            pixel_zonal = zonal_statistics_as_dic_from_csv(self.outputFile('zonal'+str(i)+'.csv'))
+            class_values = zonal_statistics_as_dic_from_csv(self.outputFile('class'+str(i)+'.csv'))
             if '1' in pixel_zonal:
                 z1 = pixel_zonal.get('1')
             else: 
@@ -189,8 +275,10 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             
             i += 1
         
+        self.tracer.report(feedback, self.outputFile(TRACE_FILE))
+
         i = 0
-        with open ('roc.txt', 'w') as f:
+        with open (self.outputFile('roc.txt'), 'w') as f:
             while i <= len(tpr) - 1:
                 f.write(str(tpr[i])+','+str(fpr[i])+'\n')
                 i += 1
@@ -198,19 +286,3 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         
         
         return {}
-        
-        
-def zonal_statistics_as_dic_from_csv(file):
-    '''
-    reads the zonal statistics as dic from csv
-    '''
-    with open(file) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=',')
-        i = 0
-        dic = {}
-        for row in csv_reader:
-            if i != 0:
-                # str->float->int->str to remove decimal places
-                dic.update({str(int(float(row[0]))): float(row[3])})
-            i += 1
-        return dic
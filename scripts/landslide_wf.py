@@ -21,6 +21,10 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterVectorLayer,
                        QgsProcessingParameterFeatureSink,
                        QgsProcessingParameterFolderDestination,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFile,
                        QgsProject,
                        QgsRasterLayer,
                        QgsVectorLayer,
@@ -32,11 +36,30 @@ from qgis.core import (QgsProcessing,
 from qgis import processing
 from qgis.analysis import (QgsRasterCalculatorEntry, QgsRasterCalculator)
 import os
-import csv
-import numpy as np
+import sys
+
+# the engine package is located next to this script
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from landslide_engine.raster_io import RasterGrid, make_folder
+from landslide_engine.statistics import Factor, contingency_tables
+from landslide_engine.reclassify import ReclassTable, reclassify_rasters, MIN_INCLUSIVE_MAX_INCLUSIVE
+from landslide_engine.summation import sum_rasters
+from landslide_engine.viewshed import ViewshedMask
+from landslide_engine.tiling import block_rows_for_budget, classify_tiled
+from landslide_engine.cache import RasterCache
+from landslide_engine.proximity import proximity_raster, largest_break
+from landslide_engine.output import OutputProfile, PROFILES
+from landslide_engine.intermediates import Intermediates
+from landslide_engine.catalog import RunStatistics
+from landslide_engine.parallel import can_spawn_processes
+from landslide_engine.tracing import Tracer, TRACE_FILE
+from landslide_engine.indices import statistical_index_table, factor_index_tables, total_statistical_index, weight_factors
+from landslide_engine.mapping import risk_maps, replace_factor, SUM_DATA_TYPE
+from landslide_engine.inventory import InventoryManifest, update_counts, map_state
+from landslide_engine.scripts import ScriptMixin, FACTOR_INPUTS, terrain_factors, zonal_statistics_as_dic_from_csv, TERRAIN_TABLES, ROADS_PARAMETERS, ROADS_TABLE, DGM_TABLE, TWI_TABLE, SPI_TABLE, SLOPE_TABLE, ASPECT_TABLE, C_PLAN_TABLE, C_PROF_TABLE, RASTER_NAMES
 #import QgsProject
 
-class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
+class ExampleProcessingAlgorithm(ScriptMixin, QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
     creates a new identical one.
@@ -57,6 +80,8 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     INPUT = 'INPUT'
     OUTPUT = 'OUTPUT'
 
+    headless = False
+
     def tr(self, string):
         """
         Returns a translatable string with the self.tr() function.
@@ -198,211 +223,449 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
                 self.tr('Output folder')
             )
         )
-        
 
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "engine",
+                self.tr('Engine'),
+                options=[self.tr('block engine (numpy/GDAL)'), self.tr('QGIS processing tools')],
+                defaultValue=0
+            )
+        )
 
-    def processAlgorithm(self, parameters, context, feedback):
-        """
-        Here is where the processing itself takes place.
-        """
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "partial_sums",
+                self.tr('Write partial sums to si_raster_addition'),
+                defaultValue=False
+            )
+        )
 
-        map_layers = QgsProject.instance().mapLayers()
-        
-        
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "memory_budget",
+                self.tr('Memory budget in MB for tiled processing (0 = no tiling)'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=0,
+                defaultValue=0
+            )
+        )
 
-        os.chdir(parameters["output"])
-        QgsApplication.setPrefixPath((parameters["output"]), True) 
-        QgsApplication.initQgis()
-       
-        if not os.path.exists('si_value_data'):
-            os.makedirs('si_value_data')
-        
-        if not os.path.exists('si_raster_addition'):
-            os.makedirs('si_raster_addition')
-        
-        viewshed_raster = processing.run("gdal:rastercalculator", {'INPUT_A':parameters["viewshed"],'BAND_A':1,'INPUT_B':None,'BAND_B':None,'INPUT_C':None,'BAND_C':None,'INPUT_D':None,'BAND_D':None,'INPUT_E':None,'BAND_E':None,'INPUT_F':None,'BAND_F':None,'FORMULA':'A >= 1','NO_DATA':None,'PROJWIN':None,'RTYPE':5,'OPTIONS':'','EXTRA':'','OUTPUT':'TEMPORARY_OUTPUT'})
-        viewshed_polygons = processing.run("gdal:polygonize", {'INPUT':viewshed_raster['OUTPUT'],'BAND':1,'FIELD':'DN','EIGHT_CONNECTEDNESS':False,'EXTRA':'','OUTPUT':'TEMPORARY_OUTPUT'})
-        
-        viewshed_layer = QgsVectorLayer(viewshed_polygons['OUTPUT'])
-        with edit(viewshed_layer):
-            
-            request = QgsFeatureRequest().setFilterExpression('"DN" = 0')
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "workers",
+                self.tr('Number of parallel workers'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=1
+            )
+        )
 
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "cache",
+                self.tr('Cache folder (optional)'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
 
-            request.setSubsetOfAttributes([])
-            request.setFlags(QgsFeatureRequest.NoGeometry)
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "cache_size",
+                self.tr('Cache size in MB'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=2048
+            )
+        )
 
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "intermediate_memory",
+                self.tr('Memory for intermediate rasters in MB (0 = scratch folder only)'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=0,
+                defaultValue=0
+            )
+        )
 
-            for f in viewshed_layer.getFeatures(request):
-                viewshed_layer.deleteFeature(f.id())
-        
-        viewshed_multipolygon = processing.run("native:collect", {'INPUT':viewshed_layer,'FIELD':[],'OUTPUT':'viewshed.shp'})
-        
-        roads_utm = processing.run("native:reprojectlayer", {'INPUT':parameters["roads"],'TARGET_CRS':QgsCoordinateReferenceSystem('EPSG:32648'),'OPERATION':'+proj=pipeline +step +proj=unitconvert +xy_in=deg +xy_out=rad +step +proj=utm +zone=48 +ellps=WGS84','OUTPUT':'TEMPORARY_OUTPUT'})
-        roads_raster = processing.run("gdal:rasterize", {'INPUT':roads_utm['OUTPUT'],'FIELD':'','BURN':1,'USE_Z':False,'UNITS':1,'WIDTH':30,'HEIGHT':30,'EXTENT':None,'NODATA':0,'OPTIONS':'','DATA_TYPE':5,'INIT':None,'INVERT':False,'EXTRA':'','OUTPUT':'TEMPORARY_OUTPUT'})
-        roads_distance = processing.run("gdal:proximity", {'INPUT':roads_raster['OUTPUT'],'BAND':1,'VALUES':'','UNITS':0,'MAX_DISTANCE':0,'REPLACE':0,'NODATA':0,'OPTIONS':'','EXTRA':'','DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "scratch",
+                self.tr('Scratch folder for intermediate files (optional, default: temporary folder)'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "catalog",
+                self.tr('Statistics catalog (SQLite, optional, without a file no catalog is written)'),
+                behavior=QgsProcessingParameterFile.File,
+                extension='sqlite',
+                optional=True
+            )
+        )
 
-        dgm = parameters['dgm']
-        raster_properties = processing.run("native:rasterlayerproperties", {'INPUT':dgm,'BAND':1})
-        extent_from_qgis = raster_properties['EXTENT'].replace(' : ',',')
-        extent_list = extent_from_qgis.split(',')
-        extent_list[1],extent_list[2] = extent_list[2],extent_list[1]
-        extent_4_gdal = ','.join(extent_list)
-        extent = extent_4_gdal +' ['+raster_properties['CRS_AUTHID']+']'
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "terrain",
+                self.tr('Terrain derivatives'),
+                options=[self.tr('native (numpy)'), self.tr('SAGA')],
+                defaultValue=0
+            )
+        )
 
-        
-        slopeaspectcurvature = processing.run("saga:slopeaspectcurvature", {'ELEVATION':dgm,'SLOPE':'TEMPORARY_OUTPUT','ASPECT':'TEMPORARY_OUTPUT','C_GENE':'TEMPORARY_OUTPUT','C_PROF':'TEMPORARY_OUTPUT','C_PLAN':'TEMPORARY_OUTPUT','C_TANG':'TEMPORARY_OUTPUT','C_LONG':'TEMPORARY_OUTPUT','C_CROS':'TEMPORARY_OUTPUT','C_MINI':'TEMPORARY_OUTPUT','C_MAXI':'TEMPORARY_OUTPUT','C_TOTA':'TEMPORARY_OUTPUT','C_ROTO':'TEMPORARY_OUTPUT','METHOD':6,'UNIT_SLOPE':1,'UNIT_ASPECT':1})
-        twi = processing.run("saga:topographicwetnessindextwi", {'SLOPE':slopeaspectcurvature['SLOPE'],'AREA':dgm,'TRANS':None,'TWI':'TEMPORARY_OUTPUT','CONV':0,'METHOD':0})
-        spi = processing.run("saga:streampowerindex", {'SLOPE':slopeaspectcurvature['SLOPE'],'AREA':dgm,'SPI':'TEMPORARY_OUTPUT','CONV':0})
-        
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "flow_routing",
+                self.tr('Flow routing (catchment area of the terrain derivatives)'),
+                options=[self.tr('D8'), self.tr('multiple flow directions (MFD)')],
+                defaultValue=1
+            )
+        )
 
-        twi_classified = processing.run("native:reclassifybytable", {'INPUT_RASTER':twi['TWI'],'RASTER_BAND':1,'TABLE':['','-7','0','-7','0','1','0','7','2','7','','3'],'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-        spi_classified = processing.run("native:reclassifybytable", {'INPUT_RASTER':spi['SPI'],'RASTER_BAND':1,'TABLE':['','250','0','250','500','1','500','750','2','750','1000','3','1000','','4'],'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-        slope_classified = processing.run("native:reclassifybytable", {'INPUT_RASTER':slopeaspectcurvature['SLOPE'],'RASTER_BAND':1,'TABLE':['','10','0','10','20','1','20','30','2','30','40','3','40','50','4','50','','6'],'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-        aspect_classified = processing.run("native:reclassifybytable", {'INPUT_RASTER':slopeaspectcurvature['ASPECT'],'RASTER_BAND':1,'TABLE':['0','45','0','45','90','1','90','135','2','135','180','3','180','225','4','225','270','5','270','315','6','315','360','7'],'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-        c_plan_classified = processing.run("native:reclassifybytable", {'INPUT_RASTER':slopeaspectcurvature['C_PLAN'],'RASTER_BAND':1,'TABLE':['','0','0','0','','1'],'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-        c_prof_classified = processing.run("native:reclassifybytable", {'INPUT_RASTER':slopeaspectcurvature['C_PROF'],'RASTER_BAND':1,'TABLE':['','0','0','0','','1'],'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-        roads_classified = processing.run("native:reclassifybytable", {'INPUT_RASTER':roads_distance['OUTPUT'],'RASTER_BAND':1,'TABLE':['','30','0','30','60','1','60','90','2','90','','3'],'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-        dgm_classified = processing.run("native:reclassifybytable", {'INPUT_RASTER':dgm,'RASTER_BAND':1,'TABLE':['','500','0','500','1000','1','1000','1500','2','1500','2000','3','2000','','4'],'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-        
-        raster_clip_list = [dgm_classified['OUTPUT'],parameters['precipation'],parameters['soil'],parameters['landuse'],parameters['lithosphere'],parameters['waterbodies'],roads_classified['OUTPUT'],twi_classified['OUTPUT'],spi_classified['OUTPUT'],slope_classified['OUTPUT'],aspect_classified['OUTPUT'],c_plan_classified['OUTPUT'],c_prof_classified['OUTPUT']]
-        raster_names = ['dgm','precip','soil','landuse','lithosphere','waterbodies','roads','twi','spi','slope','aspect','plan_curvature','profile_curvature']
-        viewshed_raster_list = []
-        
-        i = 0
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "output_profile",
+                self.tr('Output rasters'),
+                options=[self.tr('GeoTIFF (uncompressed)'), self.tr('compressed GeoTIFF'), self.tr('Cloud-Optimized GeoTIFF with overviews')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "quantize",
+                self.tr('Store si values as int16 (scale/offset)'),
+                defaultValue=False
+            )
+        )
 
-        for raster in raster_clip_list:
-            processing.run("native:rasterlayeruniquevaluesreport", {'INPUT':raster,'BAND':1,'OUTPUT_HTML_FILE':'TEMPORARY_OUTPUT','OUTPUT_TABLE':raster_names[i]+'_unique_values.csv'})
-            clip_result = processing.run("gdal:cliprasterbymasklayer", {'INPUT':raster,'MASK':viewshed_multipolygon['OUTPUT'],'SOURCE_CRS':None,'TARGET_CRS':None,'TARGET_EXTENT':None,'NODATA':None,'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':False,'OPTIONS':'','DATA_TYPE':0,'EXTRA':'','OUTPUT':'TEMPORARY_OUTPUT'})
-            viewshed_raster_list.append(clip_result['OUTPUT'])
-            i += 1
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "incremental",
+                self.tr('Update the previous run in the output folder if only the landslides or one factor changed (block engine)'),
+                defaultValue=False
+            )
+        )
         
+
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
         
-        processing.run("native:rasterlayerzonalstats", {'INPUT':parameters['landslides'],'BAND':1,'ZONES':parameters['landslides'],'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE':'landslides_pixel.csv'})
-        pixel_landslide_count = zonal_statistics_as_dic_from_csv('landslides_pixel.csv').get('1')
         
-        i = 0
-        statistical_index_raster_list = []
-        reclass_table_list = []
-        tsi_list = []
-        for raster in viewshed_raster_list:
-            processing.run("native:rasterlayerzonalstats", {'INPUT':parameters['landslides'],'BAND':1,'ZONES':raster,'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE': raster_names[i]+'_zonal.csv'})
-            processing.run("native:rasterlayerzonalstats", {'INPUT':raster,'BAND':1,'ZONES':raster,'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE': raster_names[i]+'_class_pixel.csv'})
-            pixel_zonal = zonal_statistics_as_dic_from_csv(raster_names[i]+'_zonal.csv')
-            class_values = zonal_statistics_as_dic_from_csv(raster_names[i]+'_class_pixel.csv')
-            unique_values = unique_values_from_csv(raster_names[i]+'_unique_values.csv')
-            reclass_table = create_statistical_index_list(pixel_zonal,class_values,pixel_landslide_count,unique_values)
+
+        self.output = parameters["output"]
+
+        self.tracer = Tracer()
+        self.tracer.start('initialisation')
+        if not self.headless:
+            QgsApplication.setPrefixPath((parameters["output"]), True)
+            QgsApplication.initQgis()
+       
+        if not os.path.exists(self.outputFile('si_value_data')):
+            os.makedirs(self.outputFile('si_value_data'))
+        
+        if not os.path.exists(self.outputFile('si_raster_addition')):
+            os.makedirs(self.outputFile('si_raster_addition'))
+        
+        engine = self.parameterAsEnum(parameters, 'engine', context)
+        profile = OutputProfile(PROFILES[self.parameterAsEnum(parameters, 'output_profile', context)], self.parameterAsBool(parameters, 'quantize', context))
+        memory_budget = self.parameterAsInt(parameters, 'memory_budget', context) * 1024 * 1024
+        workers = self.parameterAsInt(parameters, 'workers', context)
+        self.terrain_engine = self.parameterAsEnum(parameters, 'terrain', context)
+        self.flow_method = self.parameterAsEnum(parameters, 'flow_routing', context)
+        self.dgm = self.rasterSource(parameters, 'dgm', context)
+        self.catchment_area = None
+        self.memory_budget = memory_budget
+        cache = None
+        if self.parameterAsString(parameters, 'cache', context):
+            cache = RasterCache.shared(self.parameterAsString(parameters, 'cache', context), self.parameterAsInt(parameters, 'cache_size', context) * 1024 * 1024).job()
+        self.in_process = engine == 0 and (workers <= 1 or not can_spawn_processes())
+        self.intermediates = Intermediates(self.parameterAsInt(parameters, 'intermediate_memory', context) * 1024 * 1024, self.parameterAsString(parameters, 'scratch', context) or None)
+        try:
+            self.terrain_folder = None
+            partial_sums = {}
+            incremental = engine == 0 and self.parameterAsBool(parameters, 'incremental', context)
+            if incremental:
+                self.terrain_folder = self.outputFile('terrain')
+                make_folder(self.terrain_folder)
+            statistics = RunStatistics('wf', self.output, {'engine':engine,'terrain':self.terrainParameters(),'memory_budget':memory_budget}, self.inputSources(parameters, context))
+
+            self.tracer.start('viewshed')
+            if engine == 0:
+                grid = RasterGrid.from_path(self.rasterSource(parameters, 'dgm', context))
+                block_rows = block_rows_for_budget(grid, memory_budget, 15)
+                viewshed_mask = ViewshedMask.from_raster(self.rasterSource(parameters, 'viewshed', context), grid, block_rows)
+                viewshed_mask.write(self.outputFile('viewshed_mask.tif'))
+                landslides = self.rasterSource(parameters, 'landslides', context)
+            else:
+                viewshed_raster = self.run("gdal:rastercalculator", {'INPUT_A':parameters["viewshed"],'BAND_A':1,'INPUT_B':None,'BAND_B':None,'INPUT_C':None,'BAND_C':None,'INPUT_D':None,'BAND_D':None,'INPUT_E':None,'BAND_E':None,'INPUT_F':None,'BAND_F':None,'FORMULA':'A >= 1','NO_DATA':None,'PROJWIN':None,'RTYPE':5,'OPTIONS':'','EXTRA':'','OUTPUT':self.intermediates.file('viewshed.tif', in_process=False)})
+                viewshed_polygons = self.run("gdal:polygonize", {'INPUT':viewshed_raster['OUTPUT'],'BAND':1,'FIELD':'DN','EIGHT_CONNECTEDNESS':False,'EXTRA':'','OUTPUT':self.intermediates.file('viewshed_polygons.gpkg', in_process=False)})
+        
+                viewshed_layer = QgsVectorLayer(viewshed_polygons['OUTPUT'])
+                with edit(viewshed_layer):
+            
+                    request = QgsFeatureRequest().setFilterExpression('"DN" = 0')
+
+
+                    request.setSubsetOfAttributes([])
+                    request.setFlags(QgsFeatureRequest.NoGeometry)
+
+
+                    for f in viewshed_layer.getFeatures(request):
+                        viewshed_layer.deleteFeature(f.id())
+        
+                viewshed_multipolygon = self.run("native:collect", {'INPUT':viewshed_layer,'FIELD':[],'OUTPUT':self.outputFile('viewshed.shp')})
+                viewshed_layer = None
+                self.intermediates.release(viewshed_raster['OUTPUT'])
+                self.intermediates.release(viewshed_polygons['OUTPUT'])
+        
+            manifest = None
+            replaced = None
+            if incremental:
+                self.tracer.start('inventory update')
+                settings = self.inventorySettings(parameters, context, memory_budget)
+                manifest, replaced, current_pixels, added, removed = self.previousRun(settings, grid, landslides, block_rows, feedback)
+                if replaced is not None and settings['partial_sums']:
+                    feedback.pushInfo('full run, the partial sums are written')
+                    manifest = None
+                    replaced = None
+
+            self.tracer.start('roads distance')
+            if engine != 0:
+                roads_distance = self.cached(cache, 'roads_distance', [self.parameterAsVectorLayer(parameters, 'roads', context).source()], ROADS_PARAMETERS, lambda: self.roadsDistance(parameters['roads']))
+
+            self.tracer.start('terrain derivatives')
+            dgm = parameters['dgm']
+            raster_properties = self.run("native:rasterlayerproperties", {'INPUT':dgm,'BAND':1})
+            extent_from_qgis = raster_properties['EXTENT'].replace(' : ',',')
+            extent_list = extent_from_qgis.split(',')
+            extent_list[1],extent_list[2] = extent_list[2],extent_list[1]
+            extent_4_gdal = ','.join(extent_list)
+            extent = extent_4_gdal +' ['+raster_properties['CRS_AUTHID']+']'
+
+        
+            if engine == 0 and (memory_budget > 0 or manifest is not None):
+                # tiled mode, the derivatives are calculated per dgm tile when the factors are prepared
+                terrain = None
+            else:
+                terrain = self.cached(cache, 'terrain', [self.rasterSource(parameters, 'dgm', context)], self.terrainParameters(), lambda: self.terrainDerivatives(self.rasterSource(parameters, 'dgm', context)))
+        
+
+
+            self.tracer.start('classification')
+            if engine == 0 and manifest is not None:
+                factor_list = list(manifest.factors)
+                if replaced is not None:
+                    replaced_index = manifest.factor_index(FACTOR_INPUTS[replaced])
+                    factor_list[replaced_index] = Factor(factor_list[replaced_index].name, self.rasterSource(parameters, replaced, context))
+                classified_folder = None
+                roads_file = None
+            elif engine == 0:
+                terrain_list = terrain_factors()
+                if terrain is None:
+                    if incremental:
+                        classified_folder = self.outputFile('classified')
+                    else:
+                        classified_folder = self.intermediates.folder('classified', grid.pixel_count * 2 * 6, in_process=self.in_process)
+                    classification = {'terrain':self.terrainParameters(),'tables':TERRAIN_TABLES,'memory_budget':memory_budget}
+                    classified = self.cached(cache, 'classified', [self.rasterSource(parameters, 'dgm', context)], classification, lambda: dict((factor.name, factor.raster) for factor in classify_tiled(self.rasterSource(parameters, 'dgm', context), grid, self.terrainDerivatives, terrain_list, classified_folder, memory_budget, feedback)))
+                    terrain_list = [Factor(factor.name, classified[factor.name]) for factor in terrain_list]
+                else:
+                    terrain_list = terrain_factors(terrain)
+                self.tracer.start('roads distance')
+                roads_source = self.parameterAsVectorLayer(parameters, 'roads', context).source()
+                if incremental:
+                    roads_file = self.outputFile('roads_distance.tif')
+                else:
+                    roads_file = self.intermediates.file('roads_distance.tif', grid.pixel_count * 4, in_process=self.in_process)
+                roads_distance = self.cached(cache, 'roads_proximity', [roads_source, self.rasterSource(parameters, 'dgm', context)], {'MAX_DISTANCE':largest_break(ROADS_TABLE)}, lambda: {'OUTPUT':proximity_raster(roads_source, grid, roads_file, largest_break(ROADS_TABLE), block_rows)})
+                factor_list = [Factor('dgm',self.rasterSource(parameters, 'dgm', context),ReclassTable(DGM_TABLE)),Factor('precip',self.rasterSource(parameters, 'precipation', context)),Factor('soil',self.rasterSource(parameters, 'soil', context)),Factor('landuse',self.rasterSource(parameters, 'landuse', context)),Factor('lithosphere',self.rasterSource(parameters, 'lithosphere', context)),Factor('waterbodies',self.rasterSource(parameters, 'waterbodies', context)),Factor('roads',roads_distance['OUTPUT'],ReclassTable(ROADS_TABLE))] + terrain_list
+            else:
+                classes_in_process = self.inProcess('native:reclassifybytable', 'native:rasterlayeruniquevaluesreport', 'gdal:cliprasterbymasklayer')
+                twi_classified = self.run("native:reclassifybytable", {'INPUT_RASTER':terrain['TWI'],'RASTER_BAND':1,'TABLE':TWI_TABLE,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':self.intermediates.file('twi_classes.tif', in_process=classes_in_process)})
+                spi_classified = self.run("native:reclassifybytable", {'INPUT_RASTER':terrain['SPI'],'RASTER_BAND':1,'TABLE':SPI_TABLE,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':self.intermediates.file('spi_classes.tif', in_process=classes_in_process)})
+                slope_classified = self.run("native:reclassifybytable", {'INPUT_RASTER':terrain['SLOPE'],'RASTER_BAND':1,'TABLE':SLOPE_TABLE,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':self.intermediates.file('slope_classes.tif', in_process=classes_in_process)})
+                aspect_classified = self.run("native:reclassifybytable", {'INPUT_RASTER':terrain['ASPECT'],'RASTER_BAND':1,'TABLE':ASPECT_TABLE,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':self.intermediates.file('aspect_classes.tif', in_process=classes_in_process)})
+                c_plan_classified = self.run("native:reclassifybytable", {'INPUT_RASTER':terrain['C_PLAN'],'RASTER_BAND':1,'TABLE':C_PLAN_TABLE,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':self.intermediates.file('c_plan_classes.tif', in_process=classes_in_process)})
+                c_prof_classified = self.run("native:reclassifybytable", {'INPUT_RASTER':terrain['C_PROF'],'RASTER_BAND':1,'TABLE':C_PROF_TABLE,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':self.intermediates.file('c_prof_classes.tif', in_process=classes_in_process)})
+                roads_classified = self.run("native:reclassifybytable", {'INPUT_RASTER':roads_distance['OUTPUT'],'RASTER_BAND':1,'TABLE':ROADS_TABLE,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':self.intermediates.file('roads_classes.tif', in_process=classes_in_process)})
+                dgm_classified = self.run("native:reclassifybytable", {'INPUT_RASTER':dgm,'RASTER_BAND':1,'TABLE':DGM_TABLE,'NO_DATA':-9999,'RANGE_BOUNDARIES':0,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':self.intermediates.file('dgm_classes.tif', in_process=classes_in_process)})
+                raster_clip_list = [dgm_classified['OUTPUT'],parameters['precipation'],parameters['soil'],parameters['landuse'],parameters['lithosphere'],parameters['waterbodies'],roads_classified['OUTPUT'],twi_classified['OUTPUT'],spi_classified['OUTPUT'],slope_classified['OUTPUT'],aspect_classified['OUTPUT'],c_plan_classified['OUTPUT'],c_prof_classified['OUTPUT']]
+                self.intermediates.release(self.terrain_folder)
+                self.intermediates.release(roads_distance['OUTPUT'])
+
+            viewshed_raster_list = []
+
+            self.tracer.start('counts')
+            if engine == 0 and replaced is not None:
+                [replaced_table], pixel_landslide_count = contingency_tables([factor_list[replaced_index]], landslides, grid, viewshed_mask, block_rows, workers)
+                factor_tables = list(manifest.factor_tables)
+                factor_tables[replaced_index] = replaced_table
+            elif engine == 0 and manifest is not None:
+                factor_tables, pixel_landslide_count = update_counts(manifest.factor_tables, factor_list, grid, viewshed_mask, added, removed, manifest.landslide_count, block_rows)
+            elif engine == 0:
+                factor_tables, pixel_landslide_count = contingency_tables(factor_list, landslides, grid, viewshed_mask, block_rows, workers)
+            else:
+                self.tracer.start('unique values and clip')
+                viewshed_raster_list = self.clipFactors(raster_clip_list, viewshed_multipolygon['OUTPUT'], workers)
+        
+        
+                self.tracer.start('landslide pixels')
+                self.run("native:rasterlayerzonalstats", {'INPUT':parameters['landslides'],'BAND':1,'ZONES':parameters['landslides'],'ZONES_BAND':1,'REF_LAYER':0,'OUTPUT_TABLE':self.outputFile('landslides_pixel.csv')})
+                pixel_landslide_count = zonal_statistics_as_dic_from_csv(self.outputFile('landslides_pixel.csv')).get('1')
+
+                self.tracer.start('zonal statistics')
+                factor_counts = self.countFactors(viewshed_raster_list, parameters['landslides'], workers)
+
+            i = 0
+            statistical_index_raster_list = []
+            si_jobs = []
+            reclass_table_list = []
+            tsi_list = []
+            for raster_name in RASTER_NAMES:
+                self.tracer.start('si values', factor=raster_name)
+                if engine == 0:
+                    pixel_zonal = factor_tables[i].landslides_per_class()
+                    class_values = factor_tables[i].pixel_per_class()
+                    unique_values = factor_tables[i].unique_values()
+                else:
+                    pixel_zonal, class_values, unique_values = factor_counts[i]
+                reclass_table = statistical_index_table(pixel_zonal,class_values,pixel_landslide_count,unique_values)
             
 
             
-            tsi_parts = []
-
-            with open (raster_names[i]+'_si.txt', 'w', encoding='utf8') as f:
-                i2 = 0
-                for value in reclass_table:
-                    if (i2 % 3 == 0):
-                        f.write(value + ': ')
-                        if value in pixel_zonal:
-                            ls_zonal = pixel_zonal[value]
-                        else:
-                            ls_zonal = 0
-                    elif (i2 % 3 == 2):
-                        f.write(value + ', ')
-                        tsi_parts.append(float(value)*ls_zonal)
-                    i2 += 1 
+                tsi_parts = []
+
+                with open (self.outputFile(RASTER_NAMES[i]+'_si.txt'), 'w', encoding='utf8') as f:
+                    i2 = 0
+                    for value in reclass_table:
+                        if (i2 % 3 == 0):
+                            f.write(value + ': ')
+                            if value in pixel_zonal:
+                                ls_zonal = pixel_zonal[value]
+                            else:
+                                ls_zonal = 0
+                        elif (i2 % 3 == 2):
+                            f.write(value + ', ')
+                            tsi_parts.append(float(value)*ls_zonal)
+                        i2 += 1 
             
-            tsi = sum(tsi_parts)
-            tsi_list.append(tsi)
-            reclass_table_list.append(reclass_table)
-            i += 1
-        
-        i = 0
-        
-        
-        for raster in viewshed_raster_list:
-            wf = ((tsi_list[i]-min(tsi_list))/(max(tsi_list)-min(tsi_list)))*9+1
-            reclass_table = reclass_table_list[i]
-            with open (raster_names[i]+'_si.txt', 'a', encoding='utf8') as f:
-                f.write('WF: '+str(wf))
+                tsi = sum(tsi_parts)
+                tsi_list.append(tsi)
+                statistics.add_factor(raster_name, class_values, pixel_zonal, reclass_table, tsi)
+                reclass_table_list.append(reclass_table)
+                i += 1
+        
+            i = 0
+            si_table_list = [list(reclass_table) for reclass_table in reclass_table_list]
+            if replaced is not None:
+                previous_tables = factor_index_tables(manifest.factor_tables, pixel_landslide_count)
+                previous_tsi_list = [total_statistical_index(table, factor_table.landslides_per_class()) for table, factor_table in zip(previous_tables, manifest.factor_tables)]
+                previous_wf_list = weight_factors(previous_tsi_list)
+        
+        
+            for raster_name in RASTER_NAMES:
+                self.tracer.start('wf values', factor=raster_name)
+                wf = ((tsi_list[i]-min(tsi_list))/(max(tsi_list)-min(tsi_list)))*9+1
+                reclass_table = reclass_table_list[i]
+                with open (self.outputFile(RASTER_NAMES[i]+'_si.txt'), 'a', encoding='utf8') as f:
+                    f.write('WF: '+str(wf))
+                statistics.set_weight(raster_name, wf)
             
 
-            i2 = 2
-            while (i2 <= len(reclass_table)-1):
-                si = float(reclass_table[i2])
-                si *= wf
-                reclass_table[i2] = str(si)
-                i2 += 3
+                i2 = 2
+                while (i2 <= len(reclass_table)-1):
+                    si = float(reclass_table[i2])
+                    si *= wf
+                    reclass_table[i2] = str(si)
+                    i2 += 3
 
             
             
-            si_raster = processing.run("native:reclassifybytable", {'INPUT_RASTER':raster_clip_list[i],'RASTER_BAND':1,'TABLE':reclass_table,'NO_DATA':-9999,'RANGE_BOUNDARIES':2,'NODATA_FOR_MISSING':False,'DATA_TYPE':5,'OUTPUT':'TEMPORARY_OUTPUT'})
-
-            si_raster_warped = processing.run("gdal:warpreproject", {'INPUT':si_raster['OUTPUT'],'SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':'','DATA_TYPE':0,'TARGET_EXTENT':extent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':False,'EXTRA':'','OUTPUT':'si_value_data/si_values_'+raster_names[i]+'.tif'})
-            statistical_index_raster_list.append(si_raster_warped['OUTPUT'])
+                if engine == 0 and (replaced is None or i == replaced_index or wf != previous_wf_list[i]):
+                    si_table = ReclassTable(reclass_table, MIN_INCLUSIVE_MAX_INCLUSIVE)
+                    si_jobs.append((factor_list[i].raster, [factor_list[i].table, si_table], self.outputFile('si_value_data/si_values_'+RASTER_NAMES[i]+'.tif')))
             
             
-            i += 1
+                i += 1
             
         
 
-        i = 1
-        si_sum_raster = statistical_index_raster_list[0]
-        while (i <= len(statistical_index_raster_list)-1):
-            si_sum_raster = processing.run("gdal:rastercalculator", {'INPUT_A':si_sum_raster,'BAND_A':1,'INPUT_B':statistical_index_raster_list[i],'BAND_B':None,'INPUT_C':None,'BAND_C':None,'INPUT_D':None,'BAND_D':None,'INPUT_E':None,'BAND_E':None,'INPUT_F':None,'BAND_F':None,'FORMULA':'A + B','NO_DATA':None,'PROJWIN':None,'RTYPE':5,'OPTIONS':'','EXTRA':'','OUTPUT':'si_raster_addition/landslides_risk_si_'+str(i)+'.tif'})['OUTPUT']            #if i >= 2:
-
-            i += 1
-            
-        result_layer = QgsRasterLayer(si_sum_raster,"landslide_risk_map")
-        QgsProject.instance().addMapLayer(result_layer)
+            self.tracer.start('reclassification')
+            if engine == 0:
+                reclassified_rasters = reclassify_rasters(si_jobs, grid, block_rows, workers, profile.creation_options())
+                statistical_index_raster_list = [self.outputFile('si_value_data/si_values_'+raster_name+'.tif') for raster_name in RASTER_NAMES]
+                self.intermediates.release(self.terrain_folder)
+                if terrain is None:
+                    self.intermediates.release(classified_folder)
+                self.intermediates.release(roads_file)
+            else:
+                statistical_index_raster_list = self.siRasters(raster_clip_list, reclass_table_list, viewshed_raster_list, extent, profile.processing_options(), workers)
+
+            self.tracer.start('summation')
+            if engine == 0:
+                si_sum_raster = self.outputFile('si_raster_addition/landslides_risk_si_'+str(len(statistical_index_raster_list)-1)+'.tif')
+                sums = [self.outputFile('si_sum.tif'), self.outputFile('tsi_weighted_sum.tif')]
+                if replaced is not None:
+                    replaced_tsi = previous_tsi_list[replaced_index]
+                    replace_factor(factor_list, si_table_list, tsi_list, replaced_index, manifest.factors[replaced_index], previous_tables[replaced_index], replaced_tsi, sums, [None, si_sum_raster], grid, block_rows=block_rows, options=profile.creation_options())
+                else:
+                    if self.parameterAsBool(parameters, 'partial_sums', context):
+                        for i in range(1, len(statistical_index_raster_list)-1):
+                            partial_sums[i] = self.outputFile('si_raster_addition/landslides_risk_si_'+str(i)+'.tif')
+                    sum_rasters(statistical_index_raster_list, si_sum_raster, grid, partial_sums, block_rows, profile.creation_options())
+                if incremental and replaced is None:
+                    risk_maps(factor_list, si_table_list, [[1.0] * len(factor_list), tsi_list], sums, grid, block_rows=block_rows, options=profile.creation_options(), data_types=[SUM_DATA_TYPE, SUM_DATA_TYPE])
+            else:
+                i = 1
+                si_sum_raster = statistical_index_raster_list[0]
+                while (i <= len(statistical_index_raster_list)-1):
+                    si_sum_raster = self.run("gdal:rastercalculator", {'INPUT_A':si_sum_raster,'BAND_A':1,'INPUT_B':statistical_index_raster_list[i],'BAND_B':None,'INPUT_C':None,'BAND_C':None,'INPUT_D':None,'BAND_D':None,'INPUT_E':None,'BAND_E':None,'INPUT_F':None,'BAND_F':None,'FORMULA':'A + B','NO_DATA':None,'PROJWIN':None,'RTYPE':5,'OPTIONS':profile.processing_options(),'EXTRA':'','OUTPUT':self.outputFile('si_raster_addition/landslides_risk_si_'+str(i)+'.tif')})['OUTPUT']            #if i >= 2:
+
+                    i += 1
+
+            self.tracer.start('output rasters')
+            if engine == 0:
+                result_rasters = reclassified_rasters + list(partial_sums.values()) + [si_sum_raster]
+            else:
+                result_rasters = list(statistical_index_raster_list)
+                result_rasters += [self.outputFile('si_raster_addition/landslides_risk_si_'+str(i)+'.tif') for i in range(1, len(statistical_index_raster_list))]
+            for raster in result_rasters:
+                profile.finish(raster)
+            if incremental:
+                InventoryManifest(settings, grid, factor_list, factor_tables, pixel_landslide_count, maps=map_state(*sums)).save(self.output, current_pixels)
+        
+            self.tracer.start('catalog')
+            statistics.landslide_count = pixel_landslide_count
+            catalog = self.parameterAsString(parameters, 'catalog', context)
+            if catalog:
+                statistics.write(catalog)
+        finally:
+            self.intermediates.close()
+            if cache is not None:
+                cache.release()
+        self.tracer.report(feedback, self.outputFile(TRACE_FILE))
+
+        if not self.headless:
+            result_layer = QgsRasterLayer(si_sum_raster,"landslide_risk_map")
+            QgsProject.instance().addMapLayer(result_layer)
         
         
         return{}
-        
-        
 
-def unique_values_from_csv(file):
-     with open(file) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=',')
-        i = 0
-        list = []
-        for row in csv_reader:
-            if i != 0:
-                list.append(str(int(float(row[0]))))
-            i += 1
-        return list
-
-def zonal_statistics_as_dic_from_csv(file):
-    with open(file) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=',')
-        i = 0
-        dic = {}
-        for row in csv_reader:
-            if i != 0:
-                dic.update({str(int(float(row[0]))): float(row[3])})
-            i += 1
-        return dic
-        
-def create_statistical_index_list(pixel_landslides_per_class,pixel_per_class,pixel_landslide_count,unique_values):
-    list = []
-    for key in unique_values:
-        if key in pixel_landslides_per_class:
-            list.append(key)
-            list.append(key)
-            si = np.log((pixel_landslides_per_class.get(key)/pixel_per_class.get(key))/(pixel_landslide_count/sum(pixel_per_class.values())))
-            list.append(str(si))
-        else: 
-            if key in pixel_per_class:
-                list.append(key)
-                list.append(key)
-                si = np.log((0.1/pixel_per_class.get(key))/(pixel_landslide_count/sum(pixel_per_class.values())))
-                list.append(str(si))
-            else: 
-                list.append(key)
-                list.append(key)
-                si = 0
-                list.append(str(si))
-    return list
-    
-    
-
-    
\ No newline at end of file
+    def inventorySettings(self, parameters, context, memory_budget):
+        """
+        Returns the inputs (except the landslides) and settings the counts of a run depend on, recorded in the inventory manifest.
+        """
+        inputs = self.inputSources(parameters, context)
+        del inputs['landslides']
+        return {'script':'wf','inputs':inputs,'terrain':self.terrainParameters(),'memory_budget':memory_budget,'partial_sums':self.parameterAsBool(parameters, 'partial_sums', context)}
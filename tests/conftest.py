@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shared fixtures of the engine tests. The engine package is located in ../scripts.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from landslide_engine.raster_io import RasterGrid, create_raster, write_window
+
+
+@pytest.fixture
+def grid():
+    '''
+    30 m grid of 37 x 23 pixels (rows not a multiple of the test block rows)
+    '''
+    return RasterGrid((500000.0, 30.0, 0.0, 2300000.0, 0.0, -30.0), 23, 37)
+
+
+@pytest.fixture
+def write_raster(tmp_path):
+    '''
+    writes an array as GeoTIFF on a grid: write_raster(name, grid, array, data_type, nodata)
+    '''
+    from osgeo import gdal
+
+    def write(name, grid, array, data_type=gdal.GDT_Float32, nodata=-9999):
+        file = str(tmp_path / name)
+        dataset = create_raster(file, grid, data_type, nodata)
+        write_window(dataset, np.asarray(array), 0, nodata)
+        dataset = None
+        return file
+    return write
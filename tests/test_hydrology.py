@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from landslide_engine import hydrology
+from landslide_engine.hydrology import D8, MFD, catchment_area, fill_depressions, specific_catchment_area
+from landslide_engine.raster_io import RasterGrid, open_raster, read_window
+
+
+def read_raster(file):
+    dataset = open_raster(file)
+    return read_window(dataset, 0, dataset.RasterYSize)
+
+
+def random_dgm(grid, seed):
+    '''
+    rough slope with flats, pits and a few nodata pixels
+    '''
+    rng = np.random.default_rng(seed)
+    dgm = np.round(rng.random((grid.ysize, grid.xsize)) * 4) + np.add.outer(np.arange(grid.ysize), np.arange(grid.xsize)) * 0.3
+    dgm[rng.random(dgm.shape) < 0.03] = np.nan
+    return dgm.astype(np.float32)
+
+
+@pytest.mark.parametrize('method', [D8, MFD])
+@pytest.mark.parametrize('size', [4, 7, 16])
+def test_tiled_catchment_area_equals_one_tile(grid, write_raster, tmp_path, monkeypatch, method, size):
+    dgm = write_raster('dgm.tif', grid, random_dgm(grid, size))
+    whole = read_raster(catchment_area(dgm, str(tmp_path / 'whole' / 'SCA.tif'), method))
+    # small tiles, so the spill elevations, flat distances and flows cross many tile borders
+    monkeypatch.setattr(hydrology, 'hydrology_tile_size', lambda grid, memory_budget: size)
+    tiled = read_raster(catchment_area(dgm, str(tmp_path / 'tiled' / 'SCA.tif'), method, memory_budget=1))
+    assert np.array_equal(np.isnan(whole), np.isnan(tiled))
+    np.testing.assert_allclose(tiled[~np.isnan(tiled)], whole[~np.isnan(whole)], rtol=1e-6)
+
+
+def test_plane_drains_down_the_slope():
+    # falls by one per row towards the last row, D8 flows straight down
+    dgm = np.repeat(np.arange(12, 0, -1, dtype=np.float64)[:, None], 9, axis=1)
+    sca = specific_catchment_area(dgm, 10.0, -20.0, D8)
+    # upslope area of every cell: the cells above it and itself (10 x 20 m each) per 10 m cell width
+    np.testing.assert_allclose(sca, np.repeat((np.arange(12) + 1.0)[:, None] * 20.0, 9, axis=1))
+
+
+def test_plane_with_multiple_flow_directions_keeps_the_area():
+    dgm = np.repeat(np.arange(12, 0, -1, dtype=np.float64)[:, None], 9, axis=1)
+    sca = specific_catchment_area(dgm, 10.0, -10.0, MFD)
+    # the flow spreads over the row below, but no area is lost or gained between the rows
+    np.testing.assert_allclose(sca.sum(axis=1), (np.arange(12) + 1.0) * 9 * 10.0)
+
+
+def test_pit_is_filled_to_its_outlet():
+    # a basin below a rim of 10 with one notch of 1 in the top row
+    rng = np.random.default_rng(3)
+    dgm = np.full((9, 11), 10.0)
+    dgm[1:-1, 1:-1] = rng.random((7, 9))
+    dgm[0, 5] = 1.0
+    filled = fill_depressions(dgm)
+    expected = dgm.copy()
+    expected[1:-1, 1:-1] = 1.0
+    np.testing.assert_array_equal(filled, expected)
+    sca = specific_catchment_area(dgm, 10.0, -10.0, D8)
+    assert np.isfinite(sca).all()
+    # the whole basin drains through the notch
+    assert sca[0, 5] >= (7 * 9 + 1) * 10.0
+
+
+def test_nodata_stays_nodata(grid, write_raster, tmp_path):
+    dgm = random_dgm(grid, 5)
+    sca = read_raster(catchment_area(write_raster('dgm.tif', grid, dgm), str(tmp_path / 'SCA.tif'), D8))
+    assert np.array_equal(np.isnan(sca), np.isnan(dgm))
+    assert (sca[~np.isnan(sca)] >= abs(grid.geotransform[5])).all()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from osgeo import gdal
+
+from landslide_engine.reclassify import ReclassTable
+from landslide_engine.statistics import Factor, contingency_tables
+from landslide_engine.viewshed import ViewshedMask
+from landslide_engine.indices import factor_index_tables, total_statistical_index, weight_factors
+from landslide_engine.mapping import risk_maps, replace_factor, SUM_DATA_TYPE
+from landslide_engine.inventory import InventoryManifest, inventory_pixels, diff_inventory, update_counts, map_state
+from landslide_engine.raster_io import open_raster, read_window
+
+DGM_TABLE = ['', '500', '0', '500', '1000', '1', '1000', '1500', '2', '1500', '2000', '3', '2000', '', '4']
+
+# factor inputs of the tests ({input: factor name}) like FACTOR_INPUTS of the scripts
+FACTOR_INPUTS = {'soil': 'soil', 'precipation': 'precip'}
+
+
+def read_raster(file):
+    dataset = open_raster(file)
+    return read_window(dataset, 0, dataset.RasterYSize)
+
+
+def class_raster(rng, shape, classes, nodata_share=0.1):
+    codes = rng.integers(1, classes + 1, shape).astype(np.float64)
+    codes[rng.random(shape) < nodata_share] = np.nan
+    return codes
+
+
+def study_area(grid, write_raster, seed=0):
+    '''
+    factor rasters, viewshed and two landslide inventories which share most of their pixels
+    '''
+    rng = np.random.default_rng(seed)
+    shape = (grid.ysize, grid.xsize)
+    landslides = rng.random(shape) < 0.2
+    # a few landslides are removed and others added
+    updated = landslides ^ (rng.random(shape) < 0.05)
+    return {'soil': write_raster('soil.tif', grid, class_raster(rng, shape, 5), gdal.GDT_Int16),
+            'precip': write_raster('precip.tif', grid, class_raster(rng, shape, 3), gdal.GDT_Int16),
+            'dgm': write_raster('dgm.tif', grid, rng.uniform(0, 2500, shape)),
+            'viewshed': write_raster('viewshed.tif', grid, (rng.random(shape) < 0.7).astype(np.uint8), gdal.GDT_Byte, None),
+            'landslides': write_raster('landslides.tif', grid, landslides.astype(np.uint8), gdal.GDT_Byte, None),
+            'updated': write_raster('updated.tif', grid, updated.astype(np.uint8), gdal.GDT_Byte, None)}
+
+
+def factors_of(files, soil=None):
+    return [Factor('soil', soil or files['soil']), Factor('precip', files['precip']), Factor('dgm', files['dgm'], ReclassTable(DGM_TABLE))]
+
+
+def assert_same_tables(tables, expected):
+    for table, other in zip(tables, expected):
+        assert table.unique_values() == other.unique_values()
+        assert table.pixel_per_class() == other.pixel_per_class()
+        assert table.landslides_per_class() == other.landslides_per_class()
+
+
+def test_update_counts_equals_full_count(grid, write_raster):
+    files = study_area(grid, write_raster)
+    factors = factors_of(files)
+    viewshed = ViewshedMask.from_raster(files['viewshed'], grid, 8)
+    tables, landslide_count = contingency_tables(factors, files['landslides'], grid, viewshed, block_rows=8)
+
+    added, removed = diff_inventory(inventory_pixels(files['landslides'], grid, 8), inventory_pixels(files['updated'], grid, 8))
+    assert added.size and removed.size
+    tables, landslide_count = update_counts(tables, factors, grid, viewshed, added, removed, landslide_count, block_rows=8)
+
+    expected, expected_count = contingency_tables(factors, files['updated'], grid, viewshed, block_rows=8)
+    assert landslide_count == expected_count
+    assert_same_tables(tables, expected)
+
+
+def test_update_counts_without_changes(grid, write_raster):
+    files = study_area(grid, write_raster, seed=1)
+    factors = factors_of(files)
+    viewshed = ViewshedMask.from_raster(files['viewshed'], grid, 8)
+    tables, landslide_count = contingency_tables(factors, files['landslides'], grid, viewshed, block_rows=8)
+    pixels = inventory_pixels(files['landslides'], grid, 8)
+    added, removed = diff_inventory(pixels, pixels)
+    updated, updated_count = update_counts(tables, factors, grid, viewshed, added, removed, landslide_count, block_rows=8)
+    expected, expected_count = contingency_tables(factors, files['landslides'], grid, viewshed, block_rows=8)
+    assert updated_count == expected_count
+    assert_same_tables(updated, expected)
+
+
+def run_sums(factors, tables, landslide_count, grid, si_sum, tsi_sum):
+    '''
+    si tables and tsi of a full run, with its si sum and tsi weighted sum
+    '''
+    index_tables = factor_index_tables(tables, landslide_count)
+    tsi_list = [total_statistical_index(table, factor_table.landslides_per_class()) for table, factor_table in zip(index_tables, tables)]
+    risk_maps(factors, index_tables, [[1.0] * len(factors), tsi_list], [si_sum, tsi_sum], grid, block_rows=8,
+              data_types=[SUM_DATA_TYPE, SUM_DATA_TYPE])
+    return index_tables, tsi_list
+
+
+@pytest.mark.parametrize('replacements', [1, 3])
+def test_replace_factor_equals_full_run(grid, write_raster, tmp_path, replacements):
+    files = study_area(grid, write_raster, seed=2)
+    factors = factors_of(files)
+    viewshed = ViewshedMask.from_raster(files['viewshed'], grid, 8)
+    tables, landslide_count = contingency_tables(factors, files['landslides'], grid, viewshed, block_rows=8)
+    sums = [str(tmp_path / 'si_sum.tif'), str(tmp_path / 'tsi_weighted_sum.tif')]
+    maps = [str(tmp_path / 'landslides_risk_si.tif'), str(tmp_path / 'landslides_risk_wf.tif')]
+    index_tables, tsi_list = run_sums(factors, tables, landslide_count, grid, *sums)
+
+    rng = np.random.default_rng(3)
+    for number in range(replacements):
+        # another nodata pattern, so pixels without a value in the old map get one
+        soil = write_raster('soil_' + str(number) + '.tif', grid, class_raster(rng, (grid.ysize, grid.xsize), 4 + number, 0.2), gdal.GDT_Int16)
+        old_factor, old_table, old_tsi = factors[0], index_tables[0], tsi_list[0]
+        factors = factors_of(files, soil)
+        # only the replaced factor is counted, like the scripts do
+        [replaced_table], count = contingency_tables([factors[0]], files['landslides'], grid, viewshed, block_rows=8)
+        assert count == landslide_count
+        tables = [replaced_table] + tables[1:]
+        index_tables = factor_index_tables(tables, landslide_count)
+        tsi_list = [total_statistical_index(table, factor_table.landslides_per_class()) for table, factor_table in zip(index_tables, tables)]
+        replace_factor(factors, index_tables, tsi_list, 0, old_factor, old_table, old_tsi, sums, maps, grid, block_rows=8)
+
+    expected_tables, expected_count = contingency_tables(factors, files['landslides'], grid, viewshed, block_rows=8)
+    assert_same_tables(tables, expected_tables)
+    full = [str(tmp_path / 'full_si_sum.tif'), str(tmp_path / 'full_tsi_weighted_sum.tif')]
+    expected_index_tables, expected_tsi = run_sums(factors, expected_tables, expected_count, grid, *full)
+    assert index_tables == expected_index_tables
+    assert tsi_list == expected_tsi
+    for file, expected in zip(sums, full):
+        np.testing.assert_allclose(read_raster(file), read_raster(expected), rtol=1e-12, equal_nan=True)
+
+    full_maps = [str(tmp_path / 'full_risk_si.tif'), str(tmp_path / 'full_risk_wf.tif')]
+    risk_maps(factors, index_tables, [[1.0] * len(factors), weight_factors(tsi_list)], full_maps, grid, block_rows=8)
+    for file, expected in zip(maps, full_maps):
+        np.testing.assert_allclose(read_raster(file), read_raster(expected), rtol=1e-6, equal_nan=True)
+
+
+def test_replaced_input_of_the_manifest(grid, write_raster, tmp_path):
+    files = study_area(grid, write_raster, seed=4)
+    factors = factors_of(files)
+    tables, landslide_count = contingency_tables(factors, files['landslides'], grid, files['viewshed'], block_rows=8)
+    si_sum, tsi_sum = str(tmp_path / 'si_sum.tif'), str(tmp_path / 'tsi_weighted_sum.tif')
+    run_sums(factors, tables, landslide_count, grid, si_sum, tsi_sum)
+    settings = {'script': 'wf', 'inputs': {'soil': files['soil'], 'precipation': files['precip'], 'dgm': files['dgm']}}
+    folder = tmp_path / 'output'
+    folder.mkdir()
+    InventoryManifest(settings, grid, factors, tables, landslide_count, maps=map_state(si_sum, tsi_sum)).save(str(folder), inventory_pixels(files['landslides'], grid))
+    manifest = InventoryManifest.load(str(folder))
+
+    assert manifest.mismatch(settings, grid) is None
+    soil = write_raster('soil_new.tif', grid, class_raster(np.random.default_rng(5), (grid.ysize, grid.xsize), 5), gdal.GDT_Int16)
+    assert manifest.replaced_input(dict(settings, inputs=dict(settings['inputs'], soil=soil)), grid, FACTOR_INPUTS) == 'soil'
+    # two replaced inputs, or a replaced input which is no factor raster, need a full run
+    precip = write_raster('precip_new.tif', grid, class_raster(np.random.default_rng(6), (grid.ysize, grid.xsize), 3), gdal.GDT_Int16)
+    assert manifest.replaced_input(dict(settings, inputs=dict(settings['inputs'], soil=soil, precipation=precip)), grid, FACTOR_INPUTS) is None
+    assert manifest.replaced_input(dict(settings, inputs=dict(settings['inputs'], dgm=soil)), grid, FACTOR_INPUTS) is None
+    assert manifest.replaced_input(dict(settings, script='si'), grid, FACTOR_INPUTS) is None
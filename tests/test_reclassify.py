@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from landslide_engine.raster_io import RasterGrid, open_raster, read_window
+from landslide_engine.reclassify import (ReclassTable, reclassify_raster, apply_tables, MIN_EXCLUSIVE_MAX_INCLUSIVE,
+                                         MIN_INCLUSIVE_MAX_EXCLUSIVE, MIN_INCLUSIVE_MAX_INCLUSIVE, MIN_EXCLUSIVE_MAX_EXCLUSIVE)
+from landslide_engine.scripts import TWI_TABLE, SLOPE_TABLE, ASPECT_TABLE
+
+BOUNDARIES = [MIN_EXCLUSIVE_MAX_INCLUSIVE, MIN_INCLUSIVE_MAX_EXCLUSIVE, MIN_INCLUSIVE_MAX_INCLUSIVE, MIN_EXCLUSIVE_MAX_EXCLUSIVE]
+
+
+def reference(table, range_boundaries, values):
+    '''
+    native:reclassifybytable pixel by pixel: the first matching row wins, unmatched values are kept
+    '''
+    rows = [(float(table[i]) if table[i] != '' else -np.inf, float(table[i + 1]) if table[i + 1] != '' else np.inf,
+             float(table[i + 2])) for i in range(0, len(table), 3)]
+    result = []
+    for value in values:
+        for minimum, maximum, new in rows:
+            above = value >= minimum if range_boundaries in (MIN_INCLUSIVE_MAX_EXCLUSIVE, MIN_INCLUSIVE_MAX_INCLUSIVE) else value > minimum
+            below = value <= maximum if range_boundaries in (MIN_EXCLUSIVE_MAX_INCLUSIVE, MIN_INCLUSIVE_MAX_INCLUSIVE) else value < maximum
+            if above and below:
+                value = new
+                break
+        result.append(value)
+    return np.array(result)
+
+
+def check(table, range_boundaries, values):
+    compiled = ReclassTable(table, range_boundaries)
+    np.testing.assert_array_equal(compiled.apply(values), reference(table, range_boundaries, values))
+    return compiled
+
+
+@pytest.mark.parametrize('range_boundaries', BOUNDARIES)
+@pytest.mark.parametrize('table', [TWI_TABLE, SLOPE_TABLE, ASPECT_TABLE])
+def test_break_tables_on_and_between_the_breaks(table, range_boundaries):
+    breaks = [float(value) for value in table if value != '']
+    values = np.array(sorted(set(breaks + [value + 0.5 for value in breaks] + [value - 0.5 for value in breaks] + [-1e9, 1e9])))
+    compiled = check(table, range_boundaries, values)
+    assert not compiled.exact
+
+
+def test_nodata_stays_nodata():
+    result = ReclassTable(TWI_TABLE).apply(np.array([np.nan, -8.0, np.nan]))
+    assert np.isnan(result[0]) and np.isnan(result[2])
+    assert result[1] == 0.0
+
+
+def test_gaps_keep_their_value():
+    # 10..20 is not covered, like a table without an open end
+    check(['0', '10', '1', '20', '30', '2'], MIN_EXCLUSIVE_MAX_INCLUSIVE, np.array([-5.0, 0.0, 5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0]))
+
+
+def test_exact_table_uses_the_lookup():
+    table = ['3', '3', '0.5', '1', '1', '-0.25', '7', '7', '1.75']
+    compiled = check(table, MIN_INCLUSIVE_MAX_INCLUSIVE, np.array([0.0, 1.0, 2.0, 3.0, 3.5, 7.0, 8.0, -1.0]))
+    assert compiled.exact
+
+
+def test_exact_table_needs_inclusive_boundaries():
+    # with an exclusive boundary no value matches a single value row
+    table = ['3', '3', '0.5', '1', '1', '-0.25']
+    compiled = check(table, MIN_EXCLUSIVE_MAX_INCLUSIVE, np.array([1.0, 3.0]))
+    assert not compiled.exact
+
+
+def test_exact_table_first_row_wins():
+    check(['2', '2', '10', '2', '2', '20', '4', '4', '40'], MIN_INCLUSIVE_MAX_INCLUSIVE, np.array([2.0, 4.0]))
+
+
+@pytest.mark.parametrize('range_boundaries', BOUNDARIES)
+def test_overlapping_rows_first_row_wins(range_boundaries):
+    table = ['0', '10', '1', '5', '15', '2', '', '7', '3', '12', '', '4']
+    compiled = check(table, range_boundaries, np.arange(-2.0, 20.0, 0.5))
+    assert compiled.overlapping
+
+
+@pytest.mark.parametrize('range_boundaries', BOUNDARIES)
+def test_random_tables(range_boundaries):
+    rng = np.random.default_rng(range_boundaries)
+    for repetition in range(50):
+        breaks = np.sort(rng.choice(np.arange(-20, 21), size=rng.integers(2, 8), replace=False)).astype(float)
+        rows = [(breaks[i], breaks[i + 1]) for i in range(breaks.size - 1)]
+        if rng.random() < 0.5:
+            rows = [(None, breaks[0])] + rows + [(breaks[-1], None)]
+        if rng.random() < 0.3:
+            # an overlapping row
+            rows.append(tuple(np.sort(rng.choice(breaks, size=2, replace=False))))
+        order = rng.permutation(len(rows))
+        table = []
+        for index in order:
+            minimum, maximum = rows[index]
+            table += ['' if minimum is None else str(minimum), '' if maximum is None else str(maximum), str(float(index))]
+        values = np.concatenate([breaks, rng.uniform(-25, 25, 200)])
+        check(table, range_boundaries, values)
+
+
+def test_table_chain_and_raster(grid, write_raster, tmp_path):
+    rng = np.random.default_rng(2)
+    slope = rng.uniform(0, 60, (grid.ysize, grid.xsize))
+    slope[0, :5] = np.nan
+    source = write_raster('slope.tif', grid, slope)
+    slope = slope.astype(np.float32).astype(np.float64)
+    si = ReclassTable(['0', '0', '-1.5', '1', '1', '0.25', '6', '6', '2.0'], MIN_INCLUSIVE_MAX_INCLUSIVE)
+    tables = [ReclassTable(SLOPE_TABLE), si]
+
+    output = reclassify_raster(source, tables, str(tmp_path / 'si.tif'), block_rows=8)
+    written = read_window(open_raster(output), 0, grid.ysize)
+    expected = apply_tables(slope, tables).astype(np.float32).astype(np.float64)
+    np.testing.assert_array_equal(written, expected)
+    assert RasterGrid.from_path(output).matches(open_raster(source))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from osgeo import gdal
+
+from landslide_engine.reclassify import ReclassTable
+from landslide_engine.statistics import ClassCounter, FactorTable, Factor, contingency_tables
+
+
+def test_class_counter_grows_to_both_sides():
+    counter = ClassCounter()
+    counter.add(np.array([3, 4, 4]))
+    counter.add(np.array([-2, 7]))
+    assert counter.offset == -2
+    assert counter.codes().tolist() == [-2, 3, 4, 7]
+    assert [counter.get(code) for code in [-2, 3, 4, 7]] == [1, 1, 2, 1]
+    assert counter.get(-3) == 0 and counter.get(5) == 0 and counter.get(100) == 0
+
+
+def test_class_counter_weights_and_empty_blocks():
+    counter = ClassCounter()
+    counter.add(np.array([], dtype=np.int64))
+    assert counter.codes().size == 0
+    counter.add(np.array([1, 2, 1]), weights=np.array([2.0, 1.0, 3.0]))
+    assert counter.as_dict() == {'1': 5.0, '2': 1.0}
+
+
+def test_class_counter_merge_disjoint_ranges():
+    low = ClassCounter()
+    low.add(np.array([0, 1, 1]))
+    high = ClassCounter()
+    high.add(np.array([10, 12]))
+    low.merge(high)
+    low.merge(ClassCounter())
+    assert low.as_dict() == {'0': 1.0, '1': 2.0, '10': 1.0, '12': 1.0}
+    # the merged counter is not changed
+    assert high.as_dict() == {'10': 1.0, '12': 1.0}
+
+
+def test_factor_table_masks():
+    table = FactorTable('soil')
+    codes = np.array([[1, 2, 2], [3, 1, 2]])
+    valid = np.array([[True, True, False], [True, True, True]])
+    in_viewshed = np.array([[True, False, True], [True, True, True]])
+    is_landslide = np.array([[True, True, True], [False, True, False]])
+    table.add(codes, valid, in_viewshed, is_landslide)
+    # unique values of the whole grid, counts inside the viewshed like the clipped zonal statistics
+    assert table.unique_values() == ['1', '2', '3']
+    assert table.pixel_per_class() == {'1': 2.0, '2': 1.0, '3': 1.0}
+    assert table.landslides_per_class() == {'1': 2.0}
+
+
+def brute_force(codes, viewshed, landslides):
+    '''
+    unique values, pixels and landslide pixels per class counted pixel by pixel
+    '''
+    unique, pixels, landslide_pixels = set(), {}, {}
+    for code, inside, landslide in zip(codes.ravel(), viewshed.ravel(), landslides.ravel()):
+        if np.isnan(code):
+            continue
+        key = str(int(code))
+        unique.add(int(code))
+        if inside:
+            pixels[key] = pixels.get(key, 0.0) + 1
+            if landslide:
+                landslide_pixels[key] = landslide_pixels.get(key, 0.0) + 1
+    return [str(code) for code in sorted(unique)], pixels, landslide_pixels
+
+
+def study_area(grid, write_raster, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (grid.ysize, grid.xsize)
+    soil = rng.integers(1, 6, shape).astype(np.float64)
+    soil[rng.random(shape) < 0.1] = np.nan
+    dgm = rng.uniform(0, 2500, shape)
+    viewshed = (rng.random(shape) < 0.7).astype(np.uint8)
+    landslides = (rng.random(shape) < 0.2).astype(np.uint8)
+    files = {'soil': write_raster('soil.tif', grid, soil, gdal.GDT_Int16),
+             'dgm': write_raster('dgm.tif', grid, dgm),
+             'viewshed': write_raster('viewshed.tif', grid, viewshed, gdal.GDT_Byte, None),
+             'landslides': write_raster('landslides.tif', grid, landslides, gdal.GDT_Byte, None)}
+    return files, {'soil': soil, 'dgm': dgm.astype(np.float32).astype(np.float64), 'viewshed': viewshed > 0, 'landslides': landslides > 0}
+
+
+def test_contingency_tables_match_brute_force(grid, write_raster):
+    files, arrays = study_area(grid, write_raster)
+    dgm_table = ReclassTable(['', '500', '0', '500', '1000', '1', '1000', '1500', '2', '1500', '2000', '3', '2000', '', '4'])
+    factors = [Factor('soil', files['soil']), Factor('dgm', files['dgm'], dgm_table)]
+    tables, landslide_count = contingency_tables(factors, files['landslides'], grid, files['viewshed'], block_rows=8)
+
+    assert landslide_count == int(np.count_nonzero(arrays['landslides']))
+    for table, codes in zip(tables, [arrays['soil'], dgm_table.apply(arrays['dgm'])]):
+        unique, pixels, landslides = brute_force(codes, arrays['viewshed'], arrays['landslides'])
+        assert table.unique_values() == unique
+        assert table.pixel_per_class() == pixels
+        assert table.landslides_per_class() == landslides
+
+
+def test_contingency_tables_do_not_depend_on_workers(grid, write_raster):
+    files, arrays = study_area(grid, write_raster, seed=1)
+    factors = [Factor('soil', files['soil'])]
+    single, single_count = contingency_tables(factors, files['landslides'], grid, files['viewshed'], block_rows=4)
+    parallel, parallel_count = contingency_tables(factors, files['landslides'], grid, files['viewshed'], block_rows=4, workers=3)
+    assert single_count == parallel_count
+    assert single[0].unique_values() == parallel[0].unique_values()
+    assert single[0].pixel_per_class() == parallel[0].pixel_per_class()
+    assert single[0].landslides_per_class() == parallel[0].landslides_per_class()
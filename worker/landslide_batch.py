@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batch runner for many study areas with resumable checkpoints.
+
+The regions are listed in a batch manifest (JSON) with their input files and
+output folder. Every region runs the same stages, a stage is one run of a
+script (si, wf, roc or combined) with the parameters of the manifest:
+
+    {
+     "parameters": {"engine": 0, "workers": 1},
+     "stages": [
+      {"name": "si", "algorithm": "si"},
+      {"name": "roc", "algorithm": "roc",
+       "parameters": {"riskmap": "{output}/si/si_raster_addition/landslides_risk_si_12.tif"}}
+     ],
+     "regions": [
+      {"name": "region_a", "output": "/runs/region_a",
+       "inputs": {"dgm": "/data/a/dgm.tif", "landslides": "/data/a/landslides.tif", ...},
+       "parameters": {"memory_budget": 512}}
+     ]
+    }
+
+The parameters of a stage are the parameters of the manifest, the inputs
+and parameters of the region and the parameters of the stage (later ones
+win); {output}, {name} and {<input>} in strings are replaced by the output
+folder, the name and the inputs of the region. A stage writes into the sub
+folder <output>/<stage name>. Without stages every region runs the combined
+script.
+
+QGIS is initialized once (like the worker), up to --workers regions run at
+the same time in threads of this process, the stages of a region one after
+the other. After every stage the checkpoint of the region
+(<output>/batch_checkpoint.json) records it as done with its results. A batch
+which is started again (after a crash of QGIS, or with new regions) skips
+the stages which are done with the same parameters and unchanged input files
+(same size and modification time) and continues with the
+first stage which is not; all later stages run again, they may read its
+outputs. Inside a stage the raster cache (one cache folder per region,
+<output>/cache; --no-cache turns it off) keeps the terrain derivatives, road
+distances and class codes of an interrupted run, so a stage which failed in
+SAGA does not calculate them again. Failed stages are tried --retries times more before the region stops.
+The SI, WF and combined stages of all regions add their statistics to one
+catalog, statistics.sqlite next to the batch manifest (or --catalog), unless
+the manifest gives a catalog.
+
+    python worker/landslide_batch.py regions.json --workers 4
+
+The status of all regions is written to <manifest>.status.json.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from landslide_worker import start_qgis, load_scripts, run_algorithm, JobFeedback
+
+# checkpoint file in the output folder of a region
+CHECKPOINT_FILE = 'batch_checkpoint.json'
+
+VERSION = 1
+
+# catalog of all regions, next to the batch manifest
+BATCH_CATALOG = 'statistics.sqlite'
+
+# algorithms with a statistics catalog parameter
+CATALOG_ALGORITHMS = ['si', 'wf', 'combined']
+
+# parameters with files or folders which the stages write, not part of the stage digest
+WRITTEN_PARAMETERS = ['output', 'cache', 'catalog']
+
+# stages of a region when the manifest has none
+DEFAULT_STAGES = [{'name': 'combined', 'algorithm': 'combined'}]
+
+
+def fill(value, fields):
+    '''
+    replaces {field} in the strings of a parameter value (also in lists and dictionaries)
+    '''
+    if isinstance(value, str):
+        return value.format(**fields) if '{' in value else value
+    if isinstance(value, list):
+        return [fill(item, fields) for item in value]
+    if isinstance(value, dict):
+        return dict((key, fill(item, fields)) for key, item in value.items())
+    return value
+
+
+def input_stamps(parameters):
+    '''
+    size and modification time of the files in the parameters (inputs of the region and outputs of earlier stages)
+    '''
+    stamps = {}
+    for name, value in parameters.items():
+        if name in WRITTEN_PARAMETERS:
+            continue
+        for source in (value if isinstance(value, list) else [value]):
+            # a layer source may end with |layername=...
+            file = source.split('|')[0] if isinstance(source, str) else None
+            if file and os.path.isfile(file):
+                stat = os.stat(file)
+                stamps[os.path.abspath(file)] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def parameter_digest(algorithm, parameters):
+    '''
+    digest of a stage run, changes with the parameters and with the size or modification time of its input files
+    '''
+    return hashlib.sha256(json.dumps([algorithm, parameters, input_stamps(parameters)], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class Checkpoint:
+    '''
+    Completed stages of a region, stored in its output folder
+    '''
+
+    def __init__(self, folder):
+        self.file = os.path.join(folder, CHECKPOINT_FILE)
+        self.stages = {}
+        if os.path.exists(self.file):
+            with open(self.file, encoding='utf8') as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('version') == VERSION:
+                self.stages = checkpoint['stages']
+
+    def done(self, name, digest):
+        '''
+        True if the stage was completed with the same algorithm and parameters
+        '''
+        stage = self.stages.get(name)
+        return stage is not None and stage['status'] == 'done' and stage['digest'] == digest
+
+    def record(self, name, digest, status, **values):
+        self.stages[name] = dict(values, digest=digest, status=status, time=time.time())
+        # the checkpoint is replaced at once, a crash leaves the previous one
+        with open(self.file + '.tmp', 'w', encoding='utf8') as f:
+            json.dump({'version': VERSION, 'stages': self.stages}, f, indent=1, default=str)
+        os.replace(self.file + '.tmp', self.file)
+
+
+class Batch:
+    '''
+    Regions and stages of a batch manifest
+    '''
+
+    def __init__(self, manifest, cache=True, retries=0, catalog=None):
+        self.parameters = manifest.get('parameters', {})
+        self.stages = manifest.get('stages') or DEFAULT_STAGES
+        self.regions = manifest['regions']
+        self.cache = cache
+        self.retries = retries
+        self.catalog = catalog
+        names = [region['name'] for region in self.regions]
+        if len(set(names)) != len(names):
+            raise ValueError('the region names are not unique')
+        for stage in self.stages:
+            if not stage['name'].isidentifier():
+                raise ValueError('stage name ' + repr(stage['name']) + ' is not usable as folder name')
+
+    @classmethod
+    def load(cls, file, cache=True, retries=0, catalog=None):
+        '''
+        the batch of a manifest file, by default its regions share the catalog next to the manifest
+        '''
+        if catalog is None:
+            catalog = os.path.join(os.path.dirname(os.path.abspath(file)), BATCH_CATALOG)
+        with open(file, encoding='utf8') as f:
+            return cls(json.load(f), cache, retries, catalog)
+
+    def stage_parameters(self, region, stage):
+        '''
+        parameters of a stage run for a region
+        '''
+        fields = dict(region.get('inputs', {}), output=region['output'], name=region['name'])
+        parameters = dict(self.parameters)
+        parameters.update(region.get('inputs', {}))
+        parameters.update(region.get('parameters', {}))
+        parameters.update(stage.get('parameters', {}))
+        parameters = fill(parameters, fields)
+        parameters['output'] = os.path.join(region['output'], stage['name'])
+        if self.cache and not parameters.get('cache'):
+            # derived rasters of an interrupted stage are found again, also by the other stages of the region
+            parameters['cache'] = os.path.join(region['output'], 'cache')
+        if self.catalog and stage['algorithm'] in CATALOG_ALGORITHMS and not parameters.get('catalog'):
+            # the runs of all regions are compared in one catalog
+            parameters['catalog'] = self.catalog
+        return parameters
+
+    def run_region(self, scripts, region, log=print):
+        '''
+        runs the stages of a region which are not done yet, returns its status
+        '''
+        if not os.path.exists(region['output']):
+            os.makedirs(region['output'])
+        checkpoint = Checkpoint(region['output'])
+        rerun = False
+        for stage in self.stages:
+            parameters = self.stage_parameters(region, stage)
+            digest = parameter_digest(stage['algorithm'], parameters)
+            # a stage which runs again may change the inputs of the following stages
+            if not rerun and checkpoint.done(stage['name'], digest):
+                log(region['name'] + ': ' + stage['name'] + ' already done')
+                continue
+            rerun = True
+            if not os.path.exists(parameters['output']):
+                os.makedirs(parameters['output'])
+            for attempt in range(self.retries + 1):
+                start = time.time()
+                feedback = JobFeedback()
+                checkpoint.record(stage['name'], digest, 'running', attempt=attempt + 1)
+                try:
+                    results = run_algorithm(scripts, stage['algorithm'], parameters, feedback)
+                except Exception:
+                    checkpoint.record(stage['name'], digest, 'failed', attempt=attempt + 1, seconds=time.time() - start,
+                                      error=traceback.format_exc(), log=feedback.log)
+                    log(region['name'] + ': ' + stage['name'] + ' failed (attempt ' + str(attempt + 1) + ')')
+                    continue
+                checkpoint.record(stage['name'], digest, 'done', attempt=attempt + 1, seconds=time.time() - start,
+                                  results=results, log=feedback.log)
+                log(region['name'] + ': ' + stage['name'] + ' done')
+                break
+            else:
+                return {'status': 'failed', 'stage': stage['name']}
+        return {'status': 'done'}
+
+    def run(self, scripts, workers=1, log=print):
+        '''
+        runs all regions with up to workers at the same time, returns {region name: status}
+        '''
+        status = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = dict((executor.submit(self.run_region, scripts, region, log), region['name']) for region in self.regions)
+            for future in as_completed(futures):
+                try:
+                    status[futures[future]] = future.result()
+                except Exception:
+                    # e.g. an output folder which can not be created
+                    status[futures[future]] = {'status': 'failed', 'error': traceback.format_exc()}
+                log(futures[future] + ': ' + status[futures[future]]['status'])
+        return status
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Runs the landslide scripts for the regions of a batch manifest')
+    parser.add_argument('manifest', help='batch manifest (JSON) with the regions and stages')
+    parser.add_argument('--workers', type=int, default=1, help='regions running at the same time')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='no raster cache per region (default: <output>/cache, so interrupted stages reuse derived rasters)')
+    # the cache is the default, --cache is still accepted
+    parser.add_argument('--cache', dest='cache', action='store_true', help=argparse.SUPPRESS)
+    parser.set_defaults(cache=True)
+    parser.add_argument('--retries', type=int, default=0, help='additional attempts of a failed stage')
+    parser.add_argument('--catalog', default=None, help='statistics catalog of all regions (default: statistics.sqlite next to the manifest)')
+    parser.add_argument('--prefix', default=None, help='QGIS prefix path (default: QGIS_PREFIX_PATH or /usr)')
+    options = parser.parse_args(arguments)
+
+    batch = Batch.load(options.manifest, options.cache, options.retries, options.catalog)
+    application = start_qgis(options.prefix)
+    try:
+        status = batch.run(load_scripts(), options.workers, lambda message: print(message, flush=True))
+    finally:
+        application.exitQgis()
+    with open(os.path.splitext(options.manifest)[0] + '.status.json', 'w', encoding='utf8') as f:
+        json.dump(status, f, indent=1)
+    failed = [name for name in status if status[name]['status'] != 'done']
+    print(str(len(status) - len(failed)) + ' regions done, ' + str(len(failed)) + ' failed', flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
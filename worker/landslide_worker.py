@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+"""
+Headless worker for the landslide scripts.
+
+QGIS and the processing providers are initialized once when the worker
+starts, afterwards the worker takes jobs from a job directory and runs them,
+several at the same time, in one process. A job is a JSON file
+
+    {"algorithm": "si", "parameters": {"dgm": "/data/dgm.tif", ..., "output": "/runs/si_1"}}
+
+with the algorithm (si, wf, roc or combined) and the parameters of the
+script as they would be given to processing.run (file paths, enum indices,
+numbers). The output folder has to exist. A job file <name>.json is claimed by
+renaming it to <name>.running, so several workers can share one directory.
+When the job is finished the worker writes <name>.done (results, run time and
+log) or <name>.failed (with the error) and removes <name>.running.
+
+While a job runs, its worker touches the .running file every POLL_INTERVAL
+seconds. A .running file which was not touched for --stale-after seconds
+belongs to a worker which crashed or was killed; it is renamed back to
+<name>.json and runs again (its output folder is written again).
+
+    python worker/landslide_worker.py /runs/jobs --workers 2
+
+The scripts run with headless = True: they do not initialize QGIS again, do
+not add layers to the project and write all files by absolute paths into
+their output folder instead of changing the working directory.
+
+The jobs of a worker are threads of one process and share the state of the
+engine modules:
+
+- RasterCache.shared returns one cache per cache folder for all jobs; its
+  index is changed under a lock of the folder, a raster which is built by one
+  job is used by the others, and the entries a job reads are pinned until it
+  ends, so the other jobs do not evict them.
+- factor stacks are opened once per process (factor_stack.open_stack); the
+  memory maps are read only, a rewritten file is opened again, and only the
+  MAX_OPEN_STACKS most recently used stacks stay mapped.
+- the CPU time and the bytes read and written in trace.json are counters of
+  the process. With more than one worker they include the other jobs.
+
+Everything else (intermediates, tracer, statistics, QgsProcessingContext)
+belongs to the job.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from qgis.core import QgsApplication, QgsProcessingContext, QgsProcessingFeedback
+
+# the scripts (and the engine package) are located in ../scripts
+SCRIPTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+
+# job algorithm -> script module
+SCRIPTS = {'si': 'landslide_si', 'wf': 'landslide_wf', 'roc': 'landslide_roc', 'combined': 'landslide_combined'}
+
+# seconds between two looks into the job directory (and two touches of the running jobs)
+POLL_INTERVAL = 1.0
+
+# seconds after which a .running file which is not touched any more is taken over
+STALE_AFTER = 300.0
+
+
+def start_qgis(prefix_path=None):
+    '''
+    initializes QGIS without GUI and the processing framework with its providers, returns the application
+    '''
+    QgsApplication.setPrefixPath(prefix_path or os.environ.get('QGIS_PREFIX_PATH', '/usr'), True)
+    application = QgsApplication([], False)
+    application.initQgis()
+    # the processing plugin is not on the python path of a standalone interpreter
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins'))
+    from processing.core.Processing import Processing
+    Processing.initialize()
+    if QgsApplication.processingRegistry().providerById('native') is None:
+        from qgis.analysis import QgsNativeAlgorithms
+        QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
+    return application
+
+
+def load_scripts():
+    '''
+    imports the script modules (after QGIS is initialized), returns {algorithm: module}
+    '''
+    sys.path.append(SCRIPTS_FOLDER)
+    return dict((algorithm, importlib.import_module(module)) for algorithm, module in SCRIPTS.items())
+
+
+class JobFeedback(QgsProcessingFeedback):
+    '''
+    Processing feedback which keeps the log messages of a job
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.log = []
+
+    def pushInfo(self, info):
+        self.log.append(info)
+
+    def pushWarning(self, warning):
+        self.log.append('WARNING: ' + warning)
+
+    def reportError(self, error, fatalError=False):
+        self.log.append('ERROR: ' + error)
+
+
+def run_algorithm(scripts, name, parameters, feedback):
+    '''
+    runs a script headless with the parameters and returns its results, raises on failure
+    '''
+    if name not in scripts:
+        raise ValueError('unknown algorithm ' + repr(name) + ', expected one of ' + ', '.join(SCRIPTS))
+    algorithm = scripts[name].ExampleProcessingAlgorithm().create()
+    algorithm.headless = True
+    try:
+        # the context belongs to the thread of the job
+        context = QgsProcessingContext()
+        results, ok = algorithm.run(parameters, context, feedback)
+        if not ok:
+            raise RuntimeError('the algorithm failed, see the log')
+        return results
+    finally:
+        # a failed run leaves its intermediates, they must not fill the memory of the worker
+        if getattr(algorithm, 'intermediates', None) is not None:
+            algorithm.intermediates.close()
+        # and its open stage, the following jobs would be traced as concurrent
+        if getattr(algorithm, 'tracer', None) is not None:
+            algorithm.tracer.close()
+
+
+def run_job(scripts, job):
+    '''
+    runs one job file (<name>.running) and writes <name>.done or <name>.failed
+    '''
+    base = job[:-len('.running')]
+    start = time.time()
+    feedback = JobFeedback()
+    record = {'job': os.path.basename(base)}
+    try:
+        with open(job) as f:
+            spec = json.load(f)
+        record.update(spec)
+        record['results'] = run_algorithm(scripts, spec.get('algorithm'), spec['parameters'], feedback)
+        status = 'done'
+    except Exception:
+        record['error'] = traceback.format_exc()
+        status = 'failed'
+    record['seconds'] = time.time() - start
+    record['log'] = feedback.log
+    with open(base + '.' + status + '.tmp', 'w', encoding='utf8') as f:
+        json.dump(record, f, indent=1, default=str)
+    os.replace(base + '.' + status + '.tmp', base + '.' + status)
+    os.remove(job)
+    return os.path.basename(base) + ': ' + status
+
+
+def modification_times(folder, extension):
+    '''
+    [(modification time, file)] of the files with the extension, files removed in the meantime are left out
+    '''
+    files = []
+    for name in os.listdir(folder):
+        if name.endswith(extension):
+            try:
+                files.append((os.path.getmtime(os.path.join(folder, name)), os.path.join(folder, name)))
+            except OSError:
+                # claimed or finished by another worker while listing
+                continue
+    return files
+
+
+def reclaim_stale(folder, stale_after=STALE_AFTER):
+    '''
+    renames .running files which were not touched for stale_after seconds back to .json, returns them
+    '''
+    reclaimed = []
+    now = time.time()
+    for modified, running in modification_times(folder, '.running'):
+        if now - modified < stale_after:
+            continue
+        job = running[:-len('.running')] + '.json'
+        try:
+            os.rename(running, job)
+        except OSError:
+            # reclaimed by another worker or finished
+            continue
+        reclaimed.append(job)
+    return reclaimed
+
+
+def claim_jobs(folder, count):
+    '''
+    claims up to count waiting jobs (oldest first) by renaming them, returns the .running files
+    '''
+    if count <= 0:
+        return []
+    waiting = [job for modified, job in sorted(modification_times(folder, '.json'))]
+    claimed = []
+    for job in waiting[:count]:
+        running = job[:-len('.json')] + '.running'
+        try:
+            os.rename(job, running)
+        except OSError:
+            # taken by another worker
+            continue
+        claimed.append(running)
+    return claimed
+
+
+def touch(jobs):
+    '''
+    sets the modification time of the .running files of the jobs, so other workers do not take them over
+    '''
+    for job in jobs:
+        try:
+            os.utime(job)
+        except OSError:
+            # finished in the meantime
+            pass
+
+
+def serve(folder, workers=1, once=False, stale_after=STALE_AFTER):
+    '''
+    runs the jobs of a job directory with up to workers at the same time.
+    With once the worker stops when the directory has no more jobs.
+    '''
+    scripts = load_scripts()
+    # future -> .running file
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            for job in reclaim_stale(folder, stale_after):
+                print('reclaimed ' + os.path.basename(job), flush=True)
+            for job in claim_jobs(folder, workers - len(running)):
+                print('started ' + os.path.basename(job), flush=True)
+                running[executor.submit(run_job, scripts, job)] = job
+            if not running:
+                if once:
+                    return
+                time.sleep(POLL_INTERVAL)
+                continue
+            finished, not_finished = wait(list(running), timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                try:
+                    print(future.result(), flush=True)
+                except Exception:
+                    # the result file could not be written, or the job was taken over by another worker
+                    print(os.path.basename(job) + ': error\n' + traceback.format_exc(), flush=True)
+            touch(running.values())
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Headless worker running landslide jobs from a job directory')
+    parser.add_argument('jobs', help='job directory (<name>.json files)')
+    parser.add_argument('--workers', type=int, default=1, help='jobs running at the same time')
+    parser.add_argument('--once', action='store_true', help='stop when there are no more jobs')
+    parser.add_argument('--stale-after', type=float, default=STALE_AFTER, help='seconds after which a running job of a crashed worker is run again')
+    parser.add_argument('--prefix', default=None, help='QGIS prefix path (default: QGIS_PREFIX_PATH or /usr)')
+    options = parser.parse_args(arguments)
+
+    if not os.path.exists(options.jobs):
+        os.makedirs(options.jobs)
+    application = start_qgis(options.prefix)
+    try:
+        serve(options.jobs, options.workers, options.once, options.stale_after)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        application.exitQgis()
+
+
+if __name__ == '__main__':
+    main()